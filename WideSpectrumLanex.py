@@ -1,14 +1,18 @@
 #!/usr/bin/env python
 import numpy as np
-import matplotlib.pyplot as plt
-import matplotlib.gridspec as gridspec
-import mytools as mt
 import argparse
 from common_functions import *
-import shlex,subprocess
-import scipy as sp
+import functools
+import instrument
+import paramgraph
+import render
+import results_store
+import sweep
+import uncertainty
 
-plt.close('all')
+# Nothing below is computed at import time:
+# results are built on first use and memoized,
+# and figures are only made from main().
 
 # ====================================
 # Define FOV for GigE and Hamamatsu
@@ -54,258 +58,518 @@ px_length = 6.5e-6
 # ====================================
 # Simplified counts function
 # ====================================
+# Cached steps of counts(); a new sigma only
+# redoes the last multiply
+_counts_graph = paramgraph.optics_graph(mag_input=True)
+
 def plot_counts(N,m_Ham,sigma):
-    counts_cont = counts(
+    counts_cont = _counts_graph.set(
             sigma        = sigma,
             SE         = SE,
             N          = N,
-            mag        = m_Ham,
+            m          = m_Ham,
             px_length  = px_length,
             QE         = QE_Ham
-            )
+            )['counts']
 
     #  sigma_cont_nC_per_mm2 = sigma_cont*1e9/np.power(1e3,2)
     count_cont_frac = counts_cont/counts_max_Ham
     return count_cont_frac
 
 # ====================================
-# Beam density variable
+# Beam density for a well-fill fraction
 # ====================================
-# Needs to be in C/m^2
-sigma           = np.logspace(-16,-7,100)/(1e-6)
-sigma_C_per_mm2 = sigma * 1e-6
+# Fill levels relative to counts_max_Ham
+fill_sat    = 1.0
+fill_noise  = 40.0/np.power(2,16)
+fill_single = 1.0/np.power(2,16)
+
+def fill_sigma(fill,N,m_Ham,QE=QE_Ham,px_length=px_length,SE=SE):
+    return sigma_for_counts(
+            counts    = fill*counts_max_Ham,
+            SE        = SE,
+            N         = N,
+            mag       = m_Ham,
+            px_length = px_length,
+            QE        = QE
+            )
 
 # ====================================
-# m=-1 Analysis
+# Lens setups
 # ====================================
+# m=-1 Analysis
 #  f=24e-3
 N = np.sqrt(8.0)
 #  m_1 = -1.0
 m_1 = -0.62
-count_frac_m1 = plot_counts(N,m_1,sigma)
 
-# ====================================
 # 30cm FOV Analysis
-# ====================================
 #  f = 100e-3
 N_30cm = np.sqrt(2.0)
-count_frac_30cm = plot_counts(N_30cm,m_Ham,sigma)
 
-# ====================================
-# Create axis
-# ====================================
-fig = plt.figure()
-gs  = gridspec.GridSpec(1,1)
-ax  = fig.add_subplot(gs[0,0])
-
-# ====================================
-# Common plot config options
-# ====================================
-linewidth = 2
+sigma_low            = 5e-4*1e-12/1e-6
+sigma_low_C_per_mm2  = sigma_low*1e-6
 
 # ====================================
-# Plot lines
+# Input uncertainties
 # ====================================
-plt100        = ax.loglog(sigma_C_per_mm2,count_frac_m1,label='Current ELANEX (m={:0.3f})'.format(m_1),linewidth=linewidth)
-plt24         = ax.loglog(sigma_C_per_mm2,count_frac_30cm,label='Current WLANEX (m={:0.3f})'.format(m_Ham),linewidth=linewidth)
-plt_Ham_max   = ax.loglog(sigma_C_per_mm2,np.ones(sigma.size),label='Hamamatsu Saturation Level',linewidth=linewidth)
-plt_Ham_noise = ax.loglog(sigma_C_per_mm2,np.ones(sigma.size)*40/np.power(2,16),'orange',label='Hamamatsu Noise Level',linewidth=linewidth)
+# Spreads of the point estimates above, for
+# the uncertainty mode. SE within a factor
+# 1.5, QE and m_Ham to about 10% and 5%.
+SE_dist    = uncertainty.LogNormal(SE,1.5)
+QE_dist    = uncertainty.Normal(QE_Ham,0.06)
+m_Ham_dist = uncertainty.Normal(m_Ham,0.05*m_Ham)
 
 # ====================================
-# Calculate points of interest
+# Region configuration
 # ====================================
-counts_peak_m_1    = plot_counts(N,m_1,sigma_peak)
-counts_peak_30cm   = plot_counts(N_30cm,m_Ham,sigma_peak)
-sigma_low            = 5e-4*1e-12/1e-6
-sigma_low_C_per_mm2  = sigma_low*1e-6
-counts_low         = plot_counts(N,m_1,sigma_low)
-counts_low_cam     = counts_low*np.power(2,16)
+res = 1000
+N_range   = (np.sqrt(2),4)
+FOV_range = (5e-2,40e-2)
+N_list    = np.array([np.sqrt(2),1.8,2,np.sqrt(8)])
 
-sigma_guess = 1e-11/1e-6
-sat_opt = sp.optimize.minimize(lambda x:np.power(plot_counts(N=N_30cm,m_Ham=m_Ham,sigma=x*sigma_guess)-1.0,2),x0=1)
-sigma_sat = sigma_guess*sat_opt.x[0]
-sigma_sat_C_per_mm2 = sigma_sat*1e-6
-counts_sat = plot_counts(N=N_30cm,m_Ham=m_Ham,sigma=sigma_sat)
+def performance(N,FOV):
+    m = mag(h_img_Ham,FOV)
+    return ap_fr_mag(N,m) * np.power(px_length/m,2)
 
 # ====================================
-# Add points of interest
+# DOF configuration
 # ====================================
-plt_m1     = ax.loglog(sigma_peak_C_per_mm2,counts_peak_m_1,'bo',label='_Peak density, 1:1 mag')
-plt_30cm   = ax.loglog(sigma_peak_C_per_mm2,counts_peak_30cm,'go',label='_Peak density, 30-cm FOV')
-plt_single = ax.loglog(sigma_low_C_per_mm2,counts_low,'bo',label='_Single count density')
-plt_sat    = ax.loglog(sigma_sat_C_per_mm2,counts_sat,'ro',label='_Saturated')
+c = px_length
+N_range_dof = (1.4,4)
+f_range_dof = (20e-3,50e-3)
+res_dof     = 100
 
 # ====================================
-# Annotate points of interest
+# Lazy results
 # ====================================
-ax.annotate(
-        s          = 'Peak density,\n30-cm FOV',
-        xy         = (sigma_peak_C_per_mm2,counts_peak_30cm),
-        xytext     = (-100,-10),
-        textcoords = 'offset points', ha = 'center', va = 'center',
-        bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
-        arrowprops = dict(relpos=(1.05,0.5),arrowstyle='-',connectionstyle='arc3,rad=0.15',mutation_scale = 20,color='k')
-        )
-
-ax.annotate(
-        s          = 'Peak density,\n1:1 mag.',
-        xy         = (sigma_peak_C_per_mm2,counts_peak_m_1),
-        xytext     = (-45,-80),
-        textcoords = 'offset points', ha = 'center', va = 'center',
-        bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
-        arrowprops = dict(relpos=(0.5,1.2),arrowstyle='-',connectionstyle='arc3,rad=0.15',mutation_scale = 20,color='k')
-        )
-
-ax.annotate(
-        s          = r'Saturation {:0.2f} pC/mm$^2$'.format(sigma_sat_C_per_mm2*1e12),
-        xy         = (sigma_sat_C_per_mm2,counts_sat),
-        xytext     = (-100,30),
-        textcoords = 'offset points', ha = 'center', va = 'center',
-        bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
-        arrowprops = dict(relpos=(1.03,0.5),arrowstyle='-',connectionstyle='arc3,rad=-0.15',mutation_scale = 20,color='k')
-        )
-
-ax.annotate(
-        s          = r'$\sigma=$5$\times$10$^{{-4}}$ pC/mm$^2$ = {:0.2f} counts'.format(counts_low_cam),
-        xy         = (sigma_low_C_per_mm2,counts_low),
-        xytext     = (40,0),
-        textcoords = 'offset points', ha = 'left', va = 'top',
-        bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
-        arrowprops = dict(relpos=(0,0.5),arrowstyle='-',connectionstyle='arc3,rad=-0.15',mutation_scale = 20,color='k')
-        )
+# With results_dir set to a directory (or
+# --results), grids are kept there keyed on
+# their parameters and opened memory-mapped
+# instead of recomputed.
+results_dir = None
 
+# Monte Carlo samples for uncertainty bands
+# (or --uncertainty); None for no bands
+uncertainty_samples = None
 
-# ====================================
-# Format plot
-# ====================================
-ax.grid(which='Both',color='0.7',linestyle='-')
-ax.set_axisbelow(True)
-ax.legend(loc=0,framealpha=0.75)
+def results():
+    return None if results_dir is None else results_store.ResultsStore(results_dir)
 
-mt.addlabel(axes=ax,xlabel='Beam density [C/mm^2]',ylabel='Fractional Well Fill Level',toplabel='Hamamatsu Fraction of Well Depth in a Single Pixel')
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.count_curves')
+def count_curves():
+    params = dict(
+            sigma_logspace = (-16,-7,100),
+            N              = N,
+            m_1            = m_1,
+            N_30cm         = N_30cm,
+            m_Ham          = m_Ham,
+            SE             = SE,
+            QE             = QE_Ham,
+            px_length      = px_length,
+            counts_max     = counts_max_Ham
+            )
+    return results_store.cached(results(),'count_curves',params,_count_curves)
+
+def _count_curves():
+    # Needs to be in C/m^2
+    sigma           = np.logspace(-16,-7,100)/(1e-6)
+    sigma_C_per_mm2 = sigma * 1e-6
+    return dict(
+            sigma           = sigma,
+            sigma_C_per_mm2 = sigma_C_per_mm2,
+            count_frac_m1   = plot_counts(N,m_1,sigma),
+            count_frac_30cm = plot_counts(N_30cm,m_Ham,sigma)
+            )
 
-ax2=ax.twinx()
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.points_of_interest')
+def points_of_interest():
+    counts_low = plot_counts(N,m_1,sigma_low)
+    sigma_sat  = fill_sigma(fill_sat,N=N_30cm,m_Ham=m_Ham)
+    return dict(
+            counts_peak_m_1     = plot_counts(N,m_1,sigma_peak),
+            counts_peak_30cm    = plot_counts(N_30cm,m_Ham,sigma_peak),
+            counts_low          = counts_low,
+            counts_low_cam      = counts_low*np.power(2,16),
+            sigma_sat           = sigma_sat,
+            sigma_sat_C_per_mm2 = sigma_sat*1e-6,
+            counts_sat          = plot_counts(N=N_30cm,m_Ham=m_Ham,sigma=sigma_sat)
+            )
 
-ylims = np.array([1e-6,1e5])
-ax.set_ylim(ylims)
-ax2.set_ylim(ylims*np.power(2,16))
-ax2.set_yscale('log')
-mt.addlabel(axes=ax2,ylabel='Counts')
+# With uncertainty_samples set, the points
+# of interest also get 95% bands from Monte
+# Carlo over SE_dist, QE_dist and
+# m_Ham_dist; None otherwise.
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.uncertainty_bands')
+def uncertainty_bands():
+    if uncertainty_samples is None:
+        return None
+    n = int(uncertainty_samples)
+
+    inputs = dict(SE=SE_dist,N=N_30cm,mag=m_Ham_dist,px_length=px_length,QE=QE_dist,counts_max=counts_max_Ham)
+    hists  = uncertainty.propagate(inputs,
+            fills  = dict(counts_peak_30cm=sigma_peak),
+            levels = dict(sigma_sat=fill_sat,sigma_noise=fill_noise),
+            n=n,seed=0)
+    inputs.update(N=N,mag=m_1)
+    hists.update(uncertainty.propagate(inputs,
+            fills = dict(counts_peak_m_1=sigma_peak,counts_low=sigma_low),
+            n=n,seed=1))
+    return dict((name,uncertainty.band(hist)) for name,hist in hists.items())
+
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.region')
+def region():
+    params = dict(
+            h_img     = h_img_Ham,
+            px_length = px_length,
+            N_range   = N_range,
+            FOV_range = FOV_range,
+            res       = res
+            )
+    return results_store.cached(results(),'region',params,_region)
+
+def _region():
+    N_vector      = np.linspace(N_range[0],N_range[1],res)
+    FOV_vector    = np.linspace(FOV_range[0],FOV_range[1],res)
+    FOV_vector_cm = FOV_vector * 1e2
+
+    # Rows FOV, columns N, evaluated in chunks
+    region = sweep.Sweep(performance,[('FOV',FOV_vector),('N',N_vector)])
+    rel_max, rel_grid = region.reduce(sweep.Max(),sweep.Project(['FOV','N']))
+
+    norm_factor = rel_max.value
+    return dict(
+            N_vector      = N_vector,
+            FOV_vector    = FOV_vector,
+            FOV_vector_cm = FOV_vector_cm,
+            norm_factor   = norm_factor,
+            rel           = rel_grid.out/norm_factor
+            )
 
-gs.tight_layout(fig)
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.lineouts')
+def lineouts():
+    reg = region()
+    rel_list = performance(N=N_list,FOV=30e-2)
+    return dict(
+            rel_f28  = performance(N=np.sqrt(8),FOV=reg['FOV_vector_cm']),
+            rel_30cm = performance(N=reg['N_vector'],FOV=30e-2),
+            rel_list = rel_list
+            )
 
-# ====================================
-# Calculate region
-# ====================================
-res = 1000
-N_vector = np.linspace(np.sqrt(2),4,res)
-FOV_vector = np.linspace(5e-2,40e-2,res)
-FOV_vector_cm = FOV_vector * 1e2
+@functools.lru_cache(maxsize=None)
+@instrument.timed('WideSpectrumLanex.dof')
+def dof():
+    params = dict(
+            c           = c,
+            m           = m_Ham,
+            N_range_dof = N_range_dof,
+            f_range_dof = f_range_dof,
+            res_dof     = res_dof
+            )
+    return results_store.cached(results(),'dof',params,_dof)
+
+def _dof():
+    N_vector = np.linspace(N_range_dof[0],N_range_dof[1],res_dof)
+    f_vector = np.linspace(f_range_dof[0],f_range_dof[1],res_dof)
+
+    # Rows f, columns N
+    dof_sweep = sweep.Sweep(DOF,[('f',f_vector),('N',N_vector)],fixed=dict(c=c,m=m_Ham))
+    dof_grid, = dof_sweep.reduce(sweep.Project(['f','N']))
+    return dict(
+            N_vector_dof = N_vector,
+            f_vector     = f_vector,
+            dof_vector   = dof_grid.out
+            )
 
-NN, FOV = np.meshgrid(N_vector,FOV_vector)
-FOV_cm = FOV*1e2
+# Module attributes served from the lazy results,
+# e.g. WideSpectrumLanex.rel or .sigma_sat
+_lazy_names = {
+        'sigma'               : count_curves,
+        'sigma_C_per_mm2'     : count_curves,
+        'count_frac_m1'       : count_curves,
+        'count_frac_30cm'     : count_curves,
+        'counts_peak_m_1'     : points_of_interest,
+        'counts_peak_30cm'    : points_of_interest,
+        'counts_low'          : points_of_interest,
+        'counts_low_cam'      : points_of_interest,
+        'sigma_sat'           : points_of_interest,
+        'sigma_sat_C_per_mm2' : points_of_interest,
+        'counts_sat'          : points_of_interest,
+        'N_vector'            : region,
+        'FOV_vector'          : region,
+        'FOV_vector_cm'       : region,
+        'norm_factor'         : region,
+        'rel'                 : region,
+        'rel_f28'             : lineouts,
+        'rel_30cm'            : lineouts,
+        'rel_list'            : lineouts,
+        'f_vector'            : dof,
+        'dof_vector'          : dof
+        }
+
+def __getattr__(name):
+    try:
+        return _lazy_names[name]()[name]
+    except KeyError:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(__name__,name))
+
+# ====================================
+# Well-fill figure
+# ====================================
+@instrument.timed('WideSpectrumLanex.figure_counts')
+def figure_counts():
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    import mytools as mt
+
+    curves = count_curves()
+    poi    = points_of_interest()
+    sigma           = curves['sigma']
+    sigma_C_per_mm2 = curves['sigma_C_per_mm2']
+
+    # ====================================
+    # Create axis
+    # ====================================
+    fig = plt.figure()
+    gs  = gridspec.GridSpec(1,1)
+    ax  = fig.add_subplot(gs[0,0])
+
+    # ====================================
+    # Common plot config options
+    # ====================================
+    linewidth = 2
+
+    # ====================================
+    # Plot lines
+    # ====================================
+    plt100        = ax.loglog(sigma_C_per_mm2,curves['count_frac_m1'],label='Current ELANEX (m={:0.3f})'.format(m_1),linewidth=linewidth)
+    plt24         = ax.loglog(sigma_C_per_mm2,curves['count_frac_30cm'],label='Current WLANEX (m={:0.3f})'.format(m_Ham),linewidth=linewidth)
+    plt_Ham_max   = ax.loglog(sigma_C_per_mm2,np.ones(sigma.size),label='Hamamatsu Saturation Level',linewidth=linewidth)
+    plt_Ham_noise = ax.loglog(sigma_C_per_mm2,np.ones(sigma.size)*fill_noise,'orange',label='Hamamatsu Noise Level',linewidth=linewidth)
+
+    # ====================================
+    # Add points of interest
+    # ====================================
+    plt_m1     = ax.loglog(sigma_peak_C_per_mm2,poi['counts_peak_m_1'],'bo',label='_Peak density, 1:1 mag')
+    plt_30cm   = ax.loglog(sigma_peak_C_per_mm2,poi['counts_peak_30cm'],'go',label='_Peak density, 30-cm FOV')
+    plt_single = ax.loglog(sigma_low_C_per_mm2,poi['counts_low'],'bo',label='_Single count density')
+    plt_sat    = ax.loglog(poi['sigma_sat_C_per_mm2'],poi['counts_sat'],'ro',label='_Saturated')
+
+    # ====================================
+    # Confidence bands
+    # ====================================
+    bands = uncertainty_bands()
+    sat_text   = ''
+    low_text   = ''
+    if bands is not None:
+        def yerr(name,value):
+            return [[value-bands[name]['low']],[bands[name]['high']-value]]
+
+        ax.errorbar(sigma_peak_C_per_mm2,poi['counts_peak_m_1'],yerr=yerr('counts_peak_m_1',poi['counts_peak_m_1']),fmt='none',ecolor='b',capsize=3)
+        ax.errorbar(sigma_peak_C_per_mm2,poi['counts_peak_30cm'],yerr=yerr('counts_peak_30cm',poi['counts_peak_30cm']),fmt='none',ecolor='g',capsize=3)
+        ax.errorbar(sigma_low_C_per_mm2,poi['counts_low'],yerr=yerr('counts_low',poi['counts_low']),fmt='none',ecolor='b',capsize=3)
+        ax.axvspan(bands['sigma_sat']['low']*1e-6,bands['sigma_sat']['high']*1e-6,color='r',alpha=0.15,label='Saturation density, 95%')
+        ax.axvspan(bands['sigma_noise']['low']*1e-6,bands['sigma_noise']['high']*1e-6,color='orange',alpha=0.15,label='Noise floor density, 95%')
+
+        sat_text = '\n95%: {:0.2f}-{:0.2f}'.format(bands['sigma_sat']['low']*1e-6*1e12,bands['sigma_sat']['high']*1e-6*1e12)
+        low_text = '\n95%: {:0.2f}-{:0.2f} counts'.format(bands['counts_low']['low']*np.power(2,16),bands['counts_low']['high']*np.power(2,16))
+
+    # ====================================
+    # Annotate points of interest
+    # ====================================
+    ax.annotate(
+            s          = 'Peak density,\n30-cm FOV',
+            xy         = (sigma_peak_C_per_mm2,poi['counts_peak_30cm']),
+            xytext     = (-100,-10),
+            textcoords = 'offset points', ha = 'center', va = 'center',
+            bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
+            arrowprops = dict(relpos=(1.05,0.5),arrowstyle='-',connectionstyle='arc3,rad=0.15',mutation_scale = 20,color='k')
+            )
 
-def performance(N,FOV):
-    m = mag(h_img_Ham,FOV)
-    return ap_fr_mag(N,m) * np.power(px_length/m,2)
+    ax.annotate(
+            s          = 'Peak density,\n1:1 mag.',
+            xy         = (sigma_peak_C_per_mm2,poi['counts_peak_m_1']),
+            xytext     = (-45,-80),
+            textcoords = 'offset points', ha = 'center', va = 'center',
+            bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
+            arrowprops = dict(relpos=(0.5,1.2),arrowstyle='-',connectionstyle='arc3,rad=0.15',mutation_scale = 20,color='k')
+            )
+
+    ax.annotate(
+            s          = r'Saturation {:0.2f} pC/mm$^2$'.format(poi['sigma_sat_C_per_mm2']*1e12)+sat_text,
+            xy         = (poi['sigma_sat_C_per_mm2'],poi['counts_sat']),
+            xytext     = (-100,30),
+            textcoords = 'offset points', ha = 'center', va = 'center',
+            bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
+            arrowprops = dict(relpos=(1.03,0.5),arrowstyle='-',connectionstyle='arc3,rad=-0.15',mutation_scale = 20,color='k')
+            )
 
-rel = performance(NN,FOV)
+    ax.annotate(
+            s          = r'$\sigma=$5$\times$10$^{{-4}}$ pC/mm$^2$ = {:0.2f} counts'.format(poi['counts_low_cam'])+low_text,
+            xy         = (sigma_low_C_per_mm2,poi['counts_low']),
+            xytext     = (40,0),
+            textcoords = 'offset points', ha = 'left', va = 'top',
+            bbox       = dict(boxstyle='round,pad=0.5',fc='white',alpha=0.75),
+            arrowprops = dict(relpos=(0,0.5),arrowstyle='-',connectionstyle='arc3,rad=-0.15',mutation_scale = 20,color='k')
+            )
 
-norm_factor = np.max(rel)
-rel = rel/norm_factor
 
-#  fig2 = plt.figure(figsize=(16,12))
-fig2 = plt.figure()
+    # ====================================
+    # Format plot
+    # ====================================
+    ax.grid(which='Both',color='0.7',linestyle='-')
+    ax.set_axisbelow(True)
+    ax.legend(loc=0,framealpha=0.75)
 
-gs   = gridspec.GridSpec(2,2)
-ax01 = fig2.add_subplot(gs[0,1])
+    mt.addlabel(axes=ax,xlabel='Beam density [C/mm^2]',ylabel='Fractional Well Fill Level',toplabel='Hamamatsu Fraction of Well Depth in a Single Pixel')
 
-plt01 = ax01.pcolormesh(NN,FOV_cm,rel,cmap='Blues_r')
-ax01.axhline(30,linestyle='--',color='r',linewidth=linewidth)
-ax01.axvline(np.sqrt(8),linestyle='--',color='r',linewidth=linewidth)
+    ax2=ax.twinx()
 
-ylims = [FOV_vector_cm[0],FOV_vector_cm[-1]]
-xlims = [N_vector[0],N_vector[-1]]
-ax01.set_ylim(ylims)
-ax01.set_xlim(xlims)
-#  mt.addlabel(axes=ax01,xlabel='F-number',
-#          ylabel='Field of View'
-#          )
-cb=fig2.colorbar(plt01)
-mt.addlabel(cb=cb,clabel='Normalized Counts')
+    ylims = np.array([1e-6,1e5])
+    ax.set_ylim(ylims)
+    ax2.set_ylim(ylims*np.power(2,16))
+    ax2.set_yscale('log')
+    mt.addlabel(axes=ax2,ylabel='Counts')
 
-linewidth=1
+    gs.tight_layout(fig)
+    return fig
 
 # ====================================
-# Lineout at N=2.8
+# Light performance figure
 # ====================================
-ax00 = fig2.add_subplot(gs[0,0])
+@instrument.timed('WideSpectrumLanex.figure_performance')
+def figure_performance():
+    import matplotlib.pyplot as plt
+    import matplotlib.gridspec as gridspec
+    import mytools as mt
 
-rel_f28 = performance(N=np.sqrt(8),FOV=FOV_vector_cm)
-ax00.plot(rel_f28/norm_factor,FOV_cm,'b',linewidth=linewidth)
-mt.addlabel(axes=ax00,xlabel='Normalized Counts',ylabel='Field of View [cm]')
-ax00.set_xlim((0,0.3))
-ax00.invert_xaxis()
-#  ax00.grid(which='Both',color='0.7',linestyle='-')
-#  ax00.set_axisbelow(True)
+    reg  = region()
+    line = lineouts()
+    N_vector      = reg['N_vector']
+    FOV_vector_cm = reg['FOV_vector_cm']
+    norm_factor   = reg['norm_factor']
 
-# ====================================
-# Lineout at FOV=30 cm
-# ====================================
-ax11 = fig2.add_subplot(gs[1,1])
+    linewidth = 2
 
-rel_30cm = performance(N=N_vector,FOV=30e-2)
-N_list = np.array([np.sqrt(2),1.8,2,np.sqrt(8)])
-rel_list = performance(N=N_list,FOV=30e-2)
+    #  fig2 = plt.figure(figsize=(16,12))
+    fig2 = plt.figure()
 
-ax11.plot(N_vector,rel_30cm/norm_factor,'b',N_list,rel_list/norm_factor,'bo',linewidth=linewidth)
-ax11.set_xlim(xlims)
-mt.addlabel(axes=ax11,ylabel='Normalized Counts',xlabel='Aperture f-number')
+    gs   = gridspec.GridSpec(2,2)
+    ax01 = fig2.add_subplot(gs[0,1])
 
-layout_rect = [0,0,1,0.95]
-fig2.suptitle('Normalized Light Performance due to Magnification, F-number',fontsize=14,weight='bold')
-gs.tight_layout(fig2,rect=layout_rect)
+    # Dense mesh: rasterized, so vector outputs
+    # embed one image instead of res^2 patches
+    plt01 = ax01.pcolormesh(N_vector,FOV_vector_cm,reg['rel'],cmap='Blues_r',rasterized=True)
+    ax01.axhline(30,linestyle='--',color='r',linewidth=linewidth)
+    ax01.axvline(np.sqrt(8),linestyle='--',color='r',linewidth=linewidth)
 
-rel_list = rel_list/np.max(rel_list)
+    ylims = [FOV_vector_cm[0],FOV_vector_cm[-1]]
+    xlims = [N_vector[0],N_vector[-1]]
+    ax01.set_ylim(ylims)
+    ax01.set_xlim(xlims)
+    #  mt.addlabel(axes=ax01,xlabel='F-number',
+    #          ylabel='Field of View'
+    #          )
+    cb=fig2.colorbar(plt01)
+    mt.addlabel(cb=cb,clabel='Normalized Counts')
 
-# ====================================
-# DOF
-# ====================================
-def hyperfocal(f,N,c):
-    return np.power(f,2)/(N*c)+f
+    linewidth=1
+
+    # ====================================
+    # Lineout at N=2.8
+    # ====================================
+    ax00 = fig2.add_subplot(gs[0,0])
 
-def DOF(f,N,c,m):
-    return 2.0*N*c*(m+1) / (np.power(m,2)-np.power(N*c/f,2))
+    ax00.plot(line['rel_f28']/norm_factor,FOV_vector_cm,'b',linewidth=linewidth)
+    mt.addlabel(axes=ax00,xlabel='Normalized Counts',ylabel='Field of View [cm]')
+    ax00.set_xlim((0,0.3))
+    ax00.invert_xaxis()
+    #  ax00.grid(which='Both',color='0.7',linestyle='-')
+    #  ax00.set_axisbelow(True)
 
-c=px_length
-N_vector = np.linspace(1.4,4,100)
-f_vector = np.linspace(20e-3,50e-3,100)
+    # ====================================
+    # Lineout at FOV=30 cm
+    # ====================================
+    ax11 = fig2.add_subplot(gs[1,1])
 
-NN, ff = np.meshgrid(N_vector,f_vector)
+    ax11.plot(N_vector,line['rel_30cm']/norm_factor,'b',N_list,line['rel_list']/norm_factor,'bo',linewidth=linewidth)
+    ax11.set_xlim(xlims)
+    mt.addlabel(axes=ax11,ylabel='Normalized Counts',xlabel='Aperture f-number')
 
-dof_vector = DOF(ff,NN,c,m_Ham)
+    layout_rect = [0,0,1,0.95]
+    fig2.suptitle('Normalized Light Performance due to Magnification, F-number',fontsize=14,weight='bold')
+    gs.tight_layout(fig2,rect=layout_rect)
+    return fig2
 
 # fig3 = plt.figure()
 # gs = gridspec.GridSpec(1,1)
 # axD = fig3.add_subplot(gs[0,0])
-# 
-# plt1 = axD.pcolormesh(NN,ff,dof_vector,cmap='Blues_r')
+#
+# plt1 = axD.pcolormesh(N_vector,f_vector,dof_vector,cmap='Blues_r')
 
-if __name__ == '__main__':
+# ====================================
+# Figures for batch rendering
+# ====================================
+FIGURES = [
+        ('figure_counts','Hamamatsu_Fraction.pdf'),
+        ('figure_performance','Lens_Light_Performance.tiff')
+        ]
+
+def main():
     parser=argparse.ArgumentParser(description='Creates a plot of object length vs. focal length.')
     parser.add_argument('-v','--verbose',action='store_true',
             help='enable verbose mode')
     parser.add_argument('-s','--save',action='store_true',
             help='save file')
+    parser.add_argument('-o','--outdir',default='figs',
+            help='directory for saved figures')
+    parser.add_argument('-b','--batch',action='store_true',
+            help='do not show figures')
+    parser.add_argument('-r','--results',
+            help='directory to keep computed grids in')
+    parser.add_argument('-u','--uncertainty',type=float,
+            help='Monte Carlo samples for confidence bands, e.g. 1e6')
+    parser.add_argument('-p','--profile',
+            help='write a stage timing report (JSON) to this file')
+    parser.add_argument('--trace',
+            help='with --profile, also write a Chrome trace to this file')
 
     arg=parser.parse_args()
 
+    global results_dir,uncertainty_samples
+    if arg.results is not None:
+        results_dir=arg.results
+
+    if arg.uncertainty is not None:
+        uncertainty_samples=int(arg.uncertainty)
+
+    if arg.profile is not None:
+        import mytools as mt
+        instrument.enable(memory=True,logger=mt.mylogger(filename='WideSpectrumLanex'))
+
     if arg.save:
-        fig.savefig('figs/Hamamatsu_Fraction.pdf')
-        fig2.savefig('figs/Lens_Light_Performance.tiff')
-        command = 'open figs'
-        args = shlex.split(command)
-        subprocess.call(args)
-
-    
-    plt.show()
+        with instrument.stage('WideSpectrumLanex.render'):
+            render.render_all(['WideSpectrumLanex'],outdir=arg.outdir,
+                    settings=dict(results_dir=results_dir,uncertainty_samples=uncertainty_samples))
+
+    if not arg.batch:
+        import matplotlib.pyplot as plt
+
+        plt.close('all')
+        fig  = figure_counts()
+        fig2 = figure_performance()
+
+    if arg.profile is not None:
+        instrument.log_summary()
+        instrument.write(arg.profile,trace_path=arg.trace)
+
+    if not arg.batch:
+        plt.show()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import logging
+import numpy as np
+import elegant_pool
+import instrument
+import twiss_batch
+
+logger = logging.getLogger(__name__)
+
+
+# ====================================
+# Adaptive 1D sampling
+# ====================================
+# Samples *evaluate* on [x_min, x_max],
+# refining only where the curves are not yet
+# resolved. evaluate(x) takes an array of
+# new points and returns a dict of arrays
+# (e.g. sigx, sigy, rho); each round's new
+# points go out in one call, so a batch
+# evaluator (twiss_batch, elegant_pool) runs
+# them together.
+#
+# Curves are compared in log space, so *tol*
+# is a relative error. An interval is split
+# at its midpoint when either
+#   - the curvature estimate h^2/8 |f''| of
+#     linear interpolation across it, or
+#   - the interpolation error measured at the
+#     midpoint that created it, scaled by 1/4
+#     for the halved width,
+# exceeds *tol* for any curve. Sampling
+# stops when no interval does, when
+# *max_points* is reached, or when intervals
+# are narrower than *min_dx*.
+def _second_derivative(x, F):
+    # Three point formula on a nonuniform grid,
+    # edges copied from their neighbours
+    d2 = np.empty_like(F)
+    if x.size < 3:
+        d2[:] = 0
+        return d2
+    h1 = x[1:-1] - x[:-2]
+    h2 = x[2:] - x[1:-1]
+    d2[:, 1:-1] = 2*(h1*F[:, 2:] - (h1+h2)*F[:, 1:-1] + h2*F[:, :-2])/(h1*h2*(h1+h2))
+    d2[:, 0]    = d2[:, 1]
+    d2[:, -1]   = d2[:, -2]
+    return d2
+
+
+def _log_values(values, names):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.log(np.abs(np.array([values[name] for name in names], dtype=np.float64)))
+
+
+def interval_error(x, F, resid):
+    h     = np.diff(x)
+    d2    = np.abs(_second_derivative(x, F))
+    curv  = np.fmax(d2[:, :-1], d2[:, 1:])*h*h/8
+    # NaN (failed points) never asks for refinement
+    curv  = np.nanmax(np.where(np.isnan(curv), -np.inf, curv), axis=0) if F.size else np.zeros(h.size)
+    return np.fmax(curv, resid)
+
+
+def sample(evaluate, x_min, x_max, tol=1e-2, n_initial=33, max_points=501, min_dx=None, names=None):
+    x      = np.linspace(x_min, x_max, n_initial)
+    values = dict((k, np.asarray(v, dtype=np.float64)) for k, v in evaluate(x).items())
+    names  = sorted(values) if names is None else list(names)
+    resid  = np.zeros(x.size-1)
+    rounds = 0
+    if min_dx is None:
+        min_dx = (x_max - x_min)*1e-6
+
+    while x.size < max_points:
+        F   = _log_values(values, names)
+        err = interval_error(x, F, resid)
+        err[np.diff(x) <= min_dx] = 0
+        refine = np.nonzero(err > tol)[0]
+        if refine.size == 0:
+            break
+
+        # Worst intervals first when the budget
+        # does not cover them all
+        budget = max_points - x.size
+        if refine.size > budget:
+            refine = refine[np.argsort(err[refine])[::-1][:budget]]
+            refine.sort()
+
+        rounds += 1
+        x_new = 0.5*(x[refine] + x[refine+1])
+        with instrument.stage('adaptive.round', round=rounds, n=x_new.size):
+            new = evaluate(x_new)
+        logger.debug('Round {}: {} new points, worst error {:.3g}'.format(rounds, x_new.size, err.max()))
+
+        # Midpoint error of the old linear interpolation
+        F_new  = _log_values(new, names)
+        F_mid  = 0.5*(F[:, refine] + F[:, refine+1])
+        miss   = np.abs(F_new - F_mid)
+        r_mid  = np.nanmax(np.where(np.isnan(miss), -np.inf, miss), axis=0)/4
+
+        # Merge the midpoints into the sorted grid
+        order  = np.argsort(np.concatenate([x, x_new]), kind='mergesort')
+        x      = np.concatenate([x, x_new])[order]
+        for name in values:
+            values[name] = np.concatenate([values[name], np.asarray(new[name], dtype=np.float64)])[order]
+
+        resid_old = resid.copy()
+        resid_old[refine] = r_mid
+        # Each refined interval becomes two halves
+        # sharing the midpoint estimate
+        resid = np.repeat(resid_old, np.where(np.isin(np.arange(resid_old.size), refine), 2, 1))
+
+    instrument.count('adaptive.evaluations', x.size)
+    return x, values, dict(rounds=rounds, n_points=x.size, tol=tol)
+
+
+# Linear interpolation in log space, e.g. to
+# compare with a dense uniform scan
+def interpolate(x, values, x_new):
+    out = {}
+    for name, val in values.items():
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out[name] = np.exp(np.interp(x_new, x, np.log(val)))
+    return out
+
+
+# ====================================
+# Evaluators for the energy scan
+# ====================================
+# *to_gamma* converts the sampled energy
+# (e.g. sltr.GeV2gamma for GeV).
+def twiss_evaluator(beamline, to_gamma, edges=False):
+    table  = twiss_batch.element_table(beamline.elements)
+    gamma0 = beamline.gamma
+
+    def evaluate(energy):
+        sigx, sigy, rho = twiss_batch.beam_end(table, gamma0, to_gamma(energy), beamline.beam_x, beamline.beam_y, edges=edges)
+        return dict(sigx=sigx, sigy=sigy, rho=rho)
+    return evaluate
+
+
+def elegant_evaluator(beamline, to_gamma, **run_scan_kwargs):
+    def evaluate(energy):
+        sigx, sigy = elegant_pool.run_scan(beamline=beamline, energy_list_gamma=to_gamma(energy), **run_scan_kwargs)
+        return dict(sigx=sigx, sigy=sigy, rho=1.0/(sigx*sigy))
+    return evaluate
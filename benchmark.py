@@ -0,0 +1,356 @@
+#!/usr/bin/env python
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import numpy as np
+import bunch_stats
+import elegant_pool
+import lattice
+import sdds_reader
+import sweep
+import twiss_batch
+import WideSpectrumLanex as wsl
+from common_functions import *
+
+# ====================================
+# Benchmarks for the hot paths
+# ====================================
+# Every case is a function of one size
+# parameter returning (n_items, unit); it is
+# timed best-of-*repeat*, then run once more
+# under tracemalloc for the peak memory
+# (worker processes' peak RSS for cases in
+# WORKER_CASES, which tracemalloc cannot
+# see).
+# Results go to a JSON file and can be
+# compared against a stored baseline.
+
+Twiss = collections.namedtuple('Twiss', ['beta', 'alpha', 'emit'])
+
+
+# ====================================
+# Dump line, as set up in my.py
+# ====================================
+# Built straight into a twiss_batch table
+# so the scan can be timed without slactrac.
+def dumpline():
+    gamma0 = 39824.0
+    emit   = 100e-6/gamma0
+
+    table = np.zeros(11, dtype=twiss_batch.element_dtype)
+    elements = [
+            (twiss_batch.DRIFT, 2.65, 0),
+            (twiss_batch.QUAD, 4.61E-01, -8.411e-1),
+            (twiss_batch.DRIFT, 1.729, 0),
+            (twiss_batch.DRIFT, 0.26, 0),
+            (twiss_batch.QUAD, 1.0, 3.647850372034315e-01),
+            (twiss_batch.DRIFT, 4.00, 0),
+            (twiss_batch.QUAD, 1.0, -1.223335345241937e-01),
+            (twiss_batch.DRIFT, 0.7428, 0),
+            (twiss_batch.BEND, 9.779E-01, 0),
+            (twiss_batch.DRIFT, 8.795, 0),
+            (twiss_batch.DRIFT, 0.06, 0)
+            ]
+    for rec, (kind, length, K1) in zip(table, elements):
+        rec['type']   = kind
+        rec['length'] = length
+        rec['K1']     = K1
+    bend = table[8]
+    bend['angle'], bend['rotate'] = 6.0E-03, 90
+    bend['EDGE1'], bend['E1'] = 1, 3.0E-3
+    bend['EDGE2'], bend['E2'] = 1, 3.0E-3
+    bend['HGAP'], bend['FINT'] = 3E-02, 0.5
+
+    return table, gamma0, Twiss(0.5, 0, emit), Twiss(5.0, 0, emit)
+
+
+# ====================================
+# Stub elegant
+# ====================================
+# Writes a Gaussian bunch with the linear
+# spot sizes as a binary SDDS file, then
+# reduces it like elegant_pool.elegant_job.
+def stub_elegant_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    table, gamma0, beam_x, beam_y = beamline
+    sigx, sigy, _ = twiss_batch.beam_end(table, gamma0, energy_gamma, beam_x, beam_y)
+
+    rng = np.random.RandomState(int(energy_gamma) % 2**32)
+    n   = int(n_particles)
+    particle_file = os.path.join(workdir, 'out.out')
+    sdds_reader.write_binary(particle_file, collections.OrderedDict([
+        ('x' , rng.normal(0, sigx, n)),
+        ('xp', rng.normal(0, 1e-5, n)),
+        ('y' , rng.normal(0, sigy, n)),
+        ('yp', rng.normal(0, 1e-5, n)),
+        ('t' , np.zeros(n)),
+        ('p' , np.full(n, energy_gamma)*(1+sigma_dp*rng.normal(0, 1, n)))
+        ]))
+
+    moments = bunch_stats.bunch_stats(particle_file)
+    return dict(
+            sigx          = moments.std('x'),
+            sigy          = moments.std('y'),
+            particle_file = particle_file
+            )
+
+
+# ====================================
+# Cases
+# ====================================
+def case_counts(n):
+    sigma = np.logspace(-16, -7, n)/1e-6
+    counts(sigma=sigma, SE=wsl.SE, N=wsl.N, mag=wsl.m_Ham, px_length=wsl.px_length, QE=wsl.QE_Ham)
+    return n, 'evals'
+
+
+def case_performance(n):
+    N   = np.linspace(wsl.N_range[0], wsl.N_range[1], n)
+    FOV = np.linspace(wsl.FOV_range[0], wsl.FOV_range[1], n)
+    wsl.performance(N, FOV)
+    return n, 'evals'
+
+
+def case_dof(n):
+    f = np.linspace(wsl.f_range_dof[0], wsl.f_range_dof[1], n)
+    N = np.linspace(wsl.N_range_dof[0], wsl.N_range_dof[1], n)
+    DOF(f=f, N=N, c=wsl.c, m=wsl.m_Ham)
+    return n, 'evals'
+
+
+# Same reduction as WideSpectrumLanex.region()
+def case_grid(res):
+    N_vector   = np.linspace(wsl.N_range[0], wsl.N_range[1], res)
+    FOV_vector = np.linspace(wsl.FOV_range[0], wsl.FOV_range[1], res)
+    region = sweep.Sweep(wsl.performance, [('FOV', FOV_vector), ('N', N_vector)])
+    region.reduce(sweep.Max(), sweep.Project(['FOV', 'N']))
+    return res*res, 'cells'
+
+
+# Same scan as my.py without elegant
+def case_scan(n):
+    table, gamma0, beam_x, beam_y = dumpline()
+    gamma = np.linspace(10, 80, n)*1e3/0.51099895
+    twiss_batch.beam_end(table, gamma0, gamma, beam_x, beam_y)
+    return n, 'energies'
+
+
+# K1 variants of the last quad, each
+# evaluated on its own
+def case_variants(n):
+    table, gamma0, beam_x, beam_y = dumpline()
+    design = lattice.Lattice(table, gamma0, beam_x, beam_y)
+    for K1 in np.linspace(-0.13, -0.11, n):
+        design.with_K1(6, K1).beam_end()
+    return n, 'variants'
+
+
+# Stub elegant through the process pool
+def case_elegant(n_particles, n_energies=4):
+    beamline = dumpline()
+    gamma    = np.linspace(10, 80, n_energies)*1e3/0.51099895
+    workdir  = tempfile.mkdtemp(prefix='benchmark_')
+    try:
+        sigx, sigy = elegant_pool.run_scan(
+                beamline          = beamline         ,
+                energy_list_gamma = gamma            ,
+                n_particles       = n_particles      ,
+                dir               = workdir          ,
+                job               = stub_elegant_job
+                )
+    finally:
+        shutil.rmtree(workdir)
+    if np.any(np.isnan(sigx)):
+        raise RuntimeError('Stub elegant job failed')
+    return n_particles*n_energies, 'particles'
+
+
+CASES = collections.OrderedDict([
+    ('counts'      , (case_counts      , 'points')),
+    ('performance' , (case_performance , 'points')),
+    ('dof'         , (case_dof         , 'points')),
+    ('grid'        , (case_grid        , 'res')),
+    ('scan'        , (case_scan        , 'energies')),
+    ('variants'    , (case_variants    , 'variants')),
+    ('elegant'     , (case_elegant     , 'particles'))
+    ])
+
+# Cases whose work runs in child processes
+WORKER_CASES = set(['elegant'])
+
+
+# ====================================
+# Measurement
+# ====================================
+# Peak RSS over the workers of one run of
+# func, from a fresh process so that earlier
+# cases' children do not count
+def _worker_peak(conn, func, size):
+    func(size)
+    rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # kB on Linux, bytes on macOS
+    conn.send(rss if sys.platform == 'darwin' else rss*1024)
+    conn.close()
+
+
+def worker_peak(func, size):
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=_worker_peak, args=(child_conn, func, size))
+    proc.start()
+    child_conn.close()
+    try:
+        peak = parent_conn.recv()
+    except EOFError:
+        peak = None
+    proc.join()
+    if peak is None:
+        raise RuntimeError('Memory run failed with exit code {}'.format(proc.exitcode))
+    return peak
+
+
+def measure(func, size, repeat=3, workers=False):
+    wall = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        n_items, unit = func(size)
+        wall.append(time.perf_counter() - start)
+
+    if workers and resource is not None:
+        memory = 'worker_rss'
+        peak   = worker_peak(func, size)
+    else:
+        memory = 'tracemalloc'
+        tracemalloc.start()
+        try:
+            func(size)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    best = min(wall)
+    return dict(
+            wall_s     = best,
+            wall_all_s = wall,
+            peak_bytes = peak,
+            memory     = memory,
+            throughput = n_items/best if best > 0 else float('inf'),
+            unit       = unit+'/s'
+            )
+
+
+def run(sizes, cases=None, repeat=3):
+    results = []
+    for name, (func, param) in CASES.items():
+        if cases is not None and name not in cases:
+            continue
+        for size in sizes[param]:
+            res = measure(func, size, repeat=repeat, workers=name in WORKER_CASES)
+            res.update(case=name, param=param, size=size)
+            results.append(res)
+            print('{:12s} {:>9s}={:<9d} {:10.4f} s {:10.1f} MB {:12.4g} {}'.format(
+                name, param, size, res['wall_s'], res['peak_bytes']/1e6, res['throughput'], res['unit']))
+    return results
+
+
+# ====================================
+# Baseline comparison
+# ====================================
+# A case regresses when its wall time or
+# peak memory exceeds the baseline by more
+# than the relative *tolerance*.
+def _key(res):
+    return res['case'], res['size']
+
+
+def compare(results, baseline, tolerance=0.25):
+    base = dict((_key(res), res) for res in baseline['results'])
+    regressions = []
+    for res in results:
+        ref = base.get(_key(res))
+        if ref is None:
+            continue
+        for field in ['wall_s', 'peak_bytes']:
+            # Peaks measured differently do not
+            # compare
+            if field == 'peak_bytes' and ref.get('memory', 'tracemalloc') != res['memory']:
+                continue
+            if ref[field] > 0 and res[field] > ref[field]*(1+tolerance):
+                regressions.append(dict(
+                    case     = res['case'],
+                    size     = res['size'],
+                    field    = field,
+                    baseline = ref[field],
+                    value    = res[field],
+                    ratio    = res[field]/ref[field]
+                    ))
+    return regressions
+
+
+def environment():
+    return dict(
+            time     = time.strftime('%Y-%m-%dT%H:%M:%S'),
+            python   = sys.version.split()[0],
+            numpy    = np.__version__,
+            platform = platform.platform(),
+            machine  = platform.machine(),
+            cpus     = os.cpu_count()
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Times the optics model, design sweeps and energy scan.')
+    parser.add_argument('-c', '--cases', nargs='+', choices=list(CASES),
+            help='cases to run (default all)')
+    parser.add_argument('--points', type=int, nargs='+', default=[10**4, 10**6],
+            help='array sizes for counts, performance and DOF')
+    parser.add_argument('--res', type=int, nargs='+', default=[250, 1000, 2000],
+            help='N x FOV grid resolutions')
+    parser.add_argument('--energies', type=int, nargs='+', default=[501, 10**5],
+            help='energy scan lengths')
+    parser.add_argument('--variants', type=int, nargs='+', default=[10**3, 10**4],
+            help='beamline variants')
+    parser.add_argument('--particles', type=int, nargs='+', default=[10**4, 10**5],
+            help='particles per stub elegant run')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+            help='timing repeats (best is kept)')
+    parser.add_argument('-o', '--output', default='benchmark.json',
+            help='results file')
+    parser.add_argument('-b', '--baseline',
+            help='baseline results file to compare against')
+    parser.add_argument('-t', '--tolerance', type=float, default=0.25,
+            help='allowed relative slowdown before flagging')
+
+    arg = parser.parse_args()
+
+    sizes = dict(points=arg.points, res=arg.res, energies=arg.energies, variants=arg.variants, particles=arg.particles)
+    results = run(sizes, cases=arg.cases, repeat=arg.repeat)
+
+    report = dict(environment=environment(), results=results)
+    if arg.baseline is not None:
+        with open(arg.baseline) as f:
+            report['regressions'] = compare(results, json.load(f), tolerance=arg.tolerance)
+
+    with open(arg.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+
+    for reg in report.get('regressions', []):
+        print('REGRESSION {case} size={size}: {field} {value:.4g} vs baseline {baseline:.4g} (x{ratio:.2f})'.format(**reg))
+    if report.get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import numpy as np
+import sdds_reader
+
+
+# ====================================
+# Online moments
+# ====================================
+# Running mean and co-moment matrix,
+# merged chunk by chunk (Chan et al.),
+# so no chunk is ever kept around.
+class Moments(object):
+    def __init__(self, names):
+        self.names = list(names)
+        k          = len(self.names)
+        self.n     = 0
+        self.mean  = np.zeros(k)
+        self._M2   = np.zeros((k, k))
+
+    def update(self, chunk):
+        X   = np.array([chunk[name] for name in self.names], dtype=np.float64)
+        n_b = X.shape[1]
+        if n_b == 0:
+            return
+        mean_b = X.mean(axis=1)
+        X     -= mean_b[:, np.newaxis]
+        M2_b   = np.dot(X, X.T)
+
+        n     = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean = self.mean + delta*(n_b/float(n))
+        self._M2  = self._M2 + M2_b + np.outer(delta, delta)*(self.n*n_b/float(n))
+        self.n    = n
+
+    def merge(self, other):
+        n     = self.n + other.n
+        if n == 0:
+            return self
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta*(other.n/float(n))
+        self._M2  = self._M2 + other._M2 + np.outer(delta, delta)*(self.n*other.n/float(n))
+        self.n    = n
+        return self
+
+    @property
+    def cov(self):
+        return self._M2/self.n
+
+    def std(self, name):
+        i = self.names.index(name)
+        return np.sqrt(self.cov[i, i])
+
+    # Geometric RMS emittance of a (u, u') pair
+    def emittance(self, u, up):
+        i   = [self.names.index(u), self.names.index(up)]
+        sub = self.cov[np.ix_(i, i)]
+        return np.sqrt(np.linalg.det(sub))
+
+
+# ====================================
+# Online 2D histogram
+# ====================================
+# Fixed uniform bins, filled with bincount.
+class Hist2D(object):
+    def __init__(self, bins, range):
+        self.bins   = (bins, bins) if np.isscalar(bins) else tuple(bins)
+        self.range  = np.asarray(range, dtype=np.float64)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+
+    @property
+    def xedges(self):
+        return np.linspace(self.range[0, 0], self.range[0, 1], self.bins[0]+1)
+
+    @property
+    def yedges(self):
+        return np.linspace(self.range[1, 0], self.range[1, 1], self.bins[1]+1)
+
+    def update(self, x, y):
+        nx, ny = self.bins
+        (x0, x1), (y0, y1) = self.range
+        ix = np.floor((x - x0)*(nx/(x1-x0))).astype(np.intp)
+        iy = np.floor((y - y0)*(ny/(y1-y0))).astype(np.intp)
+        # Right edge is inclusive, as in np.histogram2d
+        ix[x == x1] = nx-1
+        iy[y == y1] = ny-1
+        good = (ix >= 0) & (ix < nx) & (iy >= 0) & (iy < ny)
+        flat = ix[good]*ny + iy[good]
+        self.counts += np.bincount(flat, minlength=nx*ny).reshape(nx, ny)
+
+
+# ====================================
+# One pass over a particle file
+# ====================================
+# *hists* maps a label to (xname, yname,
+# Hist2D); *cut* optionally takes a chunk
+# and returns a boolean mask of particles
+# to histogram.
+def bunch_stats(path, names=('x', 'xp', 'y', 'yp'), hists=None, cut=None, chunksize=1000000, page=0):
+    hists = {} if hists is None else hists
+    reader = sdds_reader.SDDSReader(path)
+
+    needed = list(names)
+    for xname, yname, _ in hists.values():
+        needed += [xname, yname]
+    needed = [name for name in reader.column_names if name in set(needed)]
+
+    moments = Moments(names)
+    for _, _, chunk in reader.iter_chunks(needed, chunksize=chunksize, page=page):
+        moments.update(chunk)
+        if hists:
+            keep = slice(None) if cut is None else cut(chunk)
+            for xname, yname, hist in hists.values():
+                hist.update(chunk[xname][keep], chunk[yname][keep])
+
+    return moments
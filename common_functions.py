@@ -48,3 +48,26 @@ def counts(sigma, SE, N, mag, px_length, QE):
     lens_fraction           = aperture_fraction*area_mapping
     camera_fraction         = QE
     return beam_density*scintillator_efficiency*lens_fraction*camera_fraction
+
+
+# ====================================
+# Depth of field
+# ====================================
+def hyperfocal(f, N, c):
+    return np.power(f, 2)/(N*c)+f
+
+
+def DOF(f, N, c, m):
+    return 2.0*N*c*(m+1) / (np.power(m, 2)-np.power(N*c/f, 2))
+
+
+# ====================================
+# Inverse counts function
+# ====================================
+# counts() is linear in sigma, so the beam
+# density for a given count level is closed
+# form; broadcasts over every argument.
+def sigma_for_counts(counts, SE, N, mag, px_length, QE):
+    aperture_fraction = ap_fr_mag(N, mag)
+    area_mapping      = np.power(px_length/mag, 2.0)
+    return counts/(SE*aperture_fraction*area_mapping*QE)
@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+import argparse
+import numpy as np
+import sweep
+from common_functions import *
+
+# ====================================
+# Hardware catalogs
+# ====================================
+# Lenses: focal length and usable f-number
+# range. Cameras: sensor height (image side,
+# negative as in CameraDistance), pixel
+# size, QE, well depth and read noise, both
+# in counts.
+lens_dtype = np.dtype([
+    ('name'  , 'U32'),
+    ('f'     , 'f8'),
+    ('N_min' , 'f8'),
+    ('N_max' , 'f8')
+    ])
+
+camera_dtype = np.dtype([
+    ('name'      , 'U32'),
+    ('h_img'     , 'f8'),
+    ('px_length' , 'f8'),
+    ('QE'        , 'f8'),
+    ('well'      , 'f8'),
+    ('noise'     , 'f8')
+    ])
+
+
+def lens_catalog(entries):
+    return np.array([tuple(entry) for entry in entries], dtype=lens_dtype)
+
+
+def camera_catalog(entries):
+    return np.array([tuple(entry) for entry in entries], dtype=camera_dtype)
+
+
+# Focal lengths from CameraDistance with a
+# generic f/1.4-f/16 range, and the
+# Hamamatsu as set up in WideSpectrumLanex
+LENSES = lens_catalog([('{:g}mm'.format(f*1e3), f, 1.4, 16.0) for f in [20e-3, 24e-3, 28e-3, 35e-3, 50e-3, 60e-3, 85e-3]])
+
+CAMERAS = camera_catalog([
+    ('Hamamatsu', -13e-3, 6.5e-6, 0.6, 30e3, 30e3*40.0/np.power(2, 16))
+    ])
+
+# Third stops, f/1 to f/22
+N_STOPS = np.power(2.0, np.arange(0, 27)/6.0)
+
+
+# ====================================
+# Scoring
+# ====================================
+# Every (lens, camera, N, FOV) is scored by
+# its light throughput, the fraction of the
+# scintillator light that is detected
+# (QE*ap_fr_mag). It falls as the FOV grows,
+# while the counts per pixel, which set
+# saturation and noise, rise. Combinations
+# breaking a constraint score NaN:
+#   FOV >= fov_min
+#   o_min <= working distance <= o_max
+#   DOF >= dof_min (circle of confusion one
+#     pixel; beyond hyperfocal counts as
+#     infinite)
+#   counts at sigma_peak <= well depth
+#   counts at sigma_min >= read noise
+class Problem(object):
+    def __init__(self, lenses=LENSES, cameras=CAMERAS, N=N_STOPS, FOV=None,
+            fov_min=0, o_min=0, o_max=np.inf, dof_min=0, sigma_peak=None, sigma_min=None, SE=1.75e9/1e-12*4*np.pi):
+        self.lenses     = lenses
+        self.cameras    = cameras
+        self.N          = np.asarray(N, dtype=np.float64)
+        self.FOV        = np.linspace(5e-2, 40e-2, 36) if FOV is None else np.asarray(FOV, dtype=np.float64)
+        self.fov_min    = fov_min
+        self.o_min      = o_min
+        self.o_max      = o_max
+        self.dof_min    = dof_min
+        self.sigma_peak = sigma_peak
+        self.sigma_min  = sigma_min
+        self.SE         = SE
+
+    def evaluate(self, lens, camera, N, FOV, feasible=False):
+        lens   = self.lenses[lens]
+        cam    = self.cameras[camera]
+        f      = lens['f']
+        px     = cam['px_length']
+
+        m      = mag(cam['h_img'], FOV)
+        o      = obj(f=f, m=m)
+        thr    = cam['QE']*ap_fr_mag(N, m)
+        # Counts per pixel for unit density (C/m^2)
+        px_cts = counts(sigma=1.0, SE=self.SE, N=N, mag=m, px_length=px, QE=cam['QE'])
+        # DOF() takes the magnitude
+        with np.errstate(divide='ignore'):
+            dof = DOF(f=f, N=N, c=px, m=np.abs(m))
+        dof = np.where(dof > 0, dof, np.inf)
+
+        ok = (N >= lens['N_min']*(1-1e-9)) & (N <= lens['N_max']*(1+1e-9))
+        ok = ok & (FOV >= self.fov_min) & (o >= self.o_min) & (o <= self.o_max) & (dof >= self.dof_min)
+        if self.sigma_peak is not None:
+            ok = ok & (px_cts*self.sigma_peak <= cam['well'])
+        if self.sigma_min is not None:
+            ok = ok & (px_cts*self.sigma_min >= cam['noise'])
+
+        if feasible:
+            return dict(throughput=thr, counts=px_cts, o=o, m=m, dof=dof, feasible=ok)
+        return np.where(ok, thr, np.nan)
+
+    def sweep(self, chunk_size=2**20):
+        return sweep.Sweep(self.evaluate, [
+            ('lens'   , np.arange(self.lenses.size)),
+            ('camera' , np.arange(self.cameras.size)),
+            ('N'      , self.N),
+            ('FOV'    , self.FOV)
+            ], chunk_size=chunk_size)
+
+
+# ====================================
+# Pareto front
+# ====================================
+# Points not beaten on both larger FOV and
+# higher throughput. Returns positions into
+# the inputs, ordered by decreasing FOV.
+# Points equal to a front point in both are
+# kept too, next to it, for optimize() to
+# choose between.
+def pareto_front(fov, thr):
+    order = np.lexsort((-thr, -fov))
+    best  = np.maximum.accumulate(thr[order])
+    keep  = np.ones(order.size, dtype=bool)
+    keep[1:] = thr[order][1:] > best[:-1]
+    tied  = np.zeros(order.size, dtype=bool)
+    tied[1:] = (fov[order][1:] == fov[order][:-1]) & (thr[order][1:] == thr[order][:-1])
+    # Each point takes the verdict of the
+    # first point of its tie
+    start = np.maximum.accumulate(np.where(tied, 0, np.arange(order.size)))
+    return order[keep[start]]
+
+
+# Sweep reducer keeping the running front of
+# feasible points as flat grid indices
+class ParetoFront(object):
+    def __init__(self, fov_axis='FOV'):
+        self.fov_axis = fov_axis
+
+    def start(self, sweep):
+        self.sweep = sweep
+        self.k     = sweep.axis(self.fov_axis)
+        self.index = np.zeros(0, dtype=np.intp)
+        self.fov   = np.zeros(0)
+        self.thr   = np.zeros(0)
+
+    def update(self, index, j, values):
+        good = np.isfinite(values)
+        if not good.any():
+            return
+        sub  = [np.broadcast_to(i, values.shape)[good] for i in self.sweep.indices(index, j)]
+        flat = np.ravel_multi_index(sub, self.sweep.shape)
+        fov  = self.sweep.vectors[self.k][sub[self.k]]
+
+        index = np.concatenate([self.index, flat])
+        fov   = np.concatenate([self.fov, fov])
+        thr   = np.concatenate([self.thr, values[good]])
+        keep  = pareto_front(fov, thr)
+        self.index, self.fov, self.thr = index[keep], fov[keep], thr[keep]
+
+
+def optimize(problem, chunk_size=2**20):
+    grid   = problem.sweep(chunk_size=chunk_size)
+    front, = grid.reduce(ParetoFront())
+
+    lens, camera, iN, iF = np.unravel_index(front.index, grid.shape)
+    N, FOV = problem.N[iN], problem.FOV[iF]
+    detail = problem.evaluate(lens, camera, N, FOV, feasible=True)
+
+    # Throughput does not depend on f, so
+    # lenses tie at equal FOV; take the
+    # largest DOF, then the shortest working
+    # distance
+    order = np.lexsort((detail['o'], -detail['dof'], -front.thr, -FOV))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = (FOV[order][1:] != FOV[order][:-1]) | (front.thr[order][1:] != front.thr[order][:-1])
+    pick  = order[first]
+    lens, camera, N, FOV = lens[pick], camera[pick], N[pick], FOV[pick]
+    detail = dict((key, value[pick]) for key, value in detail.items())
+
+    out = np.zeros(pick.size, dtype=[
+        ('lens', 'U32'), ('camera', 'U32'), ('f', 'f8'), ('N', 'f8'), ('FOV', 'f8'),
+        ('o', 'f8'), ('m', 'f8'), ('dof', 'f8'), ('throughput', 'f8'), ('counts', 'f8')
+        ])
+    out['lens']       = problem.lenses['name'][lens]
+    out['camera']     = problem.cameras['name'][camera]
+    out['f']          = problem.lenses['f'][lens]
+    out['N']          = N
+    out['FOV']        = FOV
+    out['o']          = detail['o']
+    out['m']          = detail['m']
+    out['dof']        = detail['dof']
+    out['throughput'] = detail['throughput']
+    out['counts']     = detail['counts']
+    return out
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pareto front of light throughput vs. FOV over lens and camera catalogs.')
+    parser.add_argument('--fov-min', type=float, default=30e-2,
+            help='required field of view [m]')
+    parser.add_argument('--o-min', type=float, default=0.5,
+            help='minimum working distance [m]')
+    parser.add_argument('--o-max', type=float, default=4.0,
+            help='maximum working distance [m]')
+    parser.add_argument('--dof-min', type=float, default=0.0,
+            help='minimum depth of field [m]')
+    parser.add_argument('--sigma-peak', type=float, default=None,
+            help='peak beam density that must not saturate [C/m^2]')
+    parser.add_argument('--sigma-min', type=float, default=None,
+            help='lowest beam density that must clear the read noise [C/m^2]')
+
+    arg = parser.parse_args()
+
+    problem = Problem(fov_min=arg.fov_min, o_min=arg.o_min, o_max=arg.o_max, dof_min=arg.dof_min,
+            sigma_peak=arg.sigma_peak, sigma_min=arg.sigma_min, FOV=np.linspace(arg.fov_min, 2*arg.fov_min, 41))
+    front = optimize(problem)
+    if front.size == 0:
+        print('No configuration meets the constraints')
+    for row in front:
+        print('{:>10s} {:>10s} f/{:<5.2f} FOV {:5.1f} cm  o {:5.2f} m  DOF {:8.3g} m  throughput {:.3e}  {:.3g} counts/(C/m^2)'.format(
+            row['lens'], row['camera'], row['N'], row['FOV']*1e2, row['o'], row['dof'], row['throughput'], row['counts']))
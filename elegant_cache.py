@@ -0,0 +1,143 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump when the meaning of stored results changes
+CACHE_VERSION = 1
+
+
+# ====================================
+# Stable beamline description
+# ====================================
+def _num(val):
+    # Exact, platform independent float text
+    return float(val).hex()
+
+
+def _element_desc(element):
+    desc = dict(type=element._type, name=element.name, length=_num(element.length))
+    if element._type == 'quad':
+        desc['K1'] = _num(element.K1)
+    elif element._type == 'bend':
+        desc['angle']  = _num(element.angle)
+        desc['rotate'] = _num(element.rotate)
+    desc['kwargs'] = dict((k, repr(v)) for k, v in getattr(element, '_kwargs', {}).items())
+    return desc
+
+
+def _beam_desc(beam):
+    return dict(beta=_num(beam.beta), alpha=_num(beam.alpha), emit=_num(beam.emit))
+
+
+def beamline_desc(beamline):
+    return dict(
+            elements = [_element_desc(element) for element in beamline.elements],
+            gamma    = _num(beamline.gamma),
+            beam_x   = _beam_desc(beamline.beam_x),
+            beam_y   = _beam_desc(beamline.beam_y)
+            )
+
+
+def cache_key(beamline, energy_gamma, n_particles, sigma_dp, job=None):
+    desc = dict(
+            version     = CACHE_VERSION,
+            beamline    = beamline_desc(beamline),
+            energy      = _num(energy_gamma),
+            n_particles = _num(n_particles),
+            sigma_dp    = _num(sigma_dp),
+            job         = None if job is None else '{}.{}'.format(job.__module__, job.__name__)
+            )
+    text = json.dumps(desc, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+# ====================================
+# On-disk cache
+# ====================================
+# Each entry is a directory root/ab/<key>
+# holding stats.json and, optionally, the
+# elegant particle file. Entry mtime tracks
+# last use for LRU eviction down to
+# *max_bytes*.
+class ResultCache(object):
+    _stats_name    = 'stats.json'
+    _particle_name = 'bunch.out'
+
+    def __init__(self, root, max_bytes=None, keep_particles=False):
+        self.root           = root
+        self.max_bytes      = max_bytes
+        self.keep_particles = keep_particles
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def get(self, key):
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, self._stats_name)) as f:
+                stats = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        now = time.time()
+        os.utime(entry, (now, now))
+        return stats
+
+    def particle_file(self, key):
+        path = os.path.join(self._entry(key), self._particle_name)
+        return path if os.path.exists(path) else None
+
+    def put(self, key, stats, particle_file=None, evict=True):
+        entry  = self._entry(key)
+        parent = os.path.dirname(entry)
+        if not os.path.exists(parent):
+            os.makedirs(parent)
+
+        # Build in a temp dir, then rename into place
+        tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+        with open(os.path.join(tmp, self._stats_name), 'w') as f:
+            json.dump(stats, f)
+        if self.keep_particles and particle_file is not None:
+            shutil.copyfile(particle_file, os.path.join(tmp, self._particle_name))
+
+        if os.path.exists(entry):
+            shutil.rmtree(entry)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            # Another process stored it first
+            shutil.rmtree(tmp)
+
+        if evict:
+            self.evict()
+
+    def _entries(self):
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                if key.startswith('.tmp_'):
+                    continue
+                entry = os.path.join(prefix_dir, key)
+                size  = sum(os.path.getsize(os.path.join(entry, name)) for name in os.listdir(entry))
+                yield os.path.getmtime(entry), size, entry
+
+    def evict(self):
+        if self.max_bytes is None:
+            return
+        entries = sorted(self._entries())
+        total   = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            logger.debug('Evicting cache entry {}'.format(entry))
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
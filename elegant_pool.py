@@ -0,0 +1,246 @@
+import bunch_stats
+import elegant_cache
+import instrument
+import logging
+import multiprocessing
+import multiprocessing.connection
+import numpy as np
+import os
+import shutil
+import signal
+import tempfile
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+# ====================================
+# Default job: one elegant run
+# ====================================
+# Runs in its own process with the beamline
+# already copied, so setting gamma is safe.
+def elegant_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    import slactrac as sltr
+
+    beamline.gamma = energy_gamma
+    t0 = time.time()
+    path, root, ext = sltr.elegant_sim(
+            beamline              = beamline     ,
+            beam_pCentral         = energy_gamma ,
+            lattice_pCentral      = energy_gamma ,
+            n_particles_per_bunch = n_particles  ,
+            sigma_dp              = sigma_dp     ,
+            dir                   = workdir      ,
+            filename              = 'out.ele'
+            )
+
+    # Reduce the particle file in one
+    # streaming pass
+    particle_file = os.path.join(path, root+'.out')
+    t1 = time.time()
+    moments = bunch_stats.bunch_stats(particle_file)
+    t2 = time.time()
+
+    return dict(
+            sigx          = moments.std('x'),
+            sigy          = moments.std('y'),
+            mean_x        = moments.mean[0],
+            mean_y        = moments.mean[2],
+            emit_x        = moments.emittance('x', 'xp'),
+            emit_y        = moments.emittance('y', 'yp'),
+            particle_file = particle_file,
+            timing        = dict(elegant=t1-t0, bunch_stats=t2-t1)
+            )
+
+
+# ====================================
+# Worker process entry point
+# ====================================
+def _child(conn, func, args, workdir, env):
+    # New session so a timeout can kill
+    # elegant along with the worker
+    if hasattr(os, 'setsid'):
+        os.setsid()
+    if env is not None:
+        os.environ.update(env)
+    try:
+        result = func(*args, workdir=workdir)
+        conn.send((True, result))
+    except Exception:
+        conn.send((False, traceback.format_exc()))
+    conn.close()
+
+
+# A worker that has not reached setsid() yet
+# has no group of its own, so killpg fails;
+# kill the worker alone then
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, OSError):
+        proc.kill()
+    proc.join()
+
+
+class _Job(object):
+    def __init__(self, index, args, workdir):
+        self.index    = index
+        self.args     = args
+        self.workdir  = workdir
+        self.attempts = 0
+        self.proc     = None
+        self.conn     = None
+        self.deadline = None
+        self.started  = None
+
+
+# ====================================
+# Scheduler
+# ====================================
+# Runs func(*args, workdir=...) for every
+# entry of arglist in a bounded pool of
+# processes, each job in its own directory
+# under a fresh run_* directory in *dir*
+# (so files returned by earlier calls are
+# never overwritten). Returns results in
+# arglist order, None where all attempts
+# failed.
+#
+# The run_* directory is removed once the
+# results are in, unless *keep* is set:
+# then files the results point at (e.g.
+# particle_file) stay for the caller, who
+# removes them.
+#
+# *env* is merged into each worker's
+# environment, e.g. to put a stub elegant
+# executable first on PATH.
+def run_jobs(func, arglist, dir, max_workers=None, timeout=None, retries=1, env=None, keep=False):
+    if not arglist:
+        return []
+    if max_workers is None:
+        max_workers = multiprocessing.cpu_count()
+
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    run_dir = tempfile.mkdtemp(prefix='run_', dir=dir)
+    try:
+        return _schedule(func, arglist, run_dir, max_workers, timeout, retries, env)
+    finally:
+        if not keep:
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def _schedule(func, arglist, run_dir, max_workers, timeout, retries, env):
+    jobs    = [_Job(i, args, os.path.join(run_dir, 'job_{:05d}'.format(i))) for i, args in enumerate(arglist)]
+    results = [None]*len(jobs)
+    pending = list(reversed(jobs))
+    running = {}
+
+    def start(job):
+        if os.path.exists(job.workdir):
+            shutil.rmtree(job.workdir)
+        os.makedirs(job.workdir)
+        parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+        job.proc = multiprocessing.Process(target=_child, args=(child_conn, func, job.args, job.workdir, env))
+        job.proc.start()
+        child_conn.close()
+        job.conn      = parent_conn
+        job.attempts += 1
+        job.started   = time.time()
+        job.deadline  = None if timeout is None else job.started + timeout
+        running[job.conn] = job
+
+    def finish(job, ok, payload):
+        del running[job.conn]
+        job.conn.close()
+        instrument.record('elegant_pool.job', time.time()-job.started, index=job.index, attempt=job.attempts, ok=ok)
+        if ok:
+            results[job.index] = payload
+        elif job.attempts <= retries:
+            logger.warning('Job {} failed (attempt {}), retrying:\n{}'.format(job.index, job.attempts, payload))
+            pending.append(job)
+        else:
+            logger.error('Job {} failed after {} attempts:\n{}'.format(job.index, job.attempts, payload))
+
+    while pending or running:
+        while pending and len(running) < max_workers:
+            start(pending.pop())
+
+        deadlines = [job.deadline for job in running.values() if job.deadline is not None]
+        wait_time = None if not deadlines else max(0, min(deadlines) - time.time())
+
+        for conn in multiprocessing.connection.wait(list(running), timeout=wait_time):
+            job = running[conn]
+            try:
+                ok, payload = conn.recv()
+            except EOFError:
+                ok, payload = False, 'Worker exited with code {}'.format(job.proc.exitcode)
+            job.proc.join()
+            finish(job, ok, payload)
+
+        now = time.time()
+        for job in list(running.values()):
+            if job.deadline is not None and now >= job.deadline:
+                _kill(job.proc)
+                finish(job, False, 'Timed out after {} s'.format(timeout))
+
+    return results
+
+
+# ====================================
+# Energy scan
+# ====================================
+# Points already in *cache* (an
+# elegant_cache.ResultCache) are not rerun.
+# Particle files go into the cache (which is
+# size-bounded) and the run directories are
+# then removed, unless *keep* is set.
+def run_scan(beamline, energy_list_gamma, n_particles=1e5, sigma_dp=0, dir=None, max_workers=None, timeout=None, retries=1, env=None, job=elegant_job, cache=None, keep=False):
+    if dir is None:
+        dir = os.path.join(os.getcwd(), 'temp')
+
+    results = [None]*len(energy_list_gamma)
+    keys    = [None]*len(energy_list_gamma)
+    todo    = []
+    for i, energy_gamma in enumerate(energy_list_gamma):
+        if cache is not None:
+            keys[i]    = elegant_cache.cache_key(beamline, energy_gamma, n_particles, sigma_dp, job=job)
+            results[i] = cache.get(keys[i])
+        if results[i] is None:
+            todo.append(i)
+
+    if cache is not None:
+        logger.info('Cache hits: {} of {}'.format(len(results)-len(todo), len(results)))
+        instrument.count('elegant_cache.hits', len(results)-len(todo))
+        instrument.count('elegant_cache.misses', len(todo))
+
+    arglist = [(beamline, energy_list_gamma[i], n_particles, sigma_dp) for i in todo]
+    scan_dir = None
+    try:
+        done = []
+        if arglist:
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            scan_dir = tempfile.mkdtemp(prefix='scan_', dir=dir)
+            done     = run_jobs(job, arglist, scan_dir, max_workers=max_workers, timeout=timeout, retries=retries, env=env, keep=True)
+        for i, res in zip(todo, done):
+            results[i] = res
+            # Stage times measured inside the worker
+            if res is not None:
+                for name, duration in res.get('timing', {}).items():
+                    instrument.record('elegant_job.'+name, duration, index=i)
+            if cache is not None and res is not None:
+                stats = dict((k, v) for k, v in res.items() if k not in ('particle_file', 'timing'))
+                cache.put(keys[i], stats, particle_file=res.get('particle_file'), evict=False)
+    finally:
+        if scan_dir is not None and not keep:
+            shutil.rmtree(scan_dir, ignore_errors=True)
+
+    if cache is not None:
+        cache.evict()
+
+    sigx = np.array([np.nan if res is None else res['sigx'] for res in results])
+    sigy = np.array([np.nan if res is None else res['sigy'] for res in results])
+    return sigx, sigy
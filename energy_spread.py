@@ -0,0 +1,135 @@
+import collections
+import numpy as np
+import twiss_batch
+
+# ====================================
+# Momentum distributions
+# ====================================
+# pdf over delta = dp/p, with the range
+# [low, high] it is cut to and a width
+# that sets the grid spacing
+Spread = collections.namedtuple('Spread', ['pdf', 'low', 'high', 'width'])
+
+
+# Everything at delta = 0
+def monoenergetic():
+    return Spread(lambda delta: np.where(delta == 0, 1.0, 0.0), 0.0, 0.0, 0.0)
+
+
+def gaussian(sigma_dp, n_sigma=5.0):
+    if sigma_dp == 0:
+        return monoenergetic()
+    return Spread(lambda delta: np.exp(-0.5*np.square(delta/sigma_dp)), -n_sigma*sigma_dp, n_sigma*sigma_dp, sigma_dp)
+
+
+def uniform(half_width):
+    return Spread(lambda delta: np.ones_like(delta), -half_width, half_width, half_width)
+
+
+# Tabulated, e.g. a measured spectrum
+# (linear interpolation, zero outside)
+def tabulated(delta, weight):
+    delta  = np.asarray(delta, dtype=np.float64)
+    weight = np.asarray(weight, dtype=np.float64)
+    mean   = np.average(delta, weights=weight)
+    width  = np.sqrt(np.average(np.square(delta-mean), weights=weight))
+    return Spread(lambda d: np.interp(d, delta, weight, left=0, right=0), delta[0], delta[-1], width)
+
+
+# ====================================
+# Kernel on a log-energy grid
+# ====================================
+# On a grid uniform in ln(E) with step h, a
+# slice at E0*(1+delta) sits a fixed number
+# of steps from E0, so averaging over the
+# spread is a convolution with weights
+# pdf(delta)*(1+delta) (the Jacobian of
+# delta in ln E), normalized. The range
+# always takes in delta=0, the central
+# energy.
+def kernel(spread, h):
+    k_lo = min(0, int(np.floor(np.log1p(spread.low)/h)))
+    k_hi = max(0, int(np.ceil(np.log1p(spread.high)/h)))
+    t    = np.arange(k_lo, k_hi+1)*h
+    w    = spread.pdf(np.expm1(t))*np.exp(t)
+    w    = np.where((np.expm1(t) >= spread.low) & (np.expm1(t) <= spread.high), w, 0)
+    if not np.all(np.isfinite(w)):
+        raise ValueError('Spread pdf is not finite on the kernel grid')
+    if w.sum() <= 0:
+        # Narrower than a step: monoenergetic
+        return np.array([1.0]), 0
+    return w/w.sum(), k_lo
+
+
+# ====================================
+# Spread-weighted scan
+# ====================================
+# Spot sizes and rho at central energies
+# *gamma*, averaged over *spread*. One
+# monoenergetic pass over a log grid
+# (extended by the kernel's reach) gives per
+# energy
+#   sigma^2  : betatron size of that slice
+#   c        : centroid, the integral of the
+#              dispersion R16 over ln(E)
+# and each plane's spread-weighted size is
+#   <sigma^2> + <c^2> - <c>^2
+# with every average one np.convolve over
+# the grid. Only the ratio to the
+# monoenergetic size is interpolated back to
+# *gamma*; the monoenergetic sizes there are
+# computed exactly in the same pass.
+# *resolution* is grid steps per
+# spread.width.
+def scan(table, gamma0, beam_x, beam_y, gamma, spread, edges=False, resolution=8, min_points=501, max_points=2**20):
+    gamma = np.asarray(gamma, dtype=np.float64)
+    lo    = np.log(gamma.min())
+    hi    = np.log(gamma.max())
+
+    h = (hi-lo)/(min_points-1) if hi > lo else np.inf
+    h = min(h, spread.width/resolution) if spread.width > 0 else h
+    if not np.isfinite(h):
+        h = spread.width/resolution if spread.width > 0 else 1.0
+    w, k_lo = kernel(spread, h)
+    k_hi    = k_lo + w.size - 1
+
+    # Grid covering every slice of every
+    # central energy
+    i_lo  = int(np.floor(lo/h)) + k_lo
+    i_hi  = int(np.ceil(hi/h)) + k_hi
+    if i_hi - i_lo + 1 > max_points:
+        raise ValueError('Energy grid would need {} points; lower resolution or raise max_points'.format(i_hi-i_lo+1))
+    t     = np.arange(i_lo, i_hi+1)*h
+    grid  = np.exp(t)
+
+    Mx, My = twiss_batch.transfer_matrices(table, gamma0/np.concatenate([grid, gamma]), edges=edges)
+    out    = dict(gamma=gamma)
+    for plane, M, beam in [('x', Mx, beam_x), ('y', My, beam_y)]:
+        sig2 = np.square(twiss_batch.spotsize(M, beam.beta, beam.alpha, beam.emit))
+        mono = sig2[grid.size:]
+        sig2 = sig2[:grid.size]
+        D    = M[:grid.size, 0, 2]
+        c    = np.concatenate([[0], np.cumsum(0.5*(D[1:]+D[:-1])*h)])
+
+        # Output index j of a 'valid' convolution
+        # is central energy grid[j - k_lo], i.e.
+        # t[j] - k_lo*h
+        avg    = lambda f: np.convolve(f, w[::-1], mode='valid')
+        c_mean = avg(c)
+        var    = avg(sig2) + avg(np.square(c-c[c.size//2])) - np.square(c_mean-c[c.size//2])
+        t_mid  = t[:var.size] - k_lo*h
+
+        ratio  = var/sig2[-k_lo:-k_lo+var.size]
+        out['sig'+plane]       = np.sqrt(mono*np.interp(np.log(gamma), t_mid, ratio))
+        out['centroid_'+plane] = np.interp(np.log(gamma), t_mid, c_mean) - np.interp(np.log(gamma), t, c)
+        out['mono_sig'+plane]  = np.sqrt(mono)
+
+    out['rho']      = 1.0/(out['sigx']*out['sigy'])
+    out['mono_rho'] = 1.0/(out['mono_sigx']*out['mono_sigy'])
+    out['n_grid']   = grid.size
+    return out
+
+
+def beamline_scan(beamline, gamma, spread, edges=False, **kwargs):
+    table = twiss_batch.element_table(beamline.elements)
+    return scan(table, beamline.gamma, beamline.beam_x, beamline.beam_y, gamma, spread, edges=edges, **kwargs)
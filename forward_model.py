@@ -0,0 +1,109 @@
+import numpy as np
+import os
+import bunch_stats
+import common_functions as cf
+import elegant_pool
+import frames
+
+
+# ====================================
+# Camera pixel grid at the screen
+# ====================================
+# A camera of shape (ny, nx) pixels looking
+# at the screen with magnification *mag*;
+# one pixel sees px_length/|mag| of screen.
+# Images are kept in screen orientation
+# (rows y, columns x), not flipped by the
+# lens.
+class CameraGrid(object):
+    def __init__(self, shape, mag, camera=frames.HAMAMATSU, center=(0.0, 0.0)):
+        self.shape  = tuple(shape)
+        self.mag    = mag
+        self.camera = camera
+        self.center = center
+
+    @property
+    def px_obj(self):
+        return self.camera.px_length/np.abs(self.mag)
+
+    @property
+    def range(self):
+        ny, nx = self.shape
+        cx, cy = self.center
+        return np.array([
+            [cx - 0.5*nx*self.px_obj, cx + 0.5*nx*self.px_obj],
+            [cy - 0.5*ny*self.px_obj, cy + 0.5*ny*self.px_obj]
+            ])
+
+    # Hist2D binned as (x, y)
+    def hist(self):
+        ny, nx = self.shape
+        return bunch_stats.Hist2D((nx, ny), self.range)
+
+
+# ====================================
+# Particle binning
+# ====================================
+# Bins in-memory coordinates (e.g. an
+# ElegantSim Bunch's x and y) a chunk at a
+# time; *hist* accumulates across calls.
+def bin_particles(x, y, grid, hist=None, cut=None, chunksize=1000000):
+    hist = grid.hist() if hist is None else hist
+    for start in range(0, len(x), chunksize):
+        xc = np.asarray(x[start:start+chunksize])
+        yc = np.asarray(y[start:start+chunksize])
+        if cut is not None:
+            keep = cut(dict(x=xc, y=yc))
+            xc, yc = xc[keep], yc[keep]
+        hist.update(xc, yc)
+    return hist, len(x)
+
+
+# Streams an elegant particle file; returns
+# the histogram and the total particle count
+# (before any cut)
+def bin_file(path, grid, cut=None, chunksize=1000000, page=0):
+    hist    = grid.hist()
+    moments = bunch_stats.bunch_stats(path, names=('x', 'y'), hists=dict(image=('x', 'y', hist)), cut=cut, chunksize=chunksize, page=page)
+    return hist, moments.n
+
+
+# ====================================
+# Expected camera image
+# ====================================
+# Particles per pixel to beam density
+# (C/m^2), then counts() per pixel
+def expected_image(hist, grid, charge, n_particles, SE, N):
+    sigma = hist.counts.T*(charge/float(n_particles))/np.power(grid.px_obj, 2)
+    return cf.counts(sigma=sigma, SE=SE, N=N, mag=grid.mag, px_length=grid.camera.px_length, QE=grid.camera.QE)
+
+
+def image_from_file(path, grid, charge, SE, N, cut=None, chunksize=1000000):
+    hist, n = bin_file(path, grid, cut=cut, chunksize=chunksize)
+    return expected_image(hist, grid, charge, n, SE, N)
+
+
+# ====================================
+# Energy scans
+# ====================================
+# One elegant run per energy, reduced to an
+# expected image inside the worker so only
+# the image comes back
+def image_job(beamline, energy_gamma, n_particles, sigma_dp, grid, charge, SE, N, workdir):
+    res = elegant_pool.elegant_job(beamline, energy_gamma, n_particles, sigma_dp, workdir=workdir)
+    return image_from_file(res['particle_file'], grid, charge, SE, N)
+
+
+# Returns (n_energies, ny, nx), NaN images
+# where elegant failed
+def scan_images(beamline, energy_list_gamma, grid, charge, SE, N, n_particles=1e6, sigma_dp=0, dir=None, **run_jobs_kwargs):
+    if dir is None:
+        dir = os.path.join(os.getcwd(), 'temp')
+    arglist = [(beamline, energy_gamma, n_particles, sigma_dp, grid, charge, SE, N) for energy_gamma in energy_list_gamma]
+    results = elegant_pool.run_jobs(image_job, arglist, dir, **run_jobs_kwargs)
+
+    out = np.full((len(energy_list_gamma),) + grid.shape, np.nan)
+    for i, image in enumerate(results):
+        if image is not None:
+            out[i] = image
+    return out
@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+import argparse
+import collections
+import concurrent.futures
+import os
+import struct
+import numpy as np
+import common_functions as cf
+import frames
+
+# ====================================
+# Memory-mapped frame stacks
+# ====================================
+# Stacks are (n_frames, ny, nx) arrays backed
+# by the file; frames are only read when a
+# slice of them is used.
+
+# Uncompressed TIFF and BigTIFF. Pages laid
+# out at a fixed stride (as written by most
+# camera software) map to one strided array;
+# otherwise each page is mapped on its own.
+_tiff_types = {1: 'B', 3: 'H', 4: 'I', 16: 'Q'}
+
+
+def _tiff_ifds(f):
+    order = {b'II': '<', b'MM': '>'}.get(f.read(2))
+    if order is None:
+        raise IOError('Not a TIFF file')
+    magic, = struct.unpack(order+'H', f.read(2))
+    if magic == 42:
+        big = False
+        offset, = struct.unpack(order+'I', f.read(4))
+    elif magic == 43:
+        big = True
+        f.read(4)
+        offset, = struct.unpack(order+'Q', f.read(8))
+    else:
+        raise IOError('Not a TIFF file')
+
+    count_fmt, entry_size, next_fmt = ('Q', 20, 'Q') if big else ('H', 12, 'I')
+    inline = 8 if big else 4
+    while offset:
+        f.seek(offset)
+        n, = struct.unpack(order+count_fmt, f.read(struct.calcsize(count_fmt)))
+        raw  = f.read(n*entry_size)
+        tags = {}
+        for i in range(n):
+            entry = raw[i*entry_size:(i+1)*entry_size]
+            tag, kind = struct.unpack(order+'HH', entry[:4])
+            count, = struct.unpack(order+('Q' if big else 'I'), entry[4:4+inline])
+            fmt = _tiff_types.get(kind)
+            if fmt is None:
+                continue
+            size = count*struct.calcsize(fmt)
+            if size <= inline:
+                data = entry[4+inline:4+inline+size]
+            else:
+                pos  = f.tell()
+                ptr, = struct.unpack(order+('Q' if big else 'I'), entry[4+inline:])
+                f.seek(ptr)
+                data = f.read(size)
+                f.seek(pos)
+            tags[tag] = struct.unpack(order+fmt*count, data)
+        yield order, tags
+        offset, = struct.unpack(order+next_fmt, f.read(struct.calcsize(next_fmt)))
+
+
+def _tiff_page(order, tags):
+    nx, ny   = tags[256][0], tags[257][0]
+    bits     = tags.get(258, (1,))[0]
+    if tags.get(259, (1,))[0] != 1 or tags.get(277, (1,))[0] != 1:
+        raise NotImplementedError('Only uncompressed single-channel TIFF is handled')
+    fmt      = {1: 'u', 2: 'i', 3: 'f'}[tags.get(339, (1,))[0]]
+    dtype    = np.dtype(order+fmt+str(bits//8))
+    offsets  = np.array(tags[273], dtype=np.int64)
+    sizes    = np.array(tags[279], dtype=np.int64)
+    if np.any(offsets[1:] != offsets[:-1] + sizes[:-1]) or sizes.sum() != nx*ny*dtype.itemsize:
+        raise NotImplementedError('TIFF strips are not contiguous')
+    return offsets[0], (ny, nx), dtype
+
+
+class _Pages(object):
+    def __init__(self, path, pages):
+        self.pages = [np.memmap(path, dtype=dtype, mode='r', offset=start, shape=shape) for start, shape, dtype in pages]
+        self.shape = (len(pages),) + pages[0][1]
+        self.dtype = pages[0][2]
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return np.stack([self.pages[i] for i in range(*index.indices(len(self)))])
+        return self.pages[index]
+
+
+def tiff_stack(path):
+    with open(path, 'rb') as f:
+        pages = [_tiff_page(order, tags) for order, tags in _tiff_ifds(f)]
+    starts = np.array([start for start, _, _ in pages], dtype=np.int64)
+    shape, dtype = pages[0][1], pages[0][2]
+    if any(p[1] != shape or p[2] != dtype for p in pages):
+        raise NotImplementedError('TIFF pages differ in size or type')
+
+    stride = starts[1]-starts[0] if len(pages) > 1 else shape[0]*shape[1]*dtype.itemsize
+    if np.all(np.diff(starts) == stride) and stride > 0:
+        mm = np.memmap(path, dtype=np.uint8, mode='r')
+        return np.ndarray(shape=(len(pages),)+shape, dtype=dtype, buffer=mm, offset=int(starts[0]),
+                strides=(int(stride), shape[1]*dtype.itemsize, dtype.itemsize))
+    return _Pages(path, pages)
+
+
+# Raw: headerless (or *offset* bytes of
+# header) frames of *shape*, count from the
+# file size
+def raw_stack(path, shape, dtype=np.uint16, offset=0):
+    dtype = np.dtype(dtype)
+    frame = shape[0]*shape[1]*dtype.itemsize
+    n     = (os.path.getsize(path)-offset)//frame
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(n,)+tuple(shape))
+
+
+def open_stack(path, shape=None, dtype=np.uint16, offset=0):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.npy':
+        return np.load(path, mmap_mode='r')
+    if ext in ('.tif', '.tiff'):
+        return tiff_stack(path)
+    if shape is None:
+        raise ValueError('Raw stacks need the frame shape')
+    return raw_stack(path, shape, dtype=dtype, offset=offset)
+
+
+# ====================================
+# Calibration
+# ====================================
+# ADU to beam density: frames.readout()
+# backwards (ADU to electrons), then
+# sigma_for_counts() with the lens setup.
+#   density      : C/m^2 per ADU
+#   px_area      : screen area per pixel, m^2
+#   sat_adu      : ADU at or above which the
+#                  well is full
+#   noise_adu    : read noise above pedestal
+Calibration = collections.namedtuple('Calibration', ['density', 'px_area', 'pedestal', 'sat_adu', 'noise_adu'])
+
+
+def calibration(N, mag, SE, camera=frames.HAMAMATSU, pedestal=0.0):
+    full      = 2**camera.bits - 1
+    e_per_adu = camera.well/(full+1)
+    return Calibration(
+            density   = e_per_adu*cf.sigma_for_counts(1.0, SE=SE, N=N, mag=mag, px_length=camera.px_length, QE=camera.QE),
+            px_area   = np.power(camera.px_length/mag, 2),
+            pedestal  = pedestal,
+            sat_adu   = min(full, pedestal + camera.well/e_per_adu),
+            noise_adu = camera.noise
+            )
+
+
+# ====================================
+# Per-frame statistics
+# ====================================
+#   charge      : total charge in the frame, C
+#   peak        : highest density, C/mm^2
+#   saturated   : fraction of pixels at full
+#                 well
+#   below_noise : fraction of pixels under
+#                 the read noise
+stats_dtype = np.dtype([
+    ('charge'      , 'f8'),
+    ('peak'        , 'f8'),
+    ('saturated'   , 'f8'),
+    ('below_noise' , 'f8')
+    ])
+
+
+def _analyze(stack, start, stop, cal, out):
+    raw   = np.asarray(stack[start:stop])
+    npix  = float(raw.shape[1]*raw.shape[2])
+    stats = np.zeros(raw.shape[0], dtype=stats_dtype)
+    stats['saturated'] = np.count_nonzero(raw >= cal.sat_adu, axis=(1, 2))/npix
+
+    # C/m^2, in place on one float32 copy
+    dens  = raw.astype(np.float32)
+    dens -= np.float32(cal.pedestal)
+    stats['below_noise'] = np.count_nonzero(dens < np.float32(cal.noise_adu), axis=(1, 2))/npix
+    dens *= np.float32(cal.density)
+    stats['charge'] = dens.sum(axis=(1, 2), dtype=np.float64)*cal.px_area
+    stats['peak']   = dens.max(axis=(1, 2))*1e-6
+    if out is not None:
+        dens *= np.float32(1e-6)
+        out[start:stop] = dens
+    return stats
+
+
+# Runs over the stack batch frames at a time
+# on a thread pool (numpy releases the GIL
+# in the heavy loops); at most max_in_flight
+# batches are held in memory. With *out* (an
+# array or .npy path) the C/mm^2 density
+# maps are written there as float32.
+def analyze(stack, cal, batch=16, threads=None, max_in_flight=None, out=None):
+    n = len(stack)
+    if isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=np.float32, shape=tuple(stack.shape))
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if max_in_flight is None:
+        max_in_flight = 2*threads
+
+    stats = np.zeros(n, dtype=stats_dtype)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = collections.deque()
+        for start in range(0, n, batch):
+            pending.append((start, pool.submit(_analyze, stack, start, min(n, start+batch), cal, out)))
+            if len(pending) >= max_in_flight:
+                done, future = pending.popleft()
+                stats[done:done+batch] = future.result()
+        while pending:
+            done, future = pending.popleft()
+            stats[done:done+batch] = future.result()
+
+    if hasattr(out, 'flush'):
+        out.flush()
+    return stats
+
+
+if __name__ == '__main__':
+    import time
+    import WideSpectrumLanex as wsl
+
+    parser = argparse.ArgumentParser(description='Converts camera frame stacks to beam density and per-frame statistics.')
+    parser.add_argument('stack',
+            help='.npy, .tif/.tiff or raw frame stack')
+    parser.add_argument('--shape', type=int, nargs=2, metavar=('NY', 'NX'),
+            help='frame shape of a raw stack')
+    parser.add_argument('--offset', type=int, default=0,
+            help='header bytes of a raw stack')
+    parser.add_argument('-N', type=float, default=wsl.N_30cm,
+            help='lens f-number')
+    parser.add_argument('-m', '--mag', type=float, default=wsl.m_Ham,
+            help='magnification')
+    parser.add_argument('--pedestal', type=float, default=0.0,
+            help='dark level, ADU')
+    parser.add_argument('-b', '--batch', type=int, default=16,
+            help='frames per batch')
+    parser.add_argument('-j', '--threads', type=int, default=None,
+            help='worker threads')
+    parser.add_argument('-o', '--output',
+            help='.npy file for the C/mm^2 density maps')
+    parser.add_argument('-s', '--stats',
+            help='.npy file for the per-frame statistics')
+
+    arg = parser.parse_args()
+
+    stack = open_stack(arg.stack, shape=arg.shape, offset=arg.offset)
+    cal   = calibration(N=arg.N, mag=arg.mag, SE=wsl.SE, pedestal=arg.pedestal)
+
+    start = time.time()
+    stats = analyze(stack, cal, batch=arg.batch, threads=arg.threads, out=arg.output)
+    elapsed = time.time() - start
+
+    if arg.stats is not None:
+        np.save(arg.stats, stats)
+    print('{} frames of {}x{} in {:.2f} s ({:.0f} frames/s)'.format(len(stack), stack.shape[1], stack.shape[2], elapsed, len(stack)/elapsed))
+    print('Charge {:.3g} C/frame (median), {:.2%} saturated, {:.2%} below noise'.format(
+        np.median(stats['charge']), stats['saturated'].mean(), stats['below_noise'].mean()))
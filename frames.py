@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+import argparse
+import collections
+import multiprocessing
+import numpy as np
+import common_functions as cf
+
+# ====================================
+# Cameras
+# ====================================
+# well  : full well, electrons (the
+#         counts_max of WideSpectrumLanex)
+# noise : read noise, ADU
+# bits  : ADC depth; the well maps onto the
+#         full ADC range, so 40 ADU of noise
+#         is the fill_noise level
+Camera = collections.namedtuple('Camera', ['name', 'QE', 'px_length', 'well', 'noise', 'bits'])
+
+HAMAMATSU = Camera('Hamamatsu', QE=0.6, px_length=6.5e-6, well=30e3, noise=40.0, bits=16)
+
+
+# ====================================
+# Expected image
+# ====================================
+# Mean electrons per pixel for a beam
+# density map sigma (C/m^2, one value per
+# camera pixel) through the lens model of
+# common_functions.counts()
+def expected(sigma, SE, N, mag, camera=HAMAMATSU):
+    return cf.counts(sigma=sigma, SE=SE, N=N, mag=mag, px_length=camera.px_length, QE=camera.QE)
+
+
+# ====================================
+# Noise and readout
+# ====================================
+# Poisson shot noise on the electrons,
+# clipping at the full well, conversion to
+# ADU, Gaussian read noise and quantization
+# to the ADC range. mean is broadcast to
+# (n, ...) frames.
+def readout(mean, n, rng, camera=HAMAMATSU):
+    mean   = np.asarray(mean, dtype=np.float64)
+    shape  = (n,) + mean.shape
+    full   = 2**camera.bits - 1
+    dtype  = np.uint16 if camera.bits <= 16 else np.uint32
+
+    frames = rng.poisson(np.broadcast_to(mean, shape)).astype(np.float32)
+    np.minimum(frames, camera.well, out=frames)
+    frames *= np.float32((full+1)/camera.well)
+    frames += rng.standard_normal(shape, dtype=np.float32)*np.float32(camera.noise)
+    np.rint(frames, out=frames)
+    np.clip(frames, 0, full, out=frames)
+    return frames.astype(dtype)
+
+
+# ====================================
+# Batched generation
+# ====================================
+# Frames are made in batches of batch_size,
+# each from its own child of
+# SeedSequence(seed), so the output depends
+# only on the seed and batch_size, not on
+# the number of processes. At most
+# max_in_flight batches are queued or
+# waiting to be consumed.
+_worker = {}
+
+
+def _init(mean, camera):
+    _worker['mean']   = mean
+    _worker['camera'] = camera
+
+
+def _batch(task):
+    start, n, seed = task
+    rng = np.random.default_rng(seed)
+    return start, readout(_worker['mean'], n, rng, camera=_worker['camera'])
+
+
+def _tasks(n_frames, batch_size, seed):
+    n_batches = -(-n_frames//batch_size)
+    seeds     = np.random.SeedSequence(seed).spawn(n_batches)
+    for i, child in enumerate(seeds):
+        start = i*batch_size
+        yield start, min(batch_size, n_frames-start), child
+
+
+# Yields (first frame index, frames) in order
+def generate(mean, n_frames, batch_size=64, seed=None, processes=None, max_in_flight=None, camera=HAMAMATSU):
+    mean  = np.asarray(mean, dtype=np.float64)
+    tasks = _tasks(n_frames, batch_size, seed)
+
+    if processes == 1:
+        _init(mean, camera)
+        for task in tasks:
+            yield _batch(task)
+        return
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    if max_in_flight is None:
+        max_in_flight = 2*processes
+
+    pool = multiprocessing.Pool(processes=processes, initializer=_init, initargs=(mean, camera))
+    try:
+        pending = collections.deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_batch, (task,)))
+            if len(pending) >= max_in_flight:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def simulate(mean, n_frames, **kwargs):
+    out = None
+    for start, frames in generate(mean, n_frames, **kwargs):
+        if out is None:
+            out = np.empty((n_frames,) + frames.shape[1:], dtype=frames.dtype)
+        out[start:start+frames.shape[0]] = frames
+    return out
+
+
+# Streams frames into an .npy file that can
+# be opened memory-mapped
+def write(path, mean, n_frames, **kwargs):
+    camera = kwargs.get('camera', HAMAMATSU)
+    dtype  = np.uint16 if camera.bits <= 16 else np.uint32
+    out    = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=(n_frames,)+np.shape(mean))
+    for start, frames in generate(mean, n_frames, **kwargs):
+        out[start:start+frames.shape[0]] = frames
+    out.flush()
+    del out
+    return path
+
+
+if __name__ == '__main__':
+    import time
+    import WideSpectrumLanex as wsl
+
+    parser = argparse.ArgumentParser(description='Generates synthetic Hamamatsu frames of a Gaussian beam spot.')
+    parser.add_argument('-n', '--frames', type=int, default=1000,
+            help='number of frames')
+    parser.add_argument('--size', type=int, default=256,
+            help='frame size in pixels')
+    parser.add_argument('-b', '--batch', type=int, default=64,
+            help='frames per batch')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='worker processes')
+    parser.add_argument('-s', '--seed', type=int, default=0,
+            help='random seed')
+    parser.add_argument('-o', '--output',
+            help='.npy file for the frames')
+
+    arg = parser.parse_args()
+
+    # Beam spot at the saturation density,
+    # 30-cm FOV setup
+    y, x  = np.mgrid[-1:1:arg.size*1j, -1:1:arg.size*1j]
+    sigma = wsl.points_of_interest()['sigma_sat']*np.exp(-(x*x+y*y)/(2*0.2**2))
+    mean  = expected(sigma, SE=wsl.SE, N=wsl.N_30cm, mag=wsl.m_Ham)
+
+    start = time.time()
+    if arg.output is not None:
+        write(arg.output, mean, arg.frames, batch_size=arg.batch, seed=arg.seed, processes=arg.processes)
+    else:
+        for _ in generate(mean, arg.frames, batch_size=arg.batch, seed=arg.seed, processes=arg.processes):
+            pass
+    elapsed = time.time() - start
+    print('{} frames of {}x{} in {:.2f} s ({:.0f} frames/s)'.format(arg.frames, arg.size, arg.size, elapsed, arg.frames/elapsed))
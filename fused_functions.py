@@ -0,0 +1,136 @@
+import numpy as np
+import common_functions as cf
+
+# numexpr evaluates a whole expression in one
+# pass over memory; without it each kernel is
+# a short chain of in-place ufuncs on *out*.
+try:
+    import numexpr as ne
+except ImportError:
+    ne = None
+
+
+# ====================================
+# Output buffers
+# ====================================
+def _out(out, dtype, *args):
+    if out is None:
+        shape = np.broadcast(*args).shape
+        out = np.empty(shape, dtype=np.float64 if dtype is None else dtype)
+    return out
+
+
+# The in-place chains below write *out*
+# before reading every input, so an input
+# sharing memory with *out* is copied first
+def _unalias(out, *args):
+    return [np.array(arg) if isinstance(arg, np.ndarray) and np.may_share_memory(arg, out) else arg for arg in args]
+
+
+def _evaluate(expr, out, local_dict):
+    ne.evaluate(expr, local_dict=local_dict, out=out, casting='same_kind')
+    return out
+
+
+# ====================================
+# Fused kernels
+# ====================================
+# Same results as common_functions, with the
+# algebra collapsed so no full-size
+# temporaries are allocated. Pass out= to
+# reuse a buffer, dtype=np.float32 for
+# single precision.
+
+# h_obj = -h_img*o/img(f, o) = -h_img*(o-f)/f
+def h_obj_fused(h_img, o, f, out=None, dtype=None):
+    out = _out(out, dtype, h_img, o, f)
+    h_img, o, f = _unalias(out, h_img, o, f)
+    if ne is not None:
+        return _evaluate('-h_img*(o-f)/f', out, dict(h_img=h_img, o=o, f=f))
+    np.subtract(o, f, out=out)
+    np.divide(out, f, out=out)
+    np.multiply(out, h_img, out=out)
+    np.negative(out, out=out)
+    return out
+
+
+# ap_fr = pi*(f/2N)^2/(4*pi*o^2) = (f/(4*N*o))^2
+def ap_fr_fused(f, N, o, out=None, dtype=None):
+    out = _out(out, dtype, f, N, o)
+    f, N, o = _unalias(out, f, N, o)
+    if ne is not None:
+        return _evaluate('(f/(4*N*o))**2', out, dict(f=f, N=N, o=o))
+    np.multiply(N, o, out=out)
+    np.multiply(out, 4.0, out=out)
+    np.divide(f, out, out=out)
+    np.square(out, out=out)
+    return out
+
+
+def ap_fr_mag_fused(N, m, out=None, dtype=None):
+    out = _out(out, dtype, N, m)
+    N, m = _unalias(out, N, m)
+    if ne is not None:
+        return _evaluate('(m/((m-1)*4*N))**2', out, dict(N=N, m=m))
+    np.subtract(m, 1.0, out=out)
+    np.multiply(out, N, out=out)
+    np.multiply(out, 4.0, out=out)
+    np.divide(m, out, out=out)
+    np.square(out, out=out)
+    return out
+
+
+# counts = sigma*SE*QE*ap_fr_mag*(px/m)^2
+#        = sigma*SE*QE*(px/(4*N*(m-1)))^2
+def counts_fused(sigma, SE, N, mag, px_length, QE, out=None, dtype=None):
+    out = _out(out, dtype, sigma, SE, N, mag, px_length, QE)
+    sigma, SE, N, mag, px_length, QE = _unalias(out, sigma, SE, N, mag, px_length, QE)
+    if ne is not None:
+        return _evaluate(
+                'sigma*SE*QE*(px_length/(4*N*(mag-1)))**2', out,
+                dict(sigma=sigma, SE=SE, N=N, mag=mag, px_length=px_length, QE=QE)
+                )
+    np.subtract(mag, 1.0, out=out)
+    np.multiply(out, N, out=out)
+    np.multiply(out, 4.0, out=out)
+    np.divide(px_length, out, out=out)
+    np.square(out, out=out)
+    np.multiply(out, sigma, out=out)
+    np.multiply(out, SE, out=out)
+    np.multiply(out, QE, out=out)
+    return out
+
+
+# ====================================
+# Numerical check
+# ====================================
+# Compares every fused kernel against the
+# reference in common_functions over random
+# inputs in the ranges the scripts use.
+# Returns the worst relative error of each.
+def check(n=100000, dtype=None, seed=0):
+    rng = np.random.RandomState(seed)
+
+    sigma     = np.power(10.0, rng.uniform(-10, -1, n))
+    SE        = rng.uniform(0.5, 2.0, n)*1.75e9/1e-12*4*np.pi
+    N         = rng.uniform(1.0, 16.0, n)
+    m         = -np.power(10.0, rng.uniform(-2, 0.5, n))
+    px_length = rng.uniform(2e-6, 2e-5, n)
+    QE        = rng.uniform(0.1, 0.9, n)
+    f         = rng.uniform(10e-3, 100e-3, n)
+    o         = f*rng.uniform(2.0, 200.0, n)
+    h_img     = -rng.uniform(1e-3, 30e-3, n)
+
+    cases = dict(
+            counts    = (cf.counts(sigma, SE, N, m, px_length, QE), counts_fused(sigma, SE, N, m, px_length, QE, dtype=dtype)),
+            ap_fr_mag = (cf.ap_fr_mag(N, m), ap_fr_mag_fused(N, m, dtype=dtype)),
+            ap_fr     = (cf.ap_fr(f, N, o), ap_fr_fused(f, N, o, dtype=dtype)),
+            h_obj     = (cf.h_obj(h_img=h_img, o=o, f=f), h_obj_fused(h_img, o, f, dtype=dtype))
+            )
+    return dict((name, np.max(np.abs(fused/ref - 1))) for name, (ref, fused) in cases.items())
+
+
+if __name__ == '__main__':
+    for dtype in [np.float64, np.float32]:
+        for name, err in sorted(check(dtype=dtype).items()):
+            print('{:10s} {:8s} max rel. error {:.2e}'.format(name, np.dtype(dtype).name, err))
@@ -0,0 +1,283 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ====================================
+# Stage instrumentation
+# ====================================
+# Times and counts named stages:
+#
+#   with instrument.stage('region'):
+#       ...
+#   for i, g in instrument.iterate('energy', gammas):
+#       ...
+#   with instrument.stage('scan') as stage:
+#       ...
+#       stage.note(n_energies=n)
+#
+# Off by default; then stage() hands back one
+# shared do-nothing context manager, so the
+# calls can stay in the scripts. enable()
+# turns it on, optionally with tracemalloc
+# peaks per stage and a logger (e.g. the one
+# from mt.mylogger) that gets a debug line
+# per stage and the summary from log_summary().
+
+
+class _Null(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def note(self, **args):
+        pass
+
+
+_NULL = _Null()
+
+
+class _Stage(object):
+    def __init__(self, profiler, name, args):
+        self.profiler = profiler
+        self.name     = name
+        self.args     = args
+        self.peak     = 0
+
+    def __enter__(self):
+        self.profiler._push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop = time.perf_counter()
+        self.profiler._pop(self)
+        return False
+
+    # Arguments only known once the stage has
+    # run, e.g. how many points it evaluated
+    def note(self, **args):
+        self.args.update(args)
+
+
+# Per-name aggregate
+class StageStats(object):
+    def __init__(self):
+        self.count    = 0
+        self.total    = 0.0
+        self.min      = float('inf')
+        self.max      = 0.0
+        self.mem_peak = 0
+
+    def add(self, duration, mem_peak=0):
+        self.count   += 1
+        self.total   += duration
+        self.min      = min(self.min, duration)
+        self.max      = max(self.max, duration)
+        self.mem_peak = max(self.mem_peak, mem_peak)
+
+    def as_dict(self):
+        return dict(
+                count      = self.count,
+                total_s    = self.total,
+                mean_s     = self.total/self.count if self.count else 0.0,
+                min_s      = self.min if self.count else 0.0,
+                max_s      = self.max,
+                mem_peak_b = self.mem_peak
+                )
+
+
+class Profiler(object):
+    def __init__(self):
+        self.enabled    = False
+        self.memory     = False
+        self.logger     = None
+        self.max_events = None
+        self.reset()
+
+    def reset(self):
+        self.stats    = {}
+        self.counters = {}
+        self.events   = []
+        self.t0       = time.perf_counter()
+        self._local   = threading.local()
+
+    def enable(self, memory=False, logger=None, max_events=None):
+        self.enabled    = True
+        self.logger     = logger
+        self.max_events = max_events
+        self.memory     = memory
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def disable(self):
+        self.enabled = False
+        if self.memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.memory = False
+
+    # ====================================
+    # Recording
+    # ====================================
+    def stage(self, name, **args):
+        if not self.enabled:
+            return _NULL
+        return _Stage(self, name, args)
+
+    # Decorator: every call is one stage
+    def timed(self, name):
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                with _Stage(self, name, {}):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    # Yields (i, item), timing each pass of the
+    # loop body as one stage called *name*
+    def iterate(self, name, iterable, **args):
+        if not self.enabled:
+            for item in enumerate(iterable):
+                yield item
+            return
+        for i, item in enumerate(iterable):
+            with self.stage(name, i=i, **args):
+                yield i, item
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    # A duration measured elsewhere, e.g. a
+    # worker process timed by its parent
+    def record(self, name, duration, **args):
+        if not self.enabled:
+            return
+        self.stats.setdefault(name, StageStats()).add(duration)
+        self._event(name, time.perf_counter()-duration, duration, args)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    # tracemalloc keeps a single peak, so it is
+    # folded into every open stage and reset at
+    # each boundary
+    def _fold_peak(self, stack):
+        if not self.memory:
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in stack:
+            frame.peak = max(frame.peak, peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def _push(self, frame):
+        stack = self._stack()
+        self._fold_peak(stack)
+        stack.append(frame)
+
+    def _pop(self, frame):
+        stack = self._stack()
+        self._fold_peak(stack)
+        stack.remove(frame)
+
+        duration = frame.stop - frame.start
+        self.stats.setdefault(frame.name, StageStats()).add(duration, frame.peak)
+        self._event(frame.name, frame.start, duration, frame.args)
+        if self.logger is not None:
+            self.logger.debug('Stage {}: {:.6f} s{}'.format(
+                frame.name, duration,
+                ', peak {:.1f} MB'.format(frame.peak/1e6) if self.memory else ''))
+
+    def _event(self, name, start, duration, args):
+        if self.max_events is not None and len(self.events) >= self.max_events:
+            return
+        self.events.append((name, start-self.t0, duration, threading.current_thread().ident, args))
+
+    # ====================================
+    # Reports
+    # ====================================
+    def report(self):
+        out = dict(
+                stages   = dict((name, st.as_dict()) for name, st in self.stats.items()),
+                counters = dict(self.counters),
+                wall_s   = time.perf_counter() - self.t0
+                )
+        if resource is not None:
+            # Linux reports kB, macOS bytes
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            out['maxrss_b'] = maxrss if sys.platform == 'darwin' else maxrss*1024
+        if self.memory and tracemalloc.is_tracing():
+            out['traced_peak_b'] = max([st.mem_peak for st in self.stats.values()] + [tracemalloc.get_traced_memory()[1]])
+        return out
+
+    # Chrome trace event format, for
+    # chrome://tracing or Perfetto
+    def trace(self):
+        pid = os.getpid()
+        return dict(traceEvents=[
+            dict(name=name, ph='X', ts=start*1e6, dur=duration*1e6, pid=pid, tid=tid,
+                 args=dict((k, _jsonable(v)) for k, v in args.items()))
+            for name, start, duration, tid, args in self.events
+            ])
+
+    def write(self, path, trace_path=None):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2, sort_keys=True)
+        if trace_path is not None:
+            with open(trace_path, 'w') as f:
+                json.dump(self.trace(), f)
+
+    def log_summary(self, logger=None):
+        logger = self.logger if logger is None else logger
+        if logger is None:
+            return
+        for name, st in sorted(self.stats.items(), key=lambda item: -item[1].total):
+            logger.info('{:30s} {:6d} x {:10.6f} s = {:10.4f} s'.format(
+                name, st.count, st.total/st.count, st.total))
+        for name, n in sorted(self.counters.items()):
+            logger.info('{:30s} {:6d}'.format(name, n))
+
+
+def _jsonable(value):
+    try:
+        json.dumps(value)
+        return value
+    except TypeError:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return repr(value)
+
+
+# ====================================
+# Module-level profiler
+# ====================================
+profiler = Profiler()
+
+stage       = profiler.stage
+timed       = profiler.timed
+iterate     = profiler.iterate
+count       = profiler.count
+record      = profiler.record
+enable      = profiler.enable
+disable     = profiler.disable
+report      = profiler.report
+write       = profiler.write
+log_summary = profiler.log_summary
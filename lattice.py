@@ -0,0 +1,216 @@
+import collections
+import numpy as np
+import twiss_batch
+
+
+# ====================================
+# Shared matrix cache
+# ====================================
+# One per family of variants. Holds element
+# matrices keyed by (index, scale, K1,
+# length), and products over runs of
+# elements that no variant changes: the
+# prefix [0, k) and suffix [k, n) at each
+# scale. LRU bounded by max_entries.
+class _Cache(object):
+    __slots__ = ('entries', 'max_entries', 'hits', 'misses')
+
+    def __init__(self, max_entries):
+        self.entries     = collections.OrderedDict()
+        self.max_entries = max_entries
+        self.hits        = 0
+        self.misses      = 0
+
+    def get(self, key):
+        try:
+            value = self.entries[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    # Cached matrices are handed out as they
+    # are, so they are made read-only
+    def put(self, key, value):
+        for M in value:
+            M.flags.writeable = False
+        self.entries[key] = value
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return value
+
+
+# ====================================
+# Immutable beamline
+# ====================================
+# Elements live in a read-only
+# twiss_batch.element_table shared by every
+# variant. A variant only stores its gamma
+# and the (index, K1, length) overrides that
+# differ from the table, so with_gamma(),
+# with_K1() and with_length() cost a small
+# object, and transfer() reuses the cached
+# matrices of everything the change does not
+# touch: elements before the first and after
+# the last override come from the prefix and
+# suffix products.
+class Lattice(object):
+    __slots__ = ('table', 'names', 'gamma0', 'gamma', 'beam_x', 'beam_y', 'edges', '_over', '_cache')
+
+    def __init__(self, table, gamma0, beam_x, beam_y, names=None, gamma=None, edges=False, overrides=(), cache=None, max_entries=4096):
+        if table.flags.writeable:
+            table = table.copy()
+            table.flags.writeable = False
+        init = object.__setattr__
+        init(self, 'table' , table)
+        init(self, 'names' , tuple(names) if names is not None else tuple(str(i) for i in range(len(table))))
+        init(self, 'gamma0', gamma0)
+        init(self, 'gamma' , gamma0 if gamma is None else gamma)
+        init(self, 'beam_x', beam_x)
+        init(self, 'beam_y', beam_y)
+        init(self, 'edges' , edges)
+        init(self, '_over' , tuple(overrides))
+        init(self, '_cache', _Cache(max_entries) if cache is None else cache)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Lattice is immutable; use with_gamma(), with_K1() or with_length()')
+
+    @classmethod
+    def from_beamline(cls, beamline, edges=False, **kwargs):
+        return cls(twiss_batch.element_table(beamline.elements), beamline.gamma, beamline.beam_x, beamline.beam_y,
+                names=[element.name for element in beamline.elements], edges=edges, **kwargs)
+
+    def __len__(self):
+        return len(self.table)
+
+    def __repr__(self):
+        return 'Lattice({} elements, gamma={:g}, overrides={})'.format(len(self), self.gamma, self.overrides())
+
+    def index(self, element):
+        if isinstance(element, str):
+            try:
+                return self.names.index(element)
+            except ValueError:
+                raise KeyError('No element named {}'.format(element))
+        return int(element)
+
+    # ====================================
+    # Variants
+    # ====================================
+    def _variant(self, gamma=None, overrides=None):
+        return Lattice(self.table, self.gamma0, self.beam_x, self.beam_y, names=self.names,
+                gamma=self.gamma if gamma is None else gamma, edges=self.edges,
+                overrides=self._over if overrides is None else overrides, cache=self._cache)
+
+    def _override(self, element, K1=None, length=None):
+        i    = self.index(element)
+        over = dict((j, (k, l)) for j, k, l in self._over)
+        k, l = over.get(i, (None, None))
+        k    = k if K1 is None else float(K1)
+        l    = l if length is None else float(length)
+        if i in over or k is not None or l is not None:
+            over[i] = (k, l)
+        return self._variant(overrides=tuple(sorted((j, k, l) for j, (k, l) in over.items())))
+
+    def with_gamma(self, gamma):
+        return self._variant(gamma=gamma)
+
+    def with_K1(self, element, K1):
+        i = self.index(element)
+        if self.table[i]['type'] != twiss_batch.QUAD:
+            raise ValueError('{} is not a quad'.format(self.names[i]))
+        return self._override(i, K1=K1)
+
+    def with_length(self, element, length):
+        return self._override(element, length=length)
+
+    # Overrides in the form twiss_batch takes
+    def overrides(self):
+        out = {}
+        for i, K1, length in self._over:
+            out[i] = {}
+            if K1 is not None:
+                out[i]['K1'] = np.asarray(K1)
+            if length is not None:
+                out[i]['length'] = np.asarray(length)
+        return out
+
+    # ====================================
+    # Transfer matrices
+    # ====================================
+    @property
+    def scale(self):
+        return float(self.gamma0)/float(self.gamma)
+
+    def _element(self, i, scale, K1=None, length=None):
+        key = ('element', i, scale, K1, length, self.edges)
+        R   = self._cache.get(key)
+        if R is None:
+            R = self._cache.put(key, twiss_batch.element_matrices(self.table[i], scale, K1=K1, length=length, edges=self.edges))
+        return R
+
+    # Products of the unchanged elements, built
+    # in a loop from the nearest cached product
+    # (or the identity); only the one asked
+    # for is cached
+    def _nearest(self, kind, scale, k, stop, step):
+        j = k
+        while (stop-j)*step > 0:
+            if (kind, j, scale, self.edges) in self._cache.entries:
+                return j, self._cache.get((kind, j, scale, self.edges))
+            j += step
+        return stop, (twiss_batch._eye(()), twiss_batch._eye(()))
+
+    # [0, k)
+    def _prefix(self, scale, k):
+        key = ('prefix', k, scale, self.edges)
+        M   = self._cache.get(key)
+        if M is None:
+            j, (Mx, My) = self._nearest('prefix', scale, k-1, 0, -1)
+            for i in range(j, k):
+                Rx, Ry = self._element(i, scale)
+                Mx, My = np.dot(Rx, Mx), np.dot(Ry, My)
+            M = self._cache.put(key, (Mx, My))
+        return M
+
+    # [k, n)
+    def _suffix(self, scale, k):
+        key = ('suffix', k, scale, self.edges)
+        M   = self._cache.get(key)
+        if M is None:
+            n = len(self.table)
+            j, (Mx, My) = self._nearest('suffix', scale, k+1, n, 1)
+            for i in range(j-1, k-1, -1):
+                Rx, Ry = self._element(i, scale)
+                Mx, My = np.dot(Mx, Rx), np.dot(My, Ry)
+            M = self._cache.put(key, (Mx, My))
+        return M
+
+    # 3x3 plane matrices [u, u', delta] of
+    # this variant
+    def transfer(self):
+        scale = self.scale
+        if not self._over:
+            return self._prefix(scale, len(self.table))
+
+        over   = dict((i, (K1, length)) for i, K1, length in self._over)
+        lo, hi = self._over[0][0], self._over[-1][0]
+        Mx, My = self._prefix(scale, lo)
+        for i in range(lo, hi+1):
+            Rx, Ry = self._element(i, scale, *over.get(i, (None, None)))
+            Mx, My = np.dot(Rx, Mx), np.dot(Ry, My)
+        Sx, Sy = self._suffix(scale, hi+1)
+        return np.dot(Sx, Mx), np.dot(Sy, My)
+
+    def beam_end(self):
+        Mx, My = self.transfer()
+        sigx   = twiss_batch.spotsize(Mx, self.beam_x.beta, self.beam_x.alpha, self.beam_x.emit)
+        sigy   = twiss_batch.spotsize(My, self.beam_y.beta, self.beam_y.alpha, self.beam_y.emit)
+        return sigx, sigy, 1.0/(sigx*sigy)
+
+    # Many energies with this variant's
+    # overrides, in one batched pass
+    def scan(self, gamma):
+        return twiss_batch.beam_end(self.table, self.gamma0, gamma, self.beam_x, self.beam_y, overrides=self.overrides(), edges=self.edges)
@@ -1,19 +1,30 @@
 #!/usr/bin/env python
 
-import ElegantPy
 import matplotlib.gridspec as gridspec
 import matplotlib.pyplot as plt
 import mytools as mt
 import numpy as np
 import os
 import slactrac as sltr
-import copy
+import adaptive
+import elegant_cache
+import energy_spread
+import instrument
+import quad_scan
+import results_store
+import surrogate
 
 # ======================================
 # Start logger
 # ======================================
 logger = mt.mylogger(filename='worksheet')
 
+# Stage timings and memory peaks, written
+# to profile.json and profile_trace.json
+profile = False
+if profile:
+    instrument.enable(memory=True, logger=logger)
+
 # ======================================
 # Define beamline
 # ======================================
@@ -39,7 +50,7 @@ LBEND2DUMP1   = sltr.Drift( name = 'LBEND2DUMP1'   , length = 8.795E+00 )
 LDUMP12ELANEX = sltr.Drift( name = 'LDUMP12ELANEX' , length = 0.06      )
 LELANEX2DUMP2 = sltr.Drift( name = 'LELANEX2DUMP2' , length = 0.06      )
 
-gamma    = np.float_(39824)
+gamma    = np.float64(39824)
 #  gamma = sltr.GeV2gamma(30.0)
 emit = 100e-6/gamma
 beam_x = sltr.BeamParams(
@@ -97,7 +108,7 @@ supersimpledumpline=sltr.Beamline(
 # Run elegant and load simulation
 # ======================================
 
-dir_elegant = os.path.join(os.getcwdu(),'temp')
+dir_elegant = os.path.join(os.getcwd(),'temp')
 #  path,root,ext = sltr.elegant_sim(
 #         beamline              = supersimpledumpline   ,
 #         beam_pCentral         = sltr.GeV2gamma(20.35) ,
@@ -110,7 +121,10 @@ dir_elegant = os.path.join(os.getcwdu(),'temp')
 
 # ele_path = os.path.join(path,root+ext)
 # 
-# ESim = ElegantPy.ElegantSim(ele_path)
+# Columns are read from the particle file
+# only when used (here x, y and delta)
+# import sdds_reader
+# ESim = sdds_reader.LazyElegantSim(ele_path)
 
 # ======================================
 # Create plots
@@ -140,41 +154,111 @@ dir_elegant = os.path.join(os.getcwdu(),'temp')
 # Offset energies
 # ======================================
 
-energy_list_GeV = np.linspace(10,80,501)
+energy_range_GeV  = (10,80)
+energy_list_GeV   = np.linspace(energy_range_GeV[0],energy_range_GeV[1],501)
 energy_list_gamma = sltr.GeV2gamma(energy_list_GeV)
 
-rho = np.zeros(energy_list_gamma.size)
-sigx = np.zeros(energy_list_gamma.size)
-sigy = np.zeros(energy_list_gamma.size)
+runelegant = False
+
+# Visibility averaged over a Gaussian
+# momentum spread of RMS spread_sigma_dp at
+# each central energy, drawn next to the
+# monoenergetic curve
+spread_scan     = False
+spread_sigma_dp = 1e-2
 
-orig_beamline = copy.deepcopy(supersimpledumpline)
+# Sample energies adaptively, refining only
+# where the curves bend, with at most as many
+# points as the uniform list
+adaptive_scan = True
+adaptive_tol  = 1e-2
+
+# Scans are kept in results/, keyed on the
+# beamline and energies, and reopened
+# memory-mapped on later runs
+results = results_store.ResultsStore(os.path.join(os.getcwd(),'results'))
+scan_params = dict(
+        beamline          = elegant_cache.beamline_desc(supersimpledumpline),
+        energy_list_gamma = energy_list_gamma,
+        adaptive_tol      = adaptive_tol if adaptive_scan else None,
+        runelegant        = runelegant,
+        n_particles       = 1e5 if runelegant else None
+        )
 
-for i,energy_gamma in enumerate(energy_list_gamma):
-    beamline = copy.deepcopy(supersimpledumpline)
-    beamline.gamma = energy_gamma
-    runelegant = False
+def energy_scan():
     if runelegant:
-        path,root,ext = sltr.elegant_sim(
-                beamline              = beamline,
-                beam_pCentral         = energy_gamma        ,
-                lattice_pCentral      = energy_gamma        ,
-                n_particles_per_bunch = 1e5                 ,
-                sigma_dp              = 0                   ,
-                dir                   = dir_elegant         ,
-                filename              = 'out_{:02.0f}.ele'.format(i)
+        # One isolated elegant run per energy
+        # across a process pool
+        evaluate = adaptive.elegant_evaluator(
+                beamline    = supersimpledumpline ,
+                to_gamma    = sltr.GeV2gamma      ,
+                n_particles = 1e5                 ,
+                sigma_dp    = 0                   ,
+                dir         = dir_elegant         ,
+                timeout     = 3600                ,
+                retries     = 1                   ,
+                cache       = elegant_cache.ResultCache(
+                    os.path.join(dir_elegant, 'cache'),
+                    max_bytes = 10e9
+                    )
                 )
-        
-        ele_path = os.path.join(path,root+ext)
-        
-        ESim = ElegantPy.ElegantSim(ele_path)
-
-        sigx[i] = np.std(ESim.Bunch.x)
-        sigy[i] = np.std(ESim.Bunch.y)
     else:
-        sigx[i] = beamline.beam_x_end.spotsize
-        sigy[i] = beamline.beam_y_end.spotsize
+        # All energies in one batched pass
+        evaluate = adaptive.twiss_evaluator(supersimpledumpline, sltr.GeV2gamma)
+
+    with instrument.stage('my.scan') as stage:
+        if adaptive_scan:
+            energy, values, info = adaptive.sample(evaluate, energy_range_GeV[0], energy_range_GeV[1], tol=adaptive_tol, max_points=len(energy_list_GeV))
+            logger.info('Adaptive scan: {n_points} energies in {rounds} rounds'.format(**info))
+        else:
+            energy, values = energy_list_GeV, evaluate(energy_list_GeV)
+        # Energies actually evaluated
+        stage.note(n_energies=len(energy))
+    return dict(energy_list_GeV=energy, sigx=values['sigx'], sigy=values['sigy'], rho=values['rho'])
+
+# Failed elegant jobs come back as NaN;
+# such scans are not stored
+scan = results_store.cached(results, 'energy_scan_elegant' if runelegant else 'energy_scan', scan_params, energy_scan, finite=True)
+energy_list_GeV = scan['energy_list_GeV']
+sigx, sigy, rho = scan['sigx'], scan['sigy'], scan['rho']
+
+# Spot size surrogate over energy_range_GeV:
+# later processes reopen it from results/
+# and query any energies without the
+# beamline
+def build_surrogate():
+    evaluate = adaptive.twiss_evaluator(supersimpledumpline, sltr.GeV2gamma)
+    return surrogate.build(evaluate, energy_range_GeV[0], energy_range_GeV[1]).arrays()
 
-    rho[i] = 1.0/(sigx[i]*sigy[i])
+surrogate_params = dict(beamline=scan_params['beamline'], energy_range_GeV=energy_range_GeV)
+spot_surrogate   = surrogate.Surrogate(**results_store.cached(results, 'surrogate', surrogate_params, build_surrogate))
+logger.info('Surrogate: {} intervals, estimated relative error sigx {:.2g}, sigy {:.2g}, rho {:.2g}'.format(spot_surrogate.edges.size-1, *spot_surrogate.error))
+
+# ======================================
+# Quad settings scan
+# ======================================
+# Visibility over a grid of
+# (QS0_K1, QS1_K1, QS2_K1) settings around
+# the design, with d(rho)/d(K1) of each
+# quad, in one batched pass
+scan_quads   = False
+quad_range   = 0.2
+quad_steps   = 11
+
+if scan_quads:
+    quads    = quad_scan.QuadScan.from_beamline(supersimpledumpline)
+    quad_K1  = quad_scan.grid(*[K1*np.linspace(1-quad_range, 1+quad_range, quad_steps) for K1 in quads.K1])
+    quad_params = dict(scan_params, quad_K1=quad_K1)
+
+    def run_quad_scan():
+        with instrument.stage('my.quad_scan', n_settings=len(quad_K1), n_energies=len(energy_list_GeV)):
+            out = quads.scan(quad_K1, sltr.GeV2gamma(energy_list_GeV), derivatives=True)
+        out['K1'] = quad_K1
+        return out
+
+    quad_res = results_store.cached(results, 'quad_scan', quad_params, run_quad_scan)
+    best     = np.argmax(np.nanmean(quad_res['rho'], axis=-1))
+    logger.info('Quad scan: best mean visibility at K1 = {}'.format(quad_res['K1'][best]))
 
 fig=plt.figure()
 gs=gridspec.GridSpec(1,1)
@@ -182,12 +266,16 @@ ax = fig.add_subplot(gs[0,0])
 
 sigx_inv = 1.0/sigx
 sigy_inv = 1.0/sigy
-sigx_inv_norm = sigx_inv/np.max(sigx_inv)
-sigy_inv_norm = sigy_inv/np.max(sigy_inv)
+sigx_inv_norm = sigx_inv/np.nanmax(sigx_inv)
+sigy_inv_norm = sigy_inv/np.nanmax(sigy_inv)
 
-ax.semilogy(energy_list_GeV,rho/np.max(rho),'-',label='$1/(\sigma_x \sigma_y)$')
+ax.semilogy(energy_list_GeV,rho/np.nanmax(rho),'-',label='$1/(\sigma_x \sigma_y)$')
 ax.semilogy(energy_list_GeV,sigx_inv_norm,'-',label='$\sigma_x$')
 ax.semilogy(energy_list_GeV,sigy_inv_norm,'-',label='$\sigma_y$')
+if spread_scan:
+    with instrument.stage('my.spread_scan', n_energies=len(energy_list_GeV)):
+        spread = energy_spread.beamline_scan(supersimpledumpline, sltr.GeV2gamma(energy_list_GeV), energy_spread.gaussian(spread_sigma_dp))
+    ax.semilogy(energy_list_GeV,spread['rho']/np.nanmax(rho),'--',label='$1/(\sigma_x \sigma_y)$, $\sigma_\delta$={:g}%'.format(spread_sigma_dp*100))
 plt.legend(loc=0)
 
 mt.addlabel(ax=ax,xlabel='GeV',ylabel='[Normalized]',toplabel='Visibility, Design Energy {:02.2f} GeV'.format(sltr.gamma2GeV(gamma)))
@@ -195,9 +283,15 @@ mt.addlabel(ax=ax,xlabel='GeV',ylabel='[Normalized]',toplabel='Visibility, Desig
 ax.grid(which='Both',color='0.7',linestyle='-')
 ax.set_axisbelow(True)
 
-gs.tight_layout(fig)
+with instrument.stage('my.layout'):
+    gs.tight_layout(fig)
 
 #  fig.savefig('Visibility.tiff')
-fig.savefig('Visibility_DesignE_{:0.2f}GeV.png'.format(sltr.gamma2GeV(gamma)))
+with instrument.stage('my.savefig'):
+    fig.savefig('Visibility_DesignE_{:0.2f}GeV.png'.format(sltr.gamma2GeV(gamma)))
+
+if profile:
+    instrument.log_summary()
+    instrument.write('profile.json', trace_path='profile_trace.json')
 
 plt.show()
@@ -0,0 +1,154 @@
+import collections
+import itertools
+import numpy as np
+import common_functions as cf
+
+# ====================================
+# Parameter graph
+# ====================================
+# Inputs are set by name; derived nodes
+# declare the names they are computed from.
+# A node's cache key is built from the keys
+# of its inputs, so changing one input only
+# misses for the nodes downstream of it;
+# everything else is served from the cache.
+#
+# Scalars and small arrays are keyed by
+# value, so going back to an earlier value
+# hits again. Large arrays get a fresh
+# version on every set(), and the entries
+# keyed on the version it replaces (which
+# can never hit again) are dropped. Cached
+# values live in one LRU of at most
+# *max_entries*.
+_SMALL = 64
+_versions = itertools.count()
+
+
+def _token(value):
+    if isinstance(value, np.ndarray):
+        if value.size <= _SMALL:
+            return ('a', value.shape, value.dtype.str, value.tobytes())
+        return ('v', next(_versions))
+    if isinstance(value, np.generic):
+        value = value.item()
+    try:
+        hash(value)
+    except TypeError:
+        return ('v', next(_versions))
+    return ('s', type(value).__name__, value)
+
+
+def _contains(key, token):
+    if key == token:
+        return True
+    return isinstance(key, tuple) and any(_contains(part, token) for part in key)
+
+
+class Graph(object):
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.inputs      = {}
+        self.nodes       = collections.OrderedDict()
+        self.cache       = collections.OrderedDict()
+        self.hits        = 0
+        self.misses      = 0
+        self._tokens     = {}
+
+    def node(self, name, func, inputs):
+        if name in self.inputs:
+            raise ValueError('{} is already an input'.format(name))
+        self.nodes[name] = (func, tuple(inputs))
+        return self
+
+    def set(self, **values):
+        for name, value in values.items():
+            if name in self.nodes:
+                raise ValueError('{} is derived and cannot be set'.format(name))
+            old = self._tokens.get(name)
+            self.inputs[name]  = value
+            self._tokens[name] = _token(value)
+            if old is not None and old[0] == 'v':
+                self._drop(old)
+        return self
+
+    def _drop(self, token):
+        for key in [key for key in self.cache if _contains(key, token)]:
+            del self.cache[key]
+
+    def _key(self, name, memo):
+        if name in memo:
+            return memo[name]
+        if name in self.inputs:
+            key = self._tokens[name]
+        elif name in self.nodes:
+            _, inputs = self.nodes[name]
+            key = (name,) + tuple(self._key(dep, memo) for dep in inputs)
+        else:
+            raise KeyError('No input or node named {}'.format(name))
+        memo[name] = key
+        return key
+
+    def _get(self, name, memo):
+        if name in self.inputs:
+            return self.inputs[name]
+        key = self._key(name, memo)
+        try:
+            value = self.cache[key]
+        except KeyError:
+            pass
+        else:
+            self.cache.move_to_end(key)
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        func, inputs = self.nodes[name]
+        value = func(*[self._get(dep, memo) for dep in inputs])
+        self.cache[key] = value
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return value
+
+    def __getitem__(self, name):
+        return self._get(name, {})
+
+    def get(self, *names):
+        memo = {}
+        return [self._get(name, memo) for name in names]
+
+    # Names computed from *name*, directly or not
+    def dependents(self, name):
+        out = set([name])
+        grew = True
+        while grew:
+            grew = False
+            for node, (_, inputs) in self.nodes.items():
+                if node not in out and out.intersection(inputs):
+                    out.add(node)
+                    grew = True
+        out.discard(name)
+        return [node for node in self.nodes if node in out]
+
+    def clear(self):
+        self.cache.clear()
+
+
+# ====================================
+# Optical quantities
+# ====================================
+# Same algebra as common_functions.counts(),
+# split into cached steps. With
+# mag_input=True the magnification is set
+# directly (as in WideSpectrumLanex) instead
+# of derived from h_img and h_obj.
+def optics_graph(mag_input=False, max_entries=128):
+    graph = Graph(max_entries=max_entries)
+    if not mag_input:
+        graph.node('m', cf.mag, ['h_img', 'h_obj'])
+    graph.node('o'            , lambda f, m: cf.obj(f=f, m=m)  , ['f', 'm'])
+    graph.node('ap_fr_mag'    , cf.ap_fr_mag                     , ['N', 'm'])
+    graph.node('area_mapping' , lambda px, m: np.power(px/m, 2.0), ['px_length', 'm'])
+    graph.node('lens_fraction', lambda ap, area: ap*area         , ['ap_fr_mag', 'area_mapping'])
+    graph.node('counts'       , lambda sigma, SE, lens, QE: sigma*SE*lens*QE, ['sigma', 'SE', 'lens_fraction', 'QE'])
+    return graph
@@ -0,0 +1,127 @@
+import numpy as np
+import twiss_batch
+
+
+# ====================================
+# Quadrupole settings
+# ====================================
+# Outer product of per-quad K1 values as
+# an (n_settings, n_quads) array, first
+# quad slowest
+def grid(*K1_axes):
+    mesh = np.meshgrid(*[np.asarray(K1, dtype=np.float64) for K1 in K1_axes], indexing='ij')
+    return np.stack([K.ravel() for K in mesh], axis=-1)
+
+
+# ====================================
+# Batched quad x energy scan
+# ====================================
+# The beamline is cut at the scanned quads.
+# The pieces in between depend only on the
+# energy, so their matrices are built once
+# per energy and each setting costs one
+# quad matrix and one product per quad.
+#
+# Settings are handled in chunks of at most
+# chunk_size (setting, energy) pairs.
+class QuadScan(object):
+    def __init__(self, table, gamma0, beam_x, beam_y, quads, edges=False):
+        quads = list(quads)
+        for i in quads:
+            if table[i]['type'] != twiss_batch.QUAD:
+                raise ValueError('Element {} is not a quad'.format(i))
+        self.table  = table
+        self.gamma0 = gamma0
+        self.beam_x = beam_x
+        self.beam_y = beam_y
+        self.quads  = quads
+        self.edges  = edges
+
+    @classmethod
+    def from_beamline(cls, beamline, quads=('QS0', 'QS1', 'QS2'), edges=False):
+        names = [element.name for element in beamline.elements]
+        index = []
+        for name in quads:
+            if name not in names:
+                raise ValueError('No element named {}'.format(name))
+            index.append(names.index(name))
+        return cls(twiss_batch.element_table(beamline.elements), beamline.gamma, beamline.beam_x, beamline.beam_y, index, edges=edges)
+
+    # Design K1 of the scanned quads
+    @property
+    def K1(self):
+        return self.table['K1'][self.quads]
+
+    def _segments(self, scale):
+        # Quads in beamline order, with their
+        # column in the settings array
+        order = sorted(range(len(self.quads)), key=lambda k: self.quads[k])
+        cuts  = [-1] + [self.quads[k] for k in order] + [len(self.table)]
+        segs  = []
+        for start, stop in zip(cuts[:-1], cuts[1:]):
+            segs.append(twiss_batch.transfer_matrices(self.table[start+1:stop], scale, edges=self.edges))
+        return order, segs
+
+    # Plane matrices for settings K of shape
+    # (..., n_quads) against scale (E,):
+    # (..., E, 3, 3)
+    def _matrices(self, K, scale, order, segs):
+        Mx, My = segs[0]
+        for k, (Sx, Sy) in zip(order, segs[1:]):
+            Qx, Qy = twiss_batch.element_matrices(self.table[self.quads[k]], scale, K1=K[..., k, np.newaxis])
+            Mx = np.matmul(Sx, np.matmul(Qx, Mx))
+            My = np.matmul(Sy, np.matmul(Qy, My))
+        return Mx, My
+
+    def _spot(self, K, scale, order, segs):
+        Mx, My = self._matrices(K, scale, order, segs)
+        sigx = twiss_batch.spotsize(Mx, self.beam_x.beta, self.beam_x.alpha, self.beam_x.emit)
+        sigy = twiss_batch.spotsize(My, self.beam_y.beta, self.beam_y.alpha, self.beam_y.emit)
+        return sigx, sigy
+
+    # Returns sigx, sigy, rho as
+    # (n_settings, n_energies). With
+    # derivatives=True also drho (and
+    # dlog_rho = drho/rho) of shape
+    # (n_settings, n_quads, n_energies), by
+    # central differences of step h in K1,
+    # all evaluated in the same batch.
+    def scan(self, K1, gamma, derivatives=False, h=1e-6, chunk_size=2**20):
+        K1    = np.atleast_2d(np.asarray(K1, dtype=np.float64))
+        scale = self.gamma0/np.atleast_1d(np.asarray(gamma, dtype=np.float64))
+        n_set, n_q = K1.shape
+        if n_q != len(self.quads):
+            raise ValueError('Expected {} K1 values per setting, got {}'.format(len(self.quads), n_q))
+
+        order, segs = self._segments(scale)
+
+        # Variant 0 is the setting itself,
+        # 2k+1 and 2k+2 step quad k by +h, -h
+        n_var = 1 + 2*n_q if derivatives else 1
+        step  = np.zeros((n_var, n_q))
+        if derivatives:
+            step[1::2][np.arange(n_q), np.arange(n_q)] = h
+            step[2::2][np.arange(n_q), np.arange(n_q)] = -h
+
+        out = dict(
+                sigx = np.empty((n_set, scale.size)),
+                sigy = np.empty((n_set, scale.size))
+                )
+        if derivatives:
+            out['drho'] = np.empty((n_set, n_q, scale.size))
+
+        per = max(1, int(chunk_size)//(n_var*scale.size))
+        for start in range(0, n_set, per):
+            sl = slice(start, start+per)
+            K  = K1[sl, np.newaxis, :] + step
+            sigx, sigy = self._spot(K, scale, order, segs)
+            out['sigx'][sl] = sigx[:, 0]
+            out['sigy'][sl] = sigy[:, 0]
+            if derivatives:
+                rho = 1.0/(sigx*sigy)
+                out['drho'][sl] = (rho[:, 1::2] - rho[:, 2::2])/(2*h)
+
+        out['rho'] = 1.0/(out['sigx']*out['sigy'])
+        if derivatives:
+            out['dlog_rho'] = out['drho']/out['rho'][:, np.newaxis, :]
+        return out
@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+import argparse
+import importlib
+import multiprocessing
+import os
+
+# ====================================
+# Headless, parallel figure rendering
+# ====================================
+# Every analysis module lists its figures as
+#   FIGURES = [(builder_name, filename), ...]
+# where builder_name is a zero-argument function
+# returning a matplotlib figure. Each figure is
+# built and saved in a worker process on the Agg
+# backend; nothing is shown or opened.
+#
+# Workers are fresh interpreters, so module-level
+# flags set by a script's main() are passed on as
+# *settings* (attribute name -> value) and set on
+# each module before its figures are built.
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def _render(job):
+    module_name, builder, outdir, filename, dpi, settings = job
+    import matplotlib.pyplot as plt
+
+    module = importlib.import_module(module_name)
+    for name, value in settings.items():
+        setattr(module, name, value)
+    fig    = getattr(module, builder)()
+    path   = os.path.join(outdir, filename)
+    fig.savefig(path, dpi=dpi)
+    plt.close(fig)
+    return path
+
+
+def jobs_for(module_names, outdir, dpi=None, settings=None):
+    settings = {} if settings is None else settings
+    jobs     = []
+    for module_name in module_names:
+        module = importlib.import_module(module_name)
+        for builder, filename in module.FIGURES:
+            jobs.append((module_name, builder, outdir, filename, dpi, settings))
+    return jobs
+
+
+def render_all(module_names, outdir='figs', processes=None, dpi=None, settings=None):
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+
+    jobs = jobs_for(module_names, outdir, dpi=dpi, settings=settings)
+
+    # Fresh interpreters, so the Agg backend is
+    # set before anything imports pyplot
+    ctx  = multiprocessing.get_context('spawn')
+    pool = ctx.Pool(processes=processes, initializer=_init_worker)
+    try:
+        paths = pool.map(_render, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Renders analysis figures headless, in parallel.')
+    parser.add_argument('modules', nargs='+',
+            help='modules defining FIGURES, e.g. WideSpectrumLanex')
+    parser.add_argument('-o', '--outdir', default='figs',
+            help='output directory')
+    parser.add_argument('-j', '--processes', type=int, default=None,
+            help='number of worker processes')
+    parser.add_argument('--dpi', type=float, default=None,
+            help='raster resolution')
+
+    arg = parser.parse_args()
+
+    for path in render_all(arg.modules, outdir=arg.outdir, processes=arg.processes, dpi=arg.dpi):
+        print(path)
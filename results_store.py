@@ -0,0 +1,179 @@
+import json
+import logging
+import numpy as np
+import os
+import shutil
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump when the stored layout changes
+STORE_VERSION = 1
+
+
+# ====================================
+# Parameter metadata
+# ====================================
+# Generating parameters are kept as plain
+# JSON; arrays become lists and numpy
+# scalars Python numbers, so the stored
+# copy compares equal to a fresh one.
+def _plain(value):
+    if isinstance(value, dict):
+        return dict((str(k), _plain(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_plain(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return _plain(value.tolist())
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def canonical(params):
+    return json.loads(json.dumps(_plain(params), sort_keys=True))
+
+
+# ====================================
+# Results store
+# ====================================
+# Each result is a directory root/<name>
+# holding one .npy file per array and
+# metadata.json (parameters, scalars, array
+# shapes). Arrays are written through
+# np.lib.format.open_memmap a block of rows
+# at a time and read back memory-mapped, so
+# slicing a stored grid only touches the
+# pages it needs.
+class ResultsStore(object):
+    _meta_name = 'metadata.json'
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.exists(root):
+            os.makedirs(root)
+
+    def _dir(self, name):
+        return os.path.join(self.root, name)
+
+    def names(self):
+        return sorted(name for name in os.listdir(self.root)
+                if not name.startswith('.') and name in self)
+
+    def __contains__(self, name):
+        return os.path.exists(os.path.join(self._dir(name), self._meta_name))
+
+    def metadata(self, name):
+        with open(os.path.join(self._dir(name), self._meta_name)) as f:
+            return json.load(f)
+
+    # True when *name* exists and was made
+    # from exactly these parameters
+    def matches(self, name, params):
+        if name not in self:
+            return False
+        meta = self.metadata(name)
+        return meta.get('version') == STORE_VERSION and meta.get('params') == canonical(params)
+
+    # Arrays come back as read-only memmaps
+    # (mmap_mode=None loads them), scalars as
+    # stored
+    def open(self, name, mmap_mode='r'):
+        meta = self.metadata(name)
+        out  = dict(meta['scalars'])
+        for key in meta['arrays']:
+            out[key] = np.load(os.path.join(self._dir(name), key+'.npy'), mmap_mode=mmap_mode)
+        return out
+
+    def save(self, name, results, params=None, chunk_bytes=2**26):
+        target = self._dir(name)
+        tmp    = tempfile.mkdtemp(dir=self.root, prefix='.tmp_')
+        try:
+            arrays  = {}
+            scalars = {}
+            for key, value in results.items():
+                if np.ndim(value) == 0:
+                    scalars[key] = _plain(value)
+                    continue
+                value = np.asarray(value)
+                arrays[key] = dict(shape=list(value.shape), dtype=value.dtype.str)
+                self._write(os.path.join(tmp, key+'.npy'), value, chunk_bytes)
+
+            meta = dict(
+                    version = STORE_VERSION,
+                    created = time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    params  = canonical({} if params is None else params),
+                    arrays  = arrays,
+                    scalars = scalars
+                    )
+            with open(os.path.join(tmp, self._meta_name), 'w') as f:
+                json.dump(meta, f, indent=2, sort_keys=True)
+
+            # Swap in the finished directory
+            if os.path.exists(target):
+                old = tempfile.mkdtemp(dir=self.root, prefix='.old_')
+                try:
+                    os.rename(target, os.path.join(old, name))
+                except OSError:
+                    pass
+                shutil.rmtree(old, ignore_errors=True)
+            try:
+                os.rename(tmp, target)
+            except OSError:
+                # Another process stored it first
+                shutil.rmtree(tmp)
+        except Exception:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        logger.debug('Stored {} in {}'.format(name, target))
+
+    def _write(self, path, value, chunk_bytes):
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=value.dtype, shape=value.shape)
+        if value.ndim == 0 or value.size == 0:
+            out[...] = value
+        else:
+            row_bytes = max(1, value[0].nbytes)
+            step      = max(1, int(chunk_bytes//row_bytes))
+            for start in range(0, value.shape[0], step):
+                out[start:start+step] = value[start:start+step]
+        out.flush()
+        del out
+
+    def delete(self, name):
+        shutil.rmtree(self._dir(name), ignore_errors=True)
+
+
+# ====================================
+# Load or compute
+# ====================================
+# Returns the stored result for *name* if it
+# was made from *params*; otherwise calls
+# compute() (a dict of arrays and scalars),
+# stores it and returns the stored copy.
+# With store=None it just computes.
+#
+# With finite=True a result holding NaN or
+# inf (e.g. a scan with failed jobs) is
+# returned but not stored, so the next run
+# computes it again.
+def cached(store, name, params, compute, mmap_mode='r', finite=False):
+    if store is None:
+        return compute()
+    if store.matches(name, params):
+        logger.debug('Loading {} from {}'.format(name, store.root))
+        return store.open(name, mmap_mode=mmap_mode)
+    results = compute()
+    if finite and not _all_finite(results):
+        logger.warning('Not storing {}: result has non-finite values'.format(name))
+        return results
+    store.save(name, results, params=params)
+    return store.open(name, mmap_mode=mmap_mode)
+
+
+def _all_finite(results):
+    for value in results.values():
+        value = np.asarray(value)
+        if np.issubdtype(value.dtype, np.inexact) and not np.all(np.isfinite(value)):
+            return False
+    return True
@@ -0,0 +1,474 @@
+import collections
+import numpy as np
+import os
+import re
+import struct
+
+# ====================================
+# SDDS type codes
+# ====================================
+_binary_types = {
+        'double'    : 'f8',
+        'float'     : 'f4',
+        'long64'    : 'i8',
+        'ulong64'   : 'u8',
+        'long'      : 'i4',
+        'ulong'     : 'u4',
+        'short'     : 'i2',
+        'ushort'    : 'u2',
+        'character' : 'S1'
+        }
+
+_pair_re = re.compile(r'(\w+)\s*=\s*("(?:[^"\\]|\\.)*"|[^,\s]+)')
+
+
+def _namelist(text):
+    out = {}
+    for key, val in _pair_re.findall(text):
+        if val.startswith('"'):
+            val = val[1:-1]
+        out[key.lower()] = val
+    return out
+
+
+# rows       : rows in the page
+# parameters : the page's parameter values
+# offset     : byte offset of the first row
+Page = collections.namedtuple('Page', ['rows', 'parameters', 'offset'])
+
+
+# ====================================
+# Streaming SDDS reader
+# ====================================
+# Parses the header, then streams columns
+# page by page in fixed-size chunks so
+# memory does not grow with row count.
+# Binary pages are memory-mapped.
+class SDDSReader(object):
+    def __init__(self, path):
+        self.path        = path
+        self.description = {}
+        self.parameters  = []
+        self.columns     = []
+        self.arrays      = []
+        self.data        = {}
+        self.byteorder   = '<'
+        self._pages      = None
+        self._parse_header()
+
+    @property
+    def column_names(self):
+        return [col['name'] for col in self.columns]
+
+    @property
+    def parameter_names(self):
+        return [par['name'] for par in self.parameters]
+
+    @property
+    def binary(self):
+        return self.data.get('mode', 'binary').lower() == 'binary'
+
+    def _parse_header(self):
+        with open(self.path, 'rb') as f:
+            first = f.readline().decode('ascii', 'replace')
+            if not first.startswith('SDDS'):
+                raise IOError('Not an SDDS file: {}'.format(self.path))
+
+            pending = ''
+            while True:
+                line = f.readline()
+                if not line:
+                    raise IOError('Missing &data in SDDS header: {}'.format(self.path))
+                line = line.decode('ascii', 'replace').strip()
+
+                if not pending and line.startswith('!'):
+                    if 'big-endian' in line:
+                        self.byteorder = '>'
+                    elif 'little-endian' in line:
+                        self.byteorder = '<'
+                    continue
+
+                pending = (pending + ' ' + line).strip()
+                if '&end' not in pending:
+                    continue
+
+                kind, _, body = pending.partition(' ')
+                nl = _namelist(body.replace('&end', ''))
+                pending = ''
+
+                if kind == '&description':
+                    self.description = nl
+                elif kind == '&parameter':
+                    self.parameters.append(nl)
+                elif kind == '&column':
+                    self.columns.append(nl)
+                elif kind == '&array':
+                    self.arrays.append(nl)
+                elif kind == '&data':
+                    self.data = nl
+                    break
+
+            for _ in range(int(self.data.get('additional_header_lines', 0))):
+                f.readline()
+            self.header_size = f.tell()
+
+    # ====================================
+    # Binary layout
+    # ====================================
+    def _dtype(self, type_name):
+        try:
+            code = _binary_types[type_name]
+        except KeyError:
+            raise NotImplementedError('SDDS type not handled for memory mapping: {}'.format(type_name))
+        return np.dtype(self.byteorder + code)
+
+    @property
+    def _row_dtype(self):
+        return np.dtype([(col['name'], self._dtype(col.get('type', 'double'))) for col in self.columns])
+
+    def _read_binary_parameters(self, f):
+        values = {}
+        for par in self.parameters:
+            if 'fixed_value' in par:
+                values[par['name']] = par['fixed_value']
+                continue
+            type_name = par.get('type', 'double')
+            if type_name == 'string':
+                n = struct.unpack(self.byteorder + 'i', f.read(4))[0]
+                values[par['name']] = f.read(n).decode('ascii', 'replace')
+            else:
+                dt = self._dtype(type_name)
+                values[par['name']] = np.frombuffer(f.read(dt.itemsize), dtype=dt)[0]
+        return values
+
+    def _binary_pages(self):
+        if self.arrays:
+            raise NotImplementedError('SDDS arrays are not handled in binary mode')
+        column_major = int(self.data.get('column_major_order', 0)) == 1
+        row_dtype    = self._row_dtype
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.header_size)
+            while True:
+                raw = f.read(4)
+                if len(raw) < 4:
+                    return
+                n_rows = struct.unpack(self.byteorder + 'i', raw)[0]
+                if n_rows == -2**31:
+                    n_rows = struct.unpack(self.byteorder + 'q', f.read(8))[0]
+                params = self._read_binary_parameters(f)
+                offset = f.tell()
+                yield n_rows, params, offset, column_major
+                f.seek(offset + n_rows*row_dtype.itemsize)
+
+    def _binary_columns(self, names, n_rows, offset, column_major):
+        row_dtype = self._row_dtype
+        if n_rows == 0:
+            return dict((name, np.zeros(0, dtype=row_dtype[name])) for name in names)
+        if not column_major:
+            mm = np.memmap(self.path, dtype=row_dtype, mode='r', offset=offset, shape=(n_rows,))
+            return dict((name, mm[name]) for name in names)
+        out = {}
+        for name in row_dtype.names:
+            dt = row_dtype[name]
+            if name in names:
+                out[name] = np.memmap(self.path, dtype=dt, mode='r', offset=offset, shape=(n_rows,))
+            offset += n_rows*dt.itemsize
+        return out
+
+    # ====================================
+    # ASCII layout
+    # ====================================
+    def _ascii_lines(self, f):
+        for line in f:
+            line = line.decode('ascii', 'replace')
+            if line.startswith('!'):
+                continue
+            yield line
+
+    def _ascii_value(self, par, line):
+        text = line.strip().strip('"')
+        type_name = par.get('type', 'double')
+        if type_name in ('string', 'character'):
+            return text
+        return self._dtype(type_name).type(float(text))
+
+    def _ascii_chunks(self, names, chunksize, page):
+        if self.arrays:
+            raise NotImplementedError('SDDS arrays are not handled')
+        no_row_counts = int(self.data.get('no_row_counts', 0)) == 1
+        usecols = [self.column_names.index(name) for name in names]
+
+        with open(self.path, 'rb') as f:
+            f.seek(self.header_size)
+            lines = self._ascii_lines(f)
+            i_page = 0
+            while True:
+                params = {}
+                try:
+                    for par in self.parameters:
+                        if 'fixed_value' in par:
+                            params[par['name']] = par['fixed_value']
+                        else:
+                            params[par['name']] = self._ascii_value(par, next(lines))
+                    n_rows = None if no_row_counts else int(next(lines).split()[0])
+                except StopIteration:
+                    return
+
+                rows_left = n_rows
+                while rows_left is None or rows_left > 0:
+                    n = chunksize if rows_left is None else min(chunksize, rows_left)
+                    chunk = []
+                    for line in lines:
+                        if not line.strip():
+                            if rows_left is None:
+                                break
+                            continue
+                        chunk.append(line)
+                        if len(chunk) == n:
+                            break
+                    if rows_left is not None:
+                        rows_left -= len(chunk)
+                    if chunk and (page is None or page == i_page):
+                        data = np.loadtxt(chunk, usecols=usecols, ndmin=2)
+                        yield i_page, params, dict((name, data[:, j]) for j, name in enumerate(names))
+                    if len(chunk) < n:
+                        break
+                i_page += 1
+
+    # ====================================
+    # Page index
+    # ====================================
+    # Built on first use with one pass over the
+    # page headers (binary) or lines (ASCII).
+    # offset is where the page's rows start.
+    def _ascii_index(self):
+        if self.arrays:
+            raise NotImplementedError('SDDS arrays are not handled')
+        no_row_counts = int(self.data.get('no_row_counts', 0)) == 1
+        pages = []
+        with open(self.path, 'rb') as f:
+            f.seek(self.header_size)
+            pos = self.header_size
+
+            def lines():
+                pos = self.header_size
+                for line in f:
+                    start = pos
+                    pos  += len(line)
+                    if line.startswith(b'!'):
+                        continue
+                    yield start, pos, line.decode('ascii', 'replace')
+            it = lines()
+
+            while True:
+                params = {}
+                try:
+                    for par in self.parameters:
+                        if 'fixed_value' in par:
+                            params[par['name']] = par['fixed_value']
+                        else:
+                            _, pos, line = next(it)
+                            params[par['name']] = self._ascii_value(par, line)
+                    if not no_row_counts:
+                        _, pos, line = next(it)
+                        n_rows = int(line.split()[0])
+                except StopIteration:
+                    break
+
+                offset = pos
+                count  = 0
+                # An empty page (e.g. every particle
+                # lost) has no rows to skip
+                for _, pos, line in (it if no_row_counts or n_rows > 0 else ()):
+                    if not line.strip():
+                        if no_row_counts:
+                            break
+                        continue
+                    count += 1
+                    if not no_row_counts and count == n_rows:
+                        break
+                if no_row_counts and count == 0:
+                    break
+                pages.append(Page(count if no_row_counts else n_rows, params, offset))
+        return pages
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            if self.binary:
+                self._pages = [Page(n_rows, params, offset) for n_rows, params, offset, _ in self._binary_pages()]
+            else:
+                self._pages = self._ascii_index()
+        return self._pages
+
+    # ====================================
+    # Random access
+    # ====================================
+    def _ascii_rows(self, names, page, start, stop):
+        usecols = [self.column_names.index(name) for name in names]
+        chunk   = []
+        if stop <= start:
+            return dict((name, np.zeros(0)) for name in names)
+        with open(self.path, 'rb') as f:
+            f.seek(page.offset)
+            row = 0
+            for line in self._ascii_lines(f):
+                if not line.strip():
+                    continue
+                if row >= start:
+                    chunk.append(line)
+                row += 1
+                if row >= stop:
+                    break
+        data = np.loadtxt(chunk, usecols=usecols, ndmin=2) if chunk else np.zeros((0, len(names)))
+        out  = {}
+        for j, name in enumerate(names):
+            type_name = self.columns[usecols[j]].get('type', 'double')
+            out[name] = data[:, j].astype(self._dtype(type_name).newbyteorder('='), copy=False)
+        return out
+
+    # Only *names* (default all) of one page,
+    # rows a slice or (start, stop). Binary
+    # columns come back as memory-mapped views,
+    # so nothing is read until they are used;
+    # ASCII reads just those lines and columns.
+    def read(self, names=None, page=0, rows=None):
+        names = self.column_names if names is None else list(names)
+        missing = set(names) - set(self.column_names)
+        if missing:
+            raise KeyError('Columns not in SDDS file: {}'.format(sorted(missing)))
+        try:
+            entry = self.pages[page]
+        except IndexError:
+            raise IndexError('SDDS file has {} pages: {}'.format(len(self.pages), self.path))
+        if isinstance(rows, tuple):
+            rows = slice(*rows)
+        rows = slice(None) if rows is None else rows
+
+        if self.binary:
+            column_major = int(self.data.get('column_major_order', 0)) == 1
+            cols = self._binary_columns(names, entry.rows, entry.offset, column_major)
+            return dict((name, cols[name][rows]) for name in names)
+
+        start, stop, step = rows.indices(entry.rows)
+        out = self._ascii_rows(names, entry, start, max(start, stop))
+        return dict((name, col[::step]) for name, col in out.items())
+
+    def column(self, name, page=0, rows=None):
+        return self.read([name], page=page, rows=rows)[name]
+
+    # ====================================
+    # Public interface
+    # ====================================
+    # Yields (page, parameters, {name: array})
+    # with at most *chunksize* rows per chunk.
+    def iter_chunks(self, names=None, chunksize=1000000, page=None):
+        names = self.column_names if names is None else list(names)
+        missing = set(names) - set(self.column_names)
+        if missing:
+            raise KeyError('Columns not in SDDS file: {}'.format(sorted(missing)))
+
+        if not self.binary:
+            for out in self._ascii_chunks(names, chunksize, page):
+                yield out
+            return
+
+        for i_page, (n_rows, params, offset, column_major) in enumerate(self._binary_pages()):
+            if page is not None and i_page != page:
+                continue
+            cols = self._binary_columns(names, n_rows, offset, column_major)
+            for start in range(0, n_rows, chunksize):
+                yield i_page, params, dict((name, np.array(cols[name][start:start+chunksize])) for name in names)
+            del cols
+            if page is not None:
+                return
+
+
+# ====================================
+# Lazy elegant output
+# ====================================
+# Stands in for ElegantPy's ElegantSim and
+# its Bunch: the particle file next to the
+# .ele (root.out) is indexed, and each Bunch
+# attribute (x, xp, y, yp, t, p, delta) is
+# read the first time it is used.
+class LazyBunch(object):
+    def __init__(self, reader, page=0, rows=None):
+        self._reader = reader
+        self._page   = page
+        self._rows   = rows
+
+    @property
+    def parameters(self):
+        return self._reader.pages[self._page].parameters
+
+    def __len__(self):
+        return len(self._reader.column(self._reader.column_names[0], page=self._page, rows=self._rows))
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if name == 'delta':
+            # Relative to the reference momentum
+            # (both in m_e c) when elegant wrote it
+            p     = np.asarray(self.p, dtype=np.float64)
+            p0    = float(self.parameters.get('pCentral', np.mean(p)))
+            value = p/p0 - 1
+        elif name in self._reader.column_names:
+            value = self._reader.column(name, page=self._page, rows=self._rows)
+        else:
+            raise AttributeError('No column {!r} in {}'.format(name, self._reader.path))
+        setattr(self, name, value)
+        return value
+
+
+class LazyElegantSim(object):
+    def __init__(self, ele_path, page=0, rows=None, particle_file=None):
+        self.path          = ele_path
+        self.particle_file = os.path.splitext(ele_path)[0] + '.out' if particle_file is None else particle_file
+        self.reader        = SDDSReader(self.particle_file)
+        self.page          = page
+        self.rows          = rows
+        self._bunch        = None
+
+    @property
+    def Bunch(self):
+        if self._bunch is None:
+            self._bunch = LazyBunch(self.reader, page=self.page, rows=self.rows)
+        return self._bunch
+
+
+# ====================================
+# Writer
+# ====================================
+# Binary, little-endian, row-major SDDS
+# with double columns and double or string
+# parameters, e.g. a particle file in the
+# layout elegant writes.
+def write_binary(path, columns, parameters=None):
+    parameters = {} if parameters is None else parameters
+    names = list(columns)
+    n     = len(columns[names[0]]) if names else 0
+
+    with open(path, 'wb') as f:
+        f.write(b'SDDS1\n!# little-endian\n')
+        for name, value in parameters.items():
+            type_name = 'string' if isinstance(value, str) else 'double'
+            f.write('&parameter name={}, type={}, &end\n'.format(name, type_name).encode())
+        for name in names:
+            f.write('&column name={}, type=double, &end\n'.format(name).encode())
+        f.write(b'&data mode=binary, &end\n')
+
+        f.write(struct.pack('<i', n))
+        for value in parameters.values():
+            if isinstance(value, str):
+                text = value.encode('ascii')
+                f.write(struct.pack('<i', len(text)) + text)
+            else:
+                f.write(struct.pack('<d', value))
+
+        rows = np.empty(n, dtype=[(name, '<f8') for name in names])
+        for name in names:
+            rows[name] = columns[name]
+        rows.tofile(f)
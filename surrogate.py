@@ -0,0 +1,190 @@
+import logging
+import numpy as np
+from numpy.polynomial import chebyshev
+
+logger = logging.getLogger(__name__)
+
+
+# ====================================
+# Piecewise Chebyshev surrogate
+# ====================================
+# log(sigx) and log(sigy) are interpolated on
+# Chebyshev nodes over intervals of
+# [x_min, x_max]; rho = 1/(sigx*sigy) and
+# all derivatives follow from the same
+# series. *evaluate* is the exact
+# computation, as for adaptive.sample (e.g.
+# adaptive.twiss_evaluator).
+#
+# Each interval is checked at the points
+# midway between its nodes and halved while
+# the relative error there exceeds *tol*;
+# intervals still above it after
+# *max_rounds* are kept and logged.
+#
+# The stored error is an estimate, not a
+# bound: the final intervals are evaluated
+# again at *validate* times as many equally
+# spaced points (independent of the nodes
+# and check points), and the worst error
+# seen on either set is scaled by *safety*.
+_names = ['sigx', 'sigy']
+
+
+def _nodes(degree):
+    return np.cos(np.pi*(np.arange(degree+1)+0.5)/(degree+1))[::-1]
+
+
+def _check_points(degree):
+    nodes = np.concatenate([[-1.0], _nodes(degree), [1.0]])
+    return 0.5*(nodes[1:] + nodes[:-1])
+
+
+def _to_x(t, a, b):
+    return a[:, np.newaxis] + 0.5*(t+1)*(b-a)[:, np.newaxis]
+
+
+def _log(values):
+    return np.log(np.array([values[name] for name in _names], dtype=np.float64))
+
+
+def build(evaluate, x_min, x_max, tol=1e-6, degree=16, n_intervals=8, max_rounds=12, validate=4, safety=2.0):
+    edges  = np.linspace(x_min, x_max, n_intervals+1)
+    t      = _nodes(degree)
+    t_chk  = _check_points(degree)
+    done   = []
+    todo   = (edges[:-1], edges[1:])
+    rounds = 0
+    n_eval = 0
+
+    while todo[0].size:
+        a, b = todo
+        # Nodes and check points of every open
+        # interval in one call
+        x_fit  = _to_x(t, a, b)
+        x_chk  = _to_x(t_chk, a, b)
+        F      = _log(evaluate(np.concatenate([x_fit.ravel(), x_chk.ravel()])))
+        n_eval += x_fit.size + x_chk.size
+        F_fit  = F[:, :x_fit.size].reshape((len(_names),) + x_fit.shape)
+        F_chk  = F[:, x_fit.size:].reshape((len(_names),) + x_chk.shape)
+
+        # (degree+1, n_names, n_intervals)
+        coef   = chebyshev.chebfit(t, F_fit.transpose(2, 0, 1).reshape(degree+1, -1), degree)
+        coef   = coef.reshape(degree+1, len(_names), a.size)
+        approx = chebyshev.chebval(t_chk, coef)
+        err    = np.abs(approx - F_chk).max(axis=2)
+
+        rounds += 1
+        bad = np.any(err > tol, axis=0)
+        if rounds >= max_rounds and np.any(bad):
+            logger.warning('Surrogate: {} intervals still above tol={:g} after {} rounds (worst {:.3g}), kept as they are'.format(
+                np.count_nonzero(bad), tol, rounds, err.max()))
+            bad[:] = False
+        for i in np.nonzero(~bad)[0]:
+            done.append((a[i], b[i], coef[:, :, i], err[:, i]))
+        mid  = 0.5*(a[bad] + b[bad])
+        todo = (np.concatenate([a[bad], mid]), np.concatenate([mid, b[bad]]))
+
+    done.sort(key=lambda item: item[0])
+    edges = np.array([item[0] for item in done] + [done[-1][1]])
+    coef  = np.array([item[2] for item in done]).transpose(1, 2, 0)
+    err   = np.array([item[3] for item in done]).max(axis=0)
+
+    # Independent validation points
+    t_val  = np.linspace(-1, 1, validate*(degree+1)+2)[1:-1]
+    x_val  = _to_x(t_val, edges[:-1], edges[1:])
+    F_val  = _log(evaluate(x_val.ravel())).reshape((len(_names),) + x_val.shape)
+    n_eval += x_val.size
+    err    = np.maximum(err, np.abs(chebyshev.chebval(t_val, coef) - F_val).max(axis=(1, 2)))*safety
+    logger.debug('Surrogate: {} intervals, {} evaluations, {} rounds'.format(edges.size-1, n_eval, rounds))
+    # Relative errors of sigx, sigy and rho
+    error = np.expm1(np.array([err[0], err[1], err[0]+err[1]]))
+    return Surrogate(edges, coef, error)
+
+
+class Surrogate(object):
+    # edges : (n+1,) interval bounds
+    # coef  : (degree+1, 2, n) Chebyshev series
+    #         of log sigx, log sigy
+    # error : estimated relative errors of
+    #         sigx, sigy, rho (see build)
+    def __init__(self, edges, coef, error):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.coef  = np.asarray(coef, dtype=np.float64)
+        self.error = np.asarray(error, dtype=np.float64)
+        width      = np.diff(self.edges)
+        # d/dx = d/dt * 2/width
+        self.dcoef = chebyshev.chebder(self.coef, axis=0)*(2/width)
+        # Per-interval rows for the gather in
+        # _series
+        self._c    = np.ascontiguousarray(self.coef.transpose(2, 1, 0))
+        self._dc   = np.ascontiguousarray(self.dcoef.transpose(2, 1, 0))
+
+    @property
+    def range(self):
+        return self.edges[0], self.edges[-1]
+
+    def _locate(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if np.any((x < self.edges[0]) | (x > self.edges[-1])):
+            raise ValueError('Outside the surrogate range {}'.format(self.range))
+        i = np.clip(np.searchsorted(self.edges, x, side='right')-1, 0, self.edges.size-2)
+        a = self.edges[i]
+        b = self.edges[i+1]
+        return x, i, 2*(x-a)/(b-a) - 1
+
+    # Clenshaw recurrence on the series of
+    # each query's interval; (2, n_queries)
+    @staticmethod
+    def _series(table, i, t):
+        c  = table[i].transpose(2, 1, 0)
+        t2 = 2*t
+        b1 = np.zeros(c.shape[1:])
+        b2 = np.zeros(c.shape[1:])
+        for k in range(c.shape[0]-1, 0, -1):
+            b0  = t2*b1
+            b0 -= b2
+            b0 += c[k]
+            b2, b1 = b1, b0
+        return c[0] + t*b1 - b2
+
+    # Vectorized queries: dict of sigx, sigy,
+    # rho, and with derivatives=True their
+    # x-derivatives dsigx, dsigy, drho
+    def __call__(self, x, derivatives=False):
+        x, i, t = self._locate(x)
+        shape   = x.shape
+        t, i    = t.ravel(), i.ravel()
+        logs    = self._series(self._c, i, t)
+        sigx    = np.exp(logs[0])
+        sigy    = np.exp(logs[1])
+        out     = dict(sigx=sigx.reshape(shape), sigy=sigy.reshape(shape), rho=(1.0/(sigx*sigy)).reshape(shape))
+        if derivatives:
+            dlogs = self._series(self._dc, i, t)
+            out['dsigx'] = (sigx*dlogs[0]).reshape(shape)
+            out['dsigy'] = (sigy*dlogs[1]).reshape(shape)
+            out['drho']  = (-out['rho'].ravel()*(dlogs[0]+dlogs[1])).reshape(shape)
+        return out
+
+    # Worst relative error against *evaluate*
+    # at the points *x*
+    def check(self, evaluate, x):
+        exact  = evaluate(np.asarray(x, dtype=np.float64))
+        approx = self(x)
+        return dict((name, np.max(np.abs(approx[name]/np.asarray(exact[name])-1))) for name in ['sigx', 'sigy', 'rho'])
+
+    # ====================================
+    # Serialization
+    # ====================================
+    # As a dict of arrays (e.g. for
+    # results_store) or an .npz file
+    def arrays(self):
+        return dict(edges=self.edges, coef=self.coef, error=self.error)
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['edges'], data['coef'], data['error'])
@@ -0,0 +1,207 @@
+import numpy as np
+from common_functions import *
+from fused_functions import counts_fused
+
+
+# ====================================
+# Camera light models
+# ====================================
+# Counts per pixel for any mix of scalar
+# and array parameters
+def light(N, h_obj, h_img, px_length, QE=1.0, SE=1.0, sigma=1.0):
+    return counts_fused(
+            sigma     = sigma,
+            SE        = SE,
+            N         = N,
+            mag       = mag(h_img, h_obj),
+            px_length = px_length,
+            QE        = QE
+            )
+
+
+# Depth of field, circle of confusion
+# one pixel
+def depth_of_field(f, N, h_obj, h_img, px_length):
+    return DOF(f=f, N=N, c=px_length, m=mag(h_img, h_obj))
+
+
+# ====================================
+# Chunked sweep
+# ====================================
+# Evaluates func over the outer product of
+# named 1D axes without building meshgrids.
+# Each chunk holds a block of the trailing
+# axes; axis vectors are broadcast into it.
+class Sweep(object):
+    def __init__(self, func, axes, fixed=None, chunk_size=2**20):
+        self.func       = func
+        self.names      = [name for name, _ in axes]
+        self.vectors    = [np.asarray(vec) for _, vec in axes]
+        self.fixed      = {} if fixed is None else fixed
+        self.chunk_size = int(chunk_size)
+
+    @property
+    def shape(self):
+        return tuple(vec.size for vec in self.vectors)
+
+    def axis(self, name):
+        return self.names.index(name)
+
+    def _split(self):
+        # Axis *j* is cut into blocks of *step*;
+        # axes after it are whole, axes before
+        # it are looped over one index at a time
+        shape = self.shape
+        block = 1
+        j     = len(shape)
+        while j > 0 and block*shape[j-1] <= self.chunk_size:
+            j     -= 1
+            block *= shape[j]
+        if j == 0:
+            return 0, shape[0] if shape else 1
+        return j-1, max(1, self.chunk_size//block)
+
+    def chunks(self):
+        shape   = self.shape
+        j, step = self._split()
+        ndim    = len(shape)
+
+        for lead in np.ndindex(*shape[:j]):
+            for start in range(0, shape[j] if ndim else 1, step):
+                index  = lead + (slice(start, start+step),) + (slice(None),)*(ndim-j-1)
+                kwargs = dict(self.fixed)
+                for i, (name, vec) in enumerate(zip(self.names, self.vectors)):
+                    if i < j:
+                        kwargs[name] = vec[lead[i]]
+                    else:
+                        bshape      = [1]*(ndim-j)
+                        bshape[i-j] = -1
+                        kwargs[name] = vec[index[i]].reshape(bshape)
+                values = self.func(**kwargs)
+                cshape = tuple(len(range(*index[i].indices(shape[i]))) for i in range(j, ndim))
+                yield index, j, np.broadcast_to(values, cshape)
+
+    # Integer index along every axis for each
+    # element of a chunk, broadcastable to it
+    def indices(self, index, j):
+        shape = self.shape
+        ndim  = len(shape)
+        out   = []
+        for i in range(ndim):
+            if i < j:
+                out.append(np.full((1,)*(ndim-j), index[i], dtype=np.intp))
+            else:
+                bshape      = [1]*(ndim-j)
+                bshape[i-j] = -1
+                out.append(np.arange(*index[i].indices(shape[i])).reshape(bshape))
+        return tuple(out)
+
+    def reduce(self, *reducers):
+        for reducer in reducers:
+            reducer.start(self)
+        for index, j, values in self.chunks():
+            for reducer in reducers:
+                reducer.update(index, j, values)
+        return reducers
+
+
+# ====================================
+# Reducers
+# ====================================
+# Global maximum and where it occurs
+class Max(object):
+    def start(self, sweep):
+        self.sweep = sweep
+        self.value = -np.inf
+        self.index = None
+
+    def update(self, index, j, values):
+        k = np.argmax(values)
+        if values.flat[k] > self.value:
+            self.value = values.flat[k]
+            sub = np.unravel_index(k, values.shape)
+            self.index = tuple(index[:j]) + tuple(index[j+i].indices(self.sweep.shape[j+i])[0] + s for i, s in enumerate(sub))
+
+    @property
+    def argmax(self):
+        return dict((name, vec[i]) for name, vec, i in zip(self.sweep.names, self.sweep.vectors, self.index))
+
+
+# Reduce away every axis not in *keep*,
+# leaving a small grid over the kept axes
+# (in sweep order). op is a numpy ufunc.
+class Project(object):
+    def __init__(self, keep, op=np.maximum):
+        self.keep = list(keep)
+        self.op   = op
+
+    def start(self, sweep):
+        self.axes = sorted(sweep.axis(name) for name in self.keep)
+        shape     = tuple(sweep.shape[i] for i in self.axes)
+        if self.op is np.maximum:
+            fill = -np.inf
+        elif self.op is np.minimum:
+            fill = np.inf
+        else:
+            fill = self.op.identity
+        self.out  = np.full(shape, fill, dtype=np.float64)
+
+    def update(self, index, j, values):
+        drop    = tuple(i-j for i in range(j, j+values.ndim) if i not in self.axes)
+        reduced = self.op.reduce(values, axis=drop) if drop else values
+        target  = tuple(index[i] for i in self.axes)
+        self.out[target] = self.op(self.out[target], reduced)
+
+    def normalized(self):
+        return self.out/np.nanmax(self.out)
+
+
+# ====================================
+# Iso-contours
+# ====================================
+# Marching squares on a projected 2D grid
+# Z[iy, ix]; returns line segments as an
+# (n, 2, 2) array of (x, y) end points.
+def iso_contour(x, y, Z, level):
+    Z  = np.asarray(Z, dtype=np.float64) - level
+    X, Y = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+
+    # Corners of every cell, counter-clockwise
+    z = [Z[:-1, :-1], Z[:-1, 1:], Z[1:, 1:], Z[1:, :-1]]
+    xs = [X[:-1], X[1:], X[1:], X[:-1]]
+    ys = [Y[:-1], Y[:-1], Y[1:], Y[1:]]
+
+    points = []
+    for a in range(4):
+        b = (a+1) % 4
+        za, zb = z[a], z[b]
+        cross  = (za > 0) != (zb > 0)
+        # t is inf/NaN on edges not crossed;
+        # those points are never used
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t  = za/(za-zb)
+            px = xs[a][np.newaxis, :] + t*(xs[b]-xs[a])[np.newaxis, :]
+            py = ys[a][:, np.newaxis] + t*(ys[b]-ys[a])[:, np.newaxis]
+        points.append((cross, px, py))
+
+    crossed = np.array([c for c, _, _ in points])
+    px      = np.array([p for _, p, _ in points])
+    py      = np.array([p for _, _, p in points])
+    n_cross = crossed.sum(axis=0)
+
+    # A cell crossed on two edges gives one
+    # segment; a saddle (four edges) gives two
+    first  = np.argmax(crossed, axis=0)
+    last   = 3 - np.argmax(crossed[::-1], axis=0)
+    saddle = n_cross == 4
+    pairs  = [(first, last, n_cross == 2), (0, 1, saddle), (2, 3, saddle)]
+
+    segments = []
+    for a, b, mask in pairs:
+        iy, ix = np.nonzero(mask)
+        a = a[iy, ix] if np.ndim(a) else a
+        b = b[iy, ix] if np.ndim(b) else b
+        p0 = np.stack([px[a, iy, ix], py[a, iy, ix]], axis=-1)
+        p1 = np.stack([px[b, iy, ix], py[b, iy, ix]], axis=-1)
+        segments.append(np.stack([p0, p1], axis=1))
+    return np.concatenate(segments)
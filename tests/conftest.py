@@ -0,0 +1,60 @@
+import collections
+import os
+import sys
+import pytest
+
+# The modules live flat in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# ====================================
+# Beamline as slactrac builds it
+# ====================================
+# Plain objects with the attributes the
+# modules read from slactrac elements and
+# Beamline, so tests run without slactrac.
+# Mirrors supersimpledumpline in my.py.
+BeamParams = collections.namedtuple('BeamParams', ['beta', 'alpha', 'emit'])
+
+
+class Element(object):
+    def __init__(self, _type, name, length, K1=0.0, angle=0.0, rotate=0, **kwargs):
+        self._type   = _type
+        self.name    = name
+        self.length  = length
+        self.K1      = K1
+        self.angle   = angle
+        self.rotate  = rotate
+        self._kwargs = kwargs
+
+
+class Beamline(object):
+    def __init__(self, elements, gamma, beam_x, beam_y):
+        self.elements = elements
+        self.gamma    = gamma
+        self.beam_x   = beam_x
+        self.beam_y   = beam_y
+
+
+def dumpline():
+    gamma = 39824.0
+    emit  = 100e-6/gamma
+    return Beamline([
+        Element('drift', 'LPEXT2QS0'    , 2.65),
+        Element('quad' , 'QS0'          , 4.61E-01, K1=-8.411e-1),
+        Element('drift', 'LQS02TOR3255' , 1.729),
+        Element('drift', 'LTOR2QS1'     , 0.26),
+        Element('quad' , 'QS1'          , 1.0, K1=3.647850372034315e-01),
+        Element('drift', 'LQS12QS2'     , 4.00),
+        Element('quad' , 'QS2'          , 1.0, K1=-1.223335345241937e-01),
+        Element('drift', 'LQS22BEND'    , 0.7428),
+        Element('bend' , 'B5D36'        , 9.779E-01, angle=6.0E-03, rotate=90,
+            EDGE1_EFFECTS=1, E1=3.0E-3, EDGE2_EFFECTS=1, E2=3.0E-3, HGAP=3E-02),
+        Element('drift', 'LBEND2DUMP1'  , 8.795),
+        Element('drift', 'LDUMP12ELANEX', 0.06)
+        ], gamma, BeamParams(0.5, 0, emit), BeamParams(5.0, 0, emit))
+
+
+@pytest.fixture
+def beamline():
+    return dumpline()
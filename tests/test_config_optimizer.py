@@ -0,0 +1,46 @@
+import numpy as np
+import config_optimizer
+
+
+def test_pareto_front_keeps_ties():
+    fov = np.array([0.3, 0.3, 0.3, 0.2, 0.2, 0.1])
+    thr = np.array([1.0, 2.0, 2.0, 2.0, 3.0, 3.0])
+    front = config_optimizer.pareto_front(fov, thr)
+    assert sorted(front[:2]) == [1, 2]
+    np.testing.assert_array_equal(front[2:], [4])
+
+
+def _problem(lenses):
+    return config_optimizer.Problem(lenses=lenses, fov_min=0.3, o_min=0.5, o_max=4.0,
+            FOV=np.linspace(0.3, 0.6, 13))
+
+
+# Throughput ties across lenses; the largest
+# DOF wins whatever the catalog order
+def test_tie_break_on_dof():
+    lenses = config_optimizer.LENSES
+    front  = config_optimizer.optimize(_problem(lenses))
+    rev    = config_optimizer.optimize(_problem(lenses[::-1]))
+    assert front.size > 0
+    np.testing.assert_array_equal(front, rev)
+    # One row per FOV on this front
+    assert np.unique(front['FOV']).size == front.size
+
+    problem = _problem(lenses)
+    for row in front:
+        camera = np.flatnonzero(problem.cameras['name'] == row['camera'])[0]
+        detail = problem.evaluate(np.arange(lenses.size), camera, row['N'], row['FOV'], feasible=True)
+        tied   = detail['feasible'] & (detail['throughput'] == row['throughput'])
+        assert tied.sum() > 1
+        assert row['dof'] == detail['dof'][tied].max()
+
+
+# Beyond hyperfocal every DOF is infinite;
+# the shortest working distance wins
+def test_tie_break_on_working_distance():
+    lenses = config_optimizer.lens_catalog([('long', 50e-3, 1.4, 16.0), ('short', 35e-3, 1.4, 16.0)])
+    problem = config_optimizer.Problem(lenses=lenses, N=[16.0], FOV=[10.0], o_max=np.inf)
+    detail = problem.evaluate(np.arange(2), 0, 16.0, 10.0, feasible=True)
+    assert np.all(np.isinf(detail['dof']))
+    front = config_optimizer.optimize(problem)
+    np.testing.assert_array_equal(front['lens'], ['short'])
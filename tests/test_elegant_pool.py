@@ -0,0 +1,148 @@
+import os
+import stat
+import subprocess
+import time
+import numpy as np
+import elegant_cache
+import elegant_pool
+
+
+# ====================================
+# Stub jobs
+# ====================================
+# Same signature as elegant_pool.elegant_job;
+# *beamline* carries whatever the test needs.
+def ok_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    return dict(sigx=energy_gamma, sigy=2*energy_gamma, workdir=workdir)
+
+
+def failing_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    raise RuntimeError('elegant failed')
+
+
+# Fails the first time for each energy,
+# counted in marker files under *beamline*
+def flaky_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    marker = os.path.join(beamline, 'tried_{:g}'.format(energy_gamma))
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        raise RuntimeError('first attempt')
+    return dict(sigx=energy_gamma, sigy=energy_gamma)
+
+
+# Runs the stub "elegant" found on PATH,
+# which records its pid and hangs
+def stub_elegant_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    subprocess.call(['elegant', os.path.join(beamline, 'stub.pid')])
+    return dict(sigx=energy_gamma, sigy=energy_gamma)
+
+
+def _stub_elegant(tmp_path):
+    bin_dir = tmp_path / 'bin'
+    bin_dir.mkdir()
+    exe = bin_dir / 'elegant'
+    exe.write_text('#!/bin/sh\necho $$ > "$1"\nexec sleep 30\n')
+    exe.chmod(exe.stat().st_mode | stat.S_IXUSR)
+    return dict(PATH=str(bin_dir)+os.pathsep+os.environ.get('PATH', ''))
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # Reaped by init or a zombie
+    try:
+        with open('/proc/{}/stat'.format(pid)) as f:
+            return f.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+# ====================================
+# Tests
+# ====================================
+def test_results_in_order(tmp_path):
+    sigx, sigy = elegant_pool.run_scan(None, [3.0, 1.0, 2.0], dir=str(tmp_path), max_workers=2, job=ok_job)
+    np.testing.assert_array_equal(sigx, [3, 1, 2])
+    np.testing.assert_array_equal(sigy, [6, 2, 4])
+
+
+def test_failure_gives_nan(tmp_path):
+    sigx, sigy = elegant_pool.run_scan(None, [1.0, 2.0], dir=str(tmp_path), retries=1, job=failing_job)
+    assert np.all(np.isnan(sigx))
+    assert np.all(np.isnan(sigy))
+
+
+def test_retry(tmp_path):
+    sigx, _ = elegant_pool.run_scan(str(tmp_path), [1.0, 2.0], dir=str(tmp_path / 'runs'), retries=1, job=flaky_job)
+    np.testing.assert_array_equal(sigx, [1, 2])
+
+    # No retries left: NaN
+    sigx, _ = elegant_pool.run_scan(str(tmp_path), [5.0], dir=str(tmp_path / 'runs'), retries=0, job=flaky_job)
+    assert np.isnan(sigx[0])
+
+
+def test_timeout_kills_stub_elegant(tmp_path):
+    env   = _stub_elegant(tmp_path)
+    start = time.time()
+    sigx, _ = elegant_pool.run_scan(str(tmp_path), [1.0], dir=str(tmp_path / 'runs'), timeout=1.0, retries=0, env=env, job=stub_elegant_job)
+    assert time.time() - start < 10
+    assert np.isnan(sigx[0])
+
+    # elegant went down with the worker
+    with open(str(tmp_path / 'stub.pid')) as f:
+        pid = int(f.read())
+    for _ in range(50):
+        if not _alive(pid):
+            break
+        time.sleep(0.1)
+    assert not _alive(pid)
+
+
+def test_timeout_before_setsid(tmp_path, monkeypatch):
+    # Worker not yet in its own group
+    monkeypatch.setattr(elegant_pool.os, 'setsid', lambda: None)
+    start = time.time()
+    results = elegant_pool.run_jobs(stub_elegant_job, [(str(tmp_path), 1.0, 1, 0)], str(tmp_path / 'runs'),
+            timeout=1.0, retries=0, env=_stub_elegant(tmp_path))
+    assert time.time() - start < 10
+    assert results == [None]
+
+
+def test_unique_directory_per_call(tmp_path):
+    first  = elegant_pool.run_jobs(ok_job, [(None, 1.0, 1, 0)], str(tmp_path), keep=True)
+    second = elegant_pool.run_jobs(ok_job, [(None, 1.0, 1, 0)], str(tmp_path), keep=True)
+    assert first[0]['workdir'] != second[0]['workdir']
+    assert os.path.isdir(first[0]['workdir'])
+
+
+def test_run_directories_removed(tmp_path):
+    res = elegant_pool.run_jobs(ok_job, [(None, 1.0, 1, 0), (None, 2.0, 1, 0)], str(tmp_path))
+    assert not os.path.exists(res[0]['workdir'])
+    assert os.listdir(str(tmp_path)) == []
+
+    elegant_pool.run_scan(None, [1.0, 2.0], dir=str(tmp_path), job=failing_job, retries=0)
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_empty_arglist_makes_no_directory(tmp_path):
+    assert elegant_pool.run_jobs(ok_job, [], str(tmp_path / 'runs')) == []
+    assert not os.path.exists(str(tmp_path / 'runs'))
+
+
+# Writes a small particle file like elegant
+def file_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    particle_file = os.path.join(workdir, 'out.out')
+    with open(particle_file, 'wb') as f:
+        f.write(b'x'*1000)
+    return dict(sigx=energy_gamma, sigy=energy_gamma, particle_file=particle_file)
+
+
+def test_particle_files_move_to_cache(tmp_path, beamline):
+    cache = elegant_cache.ResultCache(str(tmp_path / 'cache'), keep_particles=True)
+    sigx, _ = elegant_pool.run_scan(beamline, [1.0, 2.0], dir=str(tmp_path / 'runs'), job=file_job, cache=cache)
+    np.testing.assert_array_equal(sigx, [1, 2])
+    assert os.listdir(str(tmp_path / 'runs')) == []
+    key = elegant_cache.cache_key(beamline, 1.0, 1e5, 0, job=file_job)
+    assert os.path.getsize(cache.particle_file(key)) == 1000
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import benchmark
+import energy_spread
+
+
+@pytest.fixture(scope='module')
+def line():
+    table, gamma0, beam_x, beam_y = benchmark.dumpline()
+    gamma = np.linspace(10, 80, 501)*1e3/0.51099895
+    return table, gamma0, beam_x, beam_y, gamma
+
+
+@pytest.mark.parametrize('spread', [energy_spread.gaussian(0.0), energy_spread.uniform(0.0), energy_spread.monoenergetic()],
+        ids=['gaussian', 'uniform', 'monoenergetic'])
+def test_zero_spread_is_monoenergetic(line, spread):
+    out = energy_spread.scan(*line, spread=spread)
+    for name in ['sigx', 'sigy', 'rho']:
+        assert np.all(np.isfinite(out[name]))
+        np.testing.assert_allclose(out[name], out['mono_'+name], rtol=1e-9)
+
+
+def test_spread_is_finite_and_differs(line):
+    out = energy_spread.scan(*line, spread=energy_spread.gaussian(1e-2))
+    for name in ['sigx', 'sigy', 'rho']:
+        assert np.all(np.isfinite(out[name]))
+    assert np.max(np.abs(out['rho']/out['mono_rho'] - 1)) > 1e-3
+
+
+def test_non_finite_pdf_raises():
+    spread = energy_spread.Spread(lambda delta: np.full_like(delta, np.nan), -1e-2, 1e-2, 1e-2)
+    with pytest.raises(ValueError):
+        energy_spread.kernel(spread, 1e-3)
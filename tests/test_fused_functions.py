@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+import common_functions as cf
+import fused_functions as ff
+
+
+@pytest.mark.parametrize('dtype, rtol', [(np.float64, 1e-12), (np.float32, 1e-5)])
+def test_matches_common_functions(dtype, rtol):
+    for name, err in ff.check(n=20000, dtype=dtype).items():
+        assert err < rtol, name
+
+
+def _inputs(n=1000, seed=1):
+    rng = np.random.RandomState(seed)
+    return dict(
+            sigma     = np.power(10.0, rng.uniform(-10, -1, n)),
+            SE        = rng.uniform(0.5, 2.0, n)*1.75e9/1e-12*4*np.pi,
+            N         = rng.uniform(1.0, 16.0, n),
+            mag       = -np.power(10.0, rng.uniform(-2, 0.5, n)),
+            px_length = rng.uniform(2e-6, 2e-5, n),
+            QE        = rng.uniform(0.1, 0.9, n),
+            f         = rng.uniform(10e-3, 100e-3, n),
+            o         = rng.uniform(0.1, 2.0, n),
+            h_img     = -rng.uniform(1e-3, 30e-3, n)
+            )
+
+
+_kernels = [
+        (ff.counts_fused   , cf.counts   , ['sigma', 'SE', 'N', 'mag', 'px_length', 'QE']),
+        (ff.ap_fr_mag_fused, cf.ap_fr_mag, ['N', 'mag']),
+        (ff.ap_fr_fused    , cf.ap_fr    , ['f', 'N', 'o']),
+        (ff.h_obj_fused    , lambda h_img, o, f: cf.h_obj(h_img=h_img, o=o, f=f), ['h_img', 'o', 'f'])
+        ]
+
+
+# Every input in turn passed as out=
+@pytest.mark.parametrize('fused, ref, names', _kernels)
+def test_out_aliasing_an_input(fused, ref, names):
+    inputs = _inputs()
+    expect = ref(*[inputs[name] for name in names])
+    for alias in names:
+        args = [inputs[name].copy() for name in names]
+        out  = args[names.index(alias)]
+        res  = fused(*args, out=out)
+        assert res is out
+        np.testing.assert_allclose(res, expect, rtol=1e-12, err_msg=alias)
+
+
+def test_out_aliasing_a_view():
+    inputs = _inputs()
+    sigma  = inputs['sigma'].copy()
+    expect = cf.counts(inputs['sigma'][::2], inputs['SE'][::2], inputs['N'][::2], inputs['mag'][::2], inputs['px_length'][::2], inputs['QE'][::2])
+    res    = ff.counts_fused(sigma[::2], inputs['SE'][::2], inputs['N'][::2], inputs['mag'][::2], inputs['px_length'][::2], inputs['QE'][::2], out=sigma[::2])
+    np.testing.assert_allclose(res, expect, rtol=1e-12)
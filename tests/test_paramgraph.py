@@ -0,0 +1,35 @@
+import numpy as np
+import common_functions as cf
+import paramgraph
+
+
+def _graph():
+    graph = paramgraph.optics_graph(mag_input=True)
+    return graph.set(N=2.0, m=-0.04, px_length=6.5e-6, SE=1e10, QE=0.6)
+
+
+def test_counts_match_common_functions():
+    sigma = np.logspace(-10, -4, 100)
+    graph = _graph().set(sigma=sigma)
+    np.testing.assert_allclose(graph['counts'], cf.counts(sigma, 1e10, 2.0, -0.04, 6.5e-6, 0.6), rtol=1e-12)
+
+
+def test_scalar_values_hit_again():
+    graph = _graph().set(sigma=1e-6)
+    graph['counts']
+    graph.set(N=4.0)['counts']
+    misses = graph.misses
+    graph.set(N=2.0)['counts']
+    assert graph.misses == misses
+
+
+def test_superseded_large_arrays_are_dropped():
+    graph = _graph()
+    for i in range(20):
+        graph.set(sigma=np.full(1000, 1e-6*(i+1)))
+        graph['counts']
+    # Only the counts of the current sigma
+    # stay besides its scalar-keyed inputs
+    big = [value for value in graph.cache.values() if np.size(value) > paramgraph._SMALL]
+    assert len(big) == 1
+    np.testing.assert_allclose(big[0], cf.counts(2e-5, 1e10, 2.0, -0.04, 6.5e-6, 0.6), rtol=1e-12)
@@ -0,0 +1,56 @@
+import os
+import numpy as np
+import elegant_pool
+import results_store
+
+
+# Fails for energy 2 until a marker file
+# exists in *beamline*
+def sometimes_failing_job(beamline, energy_gamma, n_particles, sigma_dp, workdir):
+    if energy_gamma == 2.0 and not os.path.exists(os.path.join(beamline, 'fixed')):
+        raise RuntimeError('elegant failed')
+    return dict(sigx=energy_gamma, sigy=2*energy_gamma)
+
+
+def test_round_trip(tmp_path):
+    store  = results_store.ResultsStore(str(tmp_path / 'results'))
+    params = dict(energy=np.arange(3.0), label='a')
+    store.save('scan', dict(sigx=np.arange(6.0).reshape(3, 2), n=np.int64(3)), params=params)
+    assert store.matches('scan', params)
+    assert not store.matches('scan', dict(params, label='b'))
+    out = store.open('scan')
+    np.testing.assert_array_equal(out['sigx'], np.arange(6.0).reshape(3, 2))
+    assert out['n'] == 3
+
+
+def test_failed_job_not_cached(tmp_path):
+    store  = results_store.ResultsStore(str(tmp_path / 'results'))
+    params = dict(energy_list_gamma=[1.0, 2.0, 3.0])
+    calls  = []
+
+    def scan():
+        calls.append(1)
+        sigx, sigy = elegant_pool.run_scan(str(tmp_path), params['energy_list_gamma'], dir=str(tmp_path / 'runs'), retries=0, job=sometimes_failing_job)
+        return dict(sigx=sigx, sigy=sigy)
+
+    first = results_store.cached(store, 'scan', params, scan, finite=True)
+    assert np.isnan(first['sigx'][1])
+    assert 'scan' not in store
+
+    # Next run computes again and, with
+    # the job fixed, stores the result
+    open(str(tmp_path / 'fixed'), 'w').close()
+    second = results_store.cached(store, 'scan', params, scan, finite=True)
+    np.testing.assert_array_equal(second['sigx'], [1, 2, 3])
+    assert store.matches('scan', params)
+
+    third = results_store.cached(store, 'scan', params, scan, finite=True)
+    np.testing.assert_array_equal(third['sigx'], [1, 2, 3])
+    assert len(calls) == 2
+
+
+def test_non_finite_stored_by_default(tmp_path):
+    store  = results_store.ResultsStore(str(tmp_path / 'results'))
+    result = results_store.cached(store, 'grid', {}, lambda: dict(z=np.array([1.0, np.nan])))
+    assert 'grid' in store
+    assert np.isnan(result['z'][1])
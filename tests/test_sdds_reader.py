@@ -0,0 +1,152 @@
+import collections
+import struct
+import numpy as np
+import pytest
+import sdds_reader
+
+_names = ['x', 'xp', 'y', 'yp', 't', 'p']
+
+
+# ====================================
+# Generated fixtures
+# ====================================
+def _bunch(n, seed):
+    rng  = np.random.default_rng(seed)
+    cols = collections.OrderedDict((name, rng.standard_normal(n)) for name in _names)
+    cols['p'] = 4e4*(1+1e-3*cols['p'])
+    return cols
+
+
+# Another page in the layout write_binary
+# uses (pCentral, Step parameters)
+def _binary_page(cols, pCentral, step):
+    rows = np.empty(len(cols['x']), dtype=[(name, '<f8') for name in _names])
+    for name in _names:
+        rows[name] = cols[name]
+    return struct.pack('<i', rows.size) + struct.pack('<d', pCentral) + struct.pack('<d', step) + rows.tobytes()
+
+
+def _ascii(path, pages, row_counts=True):
+    with open(path, 'w') as f:
+        f.write('SDDS1\n&parameter name=pCentral, type=double, &end\n')
+        for name in _names:
+            f.write('&column name={}, type=double, &end\n'.format(name))
+        f.write('&data mode=ascii, {}&end\n'.format('' if row_counts else 'no_row_counts=1, '))
+        for cols, pCentral in pages:
+            f.write('! page\n{!r}\n'.format(pCentral))
+            if row_counts:
+                f.write('{}\n'.format(len(cols['x'])))
+            for i in range(len(cols['x'])):
+                f.write(' '.join(repr(float(cols[name][i])) for name in _names) + '\n')
+            if not row_counts:
+                f.write('\n')
+
+
+@pytest.fixture
+def binary(tmp_path):
+    first, second = _bunch(1000, 0), _bunch(500, 1)
+    path = str(tmp_path / 'bunch.out')
+    sdds_reader.write_binary(path, first, parameters=collections.OrderedDict([('pCentral', 4e4), ('Step', 1.0)]))
+    with open(path, 'ab') as f:
+        f.write(_binary_page(second, 5e4, 2.0))
+    return path, [first, second]
+
+
+@pytest.fixture(params=[True, False], ids=['row_counts', 'no_row_counts'])
+def ascii(tmp_path, request):
+    first, second = _bunch(300, 2), _bunch(120, 3)
+    path = str(tmp_path / 'bunch.sdds')
+    _ascii(path, [(first, 4e4), (second, 5e4)], row_counts=request.param)
+    return path, [first, second]
+
+
+# ====================================
+# Tests
+# ====================================
+def test_binary_pages(binary):
+    path, pages = binary
+    reader = sdds_reader.SDDSReader(path)
+    assert reader.binary
+    assert [page.rows for page in reader.pages] == [1000, 500]
+    assert [float(page.parameters['pCentral']) for page in reader.pages] == [4e4, 5e4]
+    for i, cols in enumerate(pages):
+        out = reader.read(page=i)
+        for name in _names:
+            np.testing.assert_array_equal(out[name], cols[name])
+
+
+def test_binary_columns_are_memory_mapped(binary):
+    path, pages = binary
+    x = sdds_reader.SDDSReader(path).column('x', page=1)
+    assert isinstance(x, np.memmap)
+    np.testing.assert_array_equal(x, pages[1]['x'])
+
+
+def test_ascii_pages(ascii):
+    path, pages = ascii
+    reader = sdds_reader.SDDSReader(path)
+    assert not reader.binary
+    assert [page.rows for page in reader.pages] == [300, 120]
+    assert [float(page.parameters['pCentral']) for page in reader.pages] == [4e4, 5e4]
+    for i, cols in enumerate(pages):
+        out = reader.read(['x', 'p'], page=i)
+        assert sorted(out) == ['p', 'x']
+        np.testing.assert_array_equal(out['x'], cols['x'])
+        np.testing.assert_array_equal(out['p'], cols['p'])
+
+
+@pytest.mark.parametrize('rows', [(10, 20), (250, 1000), (5, 5), slice(5, 50, 5), slice(None, None, 7)])
+def test_row_slices(binary, ascii, rows):
+    for path, pages in [binary, ascii]:
+        reader   = sdds_reader.SDDSReader(path)
+        expected = pages[0]['y'][slice(*rows) if isinstance(rows, tuple) else rows]
+        np.testing.assert_array_equal(reader.column('y', rows=rows), expected)
+
+
+def test_stream_matches_random_access(binary, ascii):
+    for path, pages in [binary, ascii]:
+        reader = sdds_reader.SDDSReader(path)
+        chunks = collections.defaultdict(list)
+        for page, _, cols in reader.iter_chunks(['x'], chunksize=128):
+            chunks[page].append(cols['x'])
+        for page, cols in enumerate(pages):
+            np.testing.assert_array_equal(np.concatenate(chunks[page]), cols['x'])
+
+
+# elegant writes a page of 0 rows when every
+# particle is lost
+def test_empty_ascii_page(tmp_path):
+    full = _bunch(3, 4)
+    path = str(tmp_path / 'empty.sdds')
+    _ascii(path, [(_bunch(0, 5), 4e4), (full, 5e4)])
+    reader = sdds_reader.SDDSReader(path)
+    assert [page.rows for page in reader.pages] == [0, 3]
+    assert [float(page.parameters['pCentral']) for page in reader.pages] == [4e4, 5e4]
+    assert reader.column('x', page=0).size == 0
+    np.testing.assert_array_equal(reader.column('x', page=1), full['x'])
+    chunks = [(page, cols['x']) for page, _, cols in reader.iter_chunks(['x'])]
+    assert len(chunks) == 1 and chunks[0][0] == 1
+
+
+def test_errors(binary):
+    reader = sdds_reader.SDDSReader(binary[0])
+    with pytest.raises(KeyError):
+        reader.read(['nope'])
+    with pytest.raises(IndexError):
+        reader.read(page=2)
+
+
+def test_lazy_elegant_sim(binary, tmp_path):
+    path, pages = binary
+    sim   = sdds_reader.LazyElegantSim(str(tmp_path / 'bunch.ele'))
+    bunch = sim.Bunch
+    assert sim.particle_file == path
+    assert len(bunch) == 1000
+    np.testing.assert_array_equal(bunch.x, pages[0]['x'])
+    np.testing.assert_allclose(bunch.delta, pages[0]['p']/4e4 - 1, rtol=1e-12)
+
+    # Second page, relative to its own pCentral
+    bunch = sdds_reader.LazyElegantSim(str(tmp_path / 'bunch.ele'), page=1).Bunch
+    np.testing.assert_allclose(bunch.delta, pages[1]['p']/5e4 - 1, rtol=1e-12)
+    with pytest.raises(AttributeError):
+        bunch.nope
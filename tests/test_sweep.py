@@ -0,0 +1,16 @@
+import warnings
+import numpy as np
+import sweep
+
+
+def test_iso_contour_circle_without_warnings():
+    x = np.linspace(-2, 2, 81)
+    y = np.linspace(-2, 2, 61)
+    # Flat regions give 0/0 on edges that
+    # are not crossed
+    Z = np.minimum(np.hypot(x[np.newaxis, :], y[:, np.newaxis]), 1.5)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        segments = sweep.iso_contour(x, y, Z, 1.0)
+    assert len(segments) > 0
+    np.testing.assert_allclose(np.hypot(segments[..., 0], segments[..., 1]), 1.0, atol=2e-3)
@@ -0,0 +1,21 @@
+import numpy as np
+import elegant_pool
+import tracker
+import twiss_batch
+
+
+# The tracker through the elegant pool gives
+# the Twiss spot sizes up to sampling error,
+# about 1/sqrt(2n) relative for a std
+def test_run_scan_matches_beam_end(tmp_path, beamline):
+    n     = 20000
+    gamma = np.array([0.8, 1.0, 1.25])*beamline.gamma
+    sigx, sigy = elegant_pool.run_scan(beamline, gamma, n_particles=n, sigma_dp=0, dir=str(tmp_path), max_workers=2, job=tracker.tracker_job)
+
+    table = twiss_batch.element_table(beamline.elements)
+    ref_x, ref_y, _ = twiss_batch.beam_end(table, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y)
+    tol = 5/np.sqrt(2*n)
+    np.testing.assert_allclose(sigx, ref_x, rtol=tol)
+    np.testing.assert_allclose(sigy, ref_y, rtol=tol)
+    # Run directories are cleaned up
+    assert not any(tmp_path.iterdir())
@@ -0,0 +1,164 @@
+import numpy as np
+import pytest
+import lattice
+import quad_scan
+import twiss_batch
+
+
+def _record(kind, length, **fields):
+    rec = np.zeros((), dtype=twiss_batch.element_dtype)
+    rec['type']   = kind
+    rec['length'] = length
+    for name, value in fields.items():
+        rec[name] = value
+    return rec
+
+
+def _plane(R11, R12, R21, R22, R13=0.0, R23=0.0):
+    return np.array([[R11, R12, R13], [R21, R22, R23], [0, 0, 1]])
+
+
+# ====================================
+# Element matrices against closed form
+# ====================================
+def test_drift():
+    Rx, Ry = twiss_batch.element_matrices(_record(twiss_batch.DRIFT, 2.5))
+    np.testing.assert_allclose(Rx, _plane(1, 2.5, 0, 1), atol=1e-15)
+    np.testing.assert_allclose(Ry, _plane(1, 2.5, 0, 1), atol=1e-15)
+
+
+@pytest.mark.parametrize('K1', [0.8, -0.8])
+def test_quad(K1):
+    L  = 0.46
+    k  = np.sqrt(abs(K1))
+    foc = _plane(np.cos(k*L), np.sin(k*L)/k, -k*np.sin(k*L), np.cos(k*L))
+    dfc = _plane(np.cosh(k*L), np.sinh(k*L)/k, k*np.sinh(k*L), np.cosh(k*L))
+    Rx, Ry = twiss_batch.element_matrices(_record(twiss_batch.QUAD, L, K1=K1))
+    np.testing.assert_allclose(Rx, foc if K1 > 0 else dfc, rtol=1e-14, atol=1e-15)
+    np.testing.assert_allclose(Ry, dfc if K1 > 0 else foc, rtol=1e-14, atol=1e-15)
+
+
+def test_quad_energy_scaling():
+    rec  = _record(twiss_batch.QUAD, 1.0, K1=0.36)
+    Rx, _ = twiss_batch.element_matrices(rec, scale=0.5)
+    ref, _ = twiss_batch.element_matrices(_record(twiss_batch.QUAD, 1.0, K1=0.18))
+    np.testing.assert_allclose(Rx, ref, rtol=1e-14)
+
+
+# Sector bend: bending plane with dispersion
+# rho*(1-cos), sin; the other plane a drift
+@pytest.mark.parametrize('rotate', [0, 90])
+def test_bend(rotate):
+    L, theta = 0.9779, 6e-3
+    rho  = L/theta
+    bend = _plane(np.cos(theta), rho*np.sin(theta), -np.sin(theta)/rho, np.cos(theta), rho*(1-np.cos(theta)), np.sin(theta))
+    drift = _plane(1, L, 0, 1)
+    Rx, Ry = twiss_batch.element_matrices(_record(twiss_batch.BEND, L, angle=theta, rotate=rotate))
+    if rotate == 90:
+        Rx, Ry = Ry, Rx
+    np.testing.assert_allclose(Rx, bend, rtol=1e-12, atol=1e-15)
+    # Unbent plane goes through the small-k guard
+    np.testing.assert_allclose(Ry, drift, rtol=1e-12, atol=1e-10)
+
+
+def test_bend_edges():
+    L, theta, E = 0.9779, 6e-3, 3e-3
+    h    = theta/L
+    rec  = _record(twiss_batch.BEND, L, angle=theta, EDGE1=1, E1=E, EDGE2=1, E2=E)
+    Rx, Ry = twiss_batch.element_matrices(rec, edges=True)
+    Bx, By = twiss_batch.element_matrices(rec)
+    edge_x = _plane(1, 0, h*np.tan(E), 1)
+    edge_y = _plane(1, 0, -h*np.tan(E), 1)
+    np.testing.assert_allclose(Rx, edge_x.dot(Bx).dot(edge_x), rtol=1e-12, atol=1e-18)
+    np.testing.assert_allclose(Ry, edge_y.dot(By).dot(edge_y), rtol=1e-12, atol=1e-18)
+
+
+# ====================================
+# Beamline transfer
+# ====================================
+def test_transfer_is_product_of_elements(beamline):
+    table  = twiss_batch.element_table(beamline.elements)
+    scale  = np.array([0.5, 1.0, 2.0])
+    Mx, My = twiss_batch.transfer_matrices(table, scale)
+    for j, s in enumerate(scale):
+        Px, Py = np.eye(3), np.eye(3)
+        for rec in table:
+            Rx, Ry = twiss_batch.element_matrices(rec, s)
+            Px, Py = Rx.dot(Px), Ry.dot(Py)
+        np.testing.assert_allclose(Mx[j], Px, rtol=1e-13, atol=1e-15)
+        np.testing.assert_allclose(My[j], Py, rtol=1e-13, atol=1e-15)
+
+
+def _rebuilt(table, gamma0, gamma, beam_x, beam_y, i, field, values):
+    out = []
+    for value in values:
+        changed = table.copy()
+        changed[i][field] = value
+        out.append(twiss_batch.beam_end(changed, gamma0, gamma, beam_x, beam_y))
+    return [np.array(res) for res in zip(*out)]
+
+
+@pytest.mark.parametrize('i, field, values', [
+    (4, 'K1', [0.30, 0.36, 0.42]),
+    (1, 'K1', [-0.9, -0.84]),
+    (5, 'length', [3.5, 4.0, 4.5]),
+    (8, 'length', [0.9, 1.0])
+    ])
+def test_overrides_match_rebuilt_table(beamline, i, field, values):
+    table = twiss_batch.element_table(beamline.elements)
+    gamma = np.linspace(0.5, 2.0, 7)*beamline.gamma
+    values = np.array(values)
+    over  = {i: {field: values[:, np.newaxis]}}
+    got   = twiss_batch.beam_end(table, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y, overrides=over)
+    ref   = _rebuilt(table, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y, i, field, values)
+    for g, r in zip(got, ref):
+        np.testing.assert_allclose(g, r, rtol=1e-12)
+
+
+# ====================================
+# Consumers agree with beam_end
+# ====================================
+def test_lattice_scan(beamline):
+    table  = twiss_batch.element_table(beamline.elements)
+    design = lattice.Lattice.from_beamline(beamline)
+    gamma  = np.linspace(0.5, 2.0, 7)*beamline.gamma
+    variant = design.with_K1('QS1', 0.4).with_length('LQS12QS2', 3.8)
+
+    changed = table.copy()
+    changed[4]['K1'], changed[5]['length'] = 0.4, 3.8
+    ref = twiss_batch.beam_end(changed, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y)
+    for g, r in zip(variant.scan(gamma), ref):
+        np.testing.assert_allclose(g, r, rtol=1e-12)
+
+    # One energy through the cached products
+    for g, r in zip(variant.with_gamma(gamma[2]).beam_end(), ref):
+        np.testing.assert_allclose(g, r[2], rtol=1e-12)
+
+
+def test_quad_scan(beamline):
+    table = twiss_batch.element_table(beamline.elements)
+    scan  = quad_scan.QuadScan.from_beamline(beamline)
+    gamma = np.linspace(0.5, 2.0, 5)*beamline.gamma
+    K1    = quad_scan.grid(*[K*np.array([0.9, 1.1]) for K in scan.K1])
+    out   = scan.scan(K1, gamma, derivatives=True)
+
+    for n, setting in enumerate(K1):
+        changed = table.copy()
+        for i, K in zip(scan.quads, setting):
+            changed[i]['K1'] = K
+        sigx, sigy, rho = twiss_batch.beam_end(changed, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y)
+        np.testing.assert_allclose(out['sigx'][n], sigx, rtol=1e-12)
+        np.testing.assert_allclose(out['sigy'][n], sigy, rtol=1e-12)
+        np.testing.assert_allclose(out['rho'][n], rho, rtol=1e-12)
+
+    # d(rho)/d(K1) of QS1 against a wider
+    # central difference through beam_end
+    h   = 1e-5
+    rho = []
+    for sign in [1, -1]:
+        changed = table.copy()
+        for i, K in zip(scan.quads, K1[0]):
+            changed[i]['K1'] = K
+        changed[scan.quads[1]]['K1'] += sign*h
+        rho.append(twiss_batch.beam_end(changed, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y)[2])
+    np.testing.assert_allclose(out['drho'][0, 1], (rho[0]-rho[1])/(2*h), rtol=1e-5)
@@ -0,0 +1,32 @@
+import numpy as np
+import uncertainty
+
+
+def test_quantiles_match_numpy():
+    x    = np.random.default_rng(0).lognormal(0, 1, 10**6)
+    hist = uncertainty.LogHistogram()
+    for chunk in np.array_split(x, 8):
+        hist.update(chunk)
+    q = [0.025, 0.5, 0.975]
+    np.testing.assert_allclose(hist.quantile(q), np.quantile(x, q), rtol=2*hist.resolution)
+
+
+def test_nonpositive_samples_count():
+    # A Normal crossing zero: about 5% <= 0
+    x    = np.random.default_rng(1).normal(1.0, 0.6, 10**6)
+    hist = uncertainty.LogHistogram()
+    for chunk in np.array_split(x, 8):
+        hist.update(chunk)
+    assert hist.n == x.size
+    assert hist.nonpositive == np.count_nonzero(x <= 0)
+
+    low, med, high = hist.quantile([0.025, 0.5, 0.975])
+    assert np.isnan(low)
+    np.testing.assert_allclose([med, high], np.quantile(x, [0.5, 0.975]), rtol=2*hist.resolution)
+
+
+def test_propagate_fixed_inputs():
+    inputs = dict(SE=1e10, N=2.0, mag=-0.5, px_length=6.5e-6, QE=0.6, counts_max=3e4)
+    hists  = uncertainty.propagate(inputs, fills=dict(peak=1e-3), n=1000, seed=0)
+    expect = 1e-3*1e10*0.6*np.square(6.5e-6/(4*2.0*(-0.5-1)))/3e4
+    np.testing.assert_allclose(uncertainty.band(hists['peak'])['median'], expect, rtol=1e-12)
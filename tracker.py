@@ -0,0 +1,187 @@
+import numpy as np
+import os
+import bunch_stats
+import sdds_reader
+import twiss_batch
+
+
+# ====================================
+# Particle ensembles
+# ====================================
+# Same attribute names as ElegantPy's
+# ElegantSim.Bunch, so code written against
+# ESim.Bunch (e.g. the hist2d block in
+# my.py) takes either.
+class Bunch(object):
+    def __init__(self, x, xp, y, yp, delta, gamma, t=None):
+        self.x     = x
+        self.xp    = xp
+        self.y     = y
+        self.yp    = yp
+        self.delta = delta
+        self.gamma = gamma
+        self.t     = np.zeros_like(x) if t is None else t
+
+    @property
+    def p(self):
+        return self.gamma*(1+self.delta)
+
+    def __len__(self):
+        return len(self.x)
+
+    def columns(self):
+        return dict(x=self.x, xp=self.xp, y=self.y, yp=self.yp, t=self.t, p=self.p)
+
+
+# Matched Gaussian ensemble from Twiss
+# parameters (objects with beta, alpha,
+# emit, e.g. sltr.BeamParams)
+def gaussian_bunch(n, beam_x, beam_y, sigma_dp=0, gamma=1.0, rng=None):
+    rng = np.random.default_rng(rng)
+    n   = int(n)
+
+    def plane(beam):
+        u1 = rng.standard_normal(n)
+        u2 = rng.standard_normal(n)
+        u  = np.sqrt(beam.emit*beam.beta)*u1
+        up = np.sqrt(beam.emit/beam.beta)*(u2 - beam.alpha*u1)
+        return u, up
+
+    x, xp = plane(beam_x)
+    y, yp = plane(beam_y)
+    delta = sigma_dp*rng.standard_normal(n) if sigma_dp else np.zeros(n)
+    return Bunch(x, xp, y, yp, delta, gamma)
+
+
+# ====================================
+# Linear tracker
+# ====================================
+# Pushes particles through the 3x3 plane
+# maps of twiss_batch ([u, u', delta]).
+# order=1 uses the map at the reference
+# energy (dispersion included); order=2 adds
+# the chromatic term delta*dM/ddelta, the
+# map's first derivative in momentum,
+# taken by central difference in the
+# energy scale.
+class Tracker(object):
+    def __init__(self, table, gamma0, order=1, edges=False, h=1e-6):
+        if order not in (1, 2):
+            raise ValueError('order must be 1 or 2')
+        self.table  = table
+        self.gamma0 = gamma0
+        self.order  = order
+        self.edges  = edges
+        self.h      = h
+
+    @classmethod
+    def from_beamline(cls, beamline, **kwargs):
+        return cls(twiss_batch.element_table(beamline.elements), beamline.gamma, **kwargs)
+
+    # Maps at each reference energy, (E, 3, 3)
+    # for gamma of shape (E,)
+    def maps(self, gamma):
+        scale  = self.gamma0/np.asarray(gamma, dtype=np.float64)
+        Mx, My = twiss_batch.transfer_matrices(self.table, scale, edges=self.edges)
+        if self.order == 1:
+            return Mx, My, None, None
+        # delta lowers the scale: s/(1+d) ~ s(1-d)
+        Mxp, Myp = twiss_batch.transfer_matrices(self.table, scale*(1-self.h), edges=self.edges)
+        Mxm, Mym = twiss_batch.transfer_matrices(self.table, scale*(1+self.h), edges=self.edges)
+        return Mx, My, (Mxp-Mxm)/(2*self.h), (Myp-Mym)/(2*self.h)
+
+    @staticmethod
+    def _apply(M, dM, u, up, delta):
+        # M, dM broadcast against the particles
+        u_out  = M[..., 0, 0]*u + M[..., 0, 1]*up + M[..., 0, 2]*delta
+        up_out = M[..., 1, 0]*u + M[..., 1, 1]*up + M[..., 1, 2]*delta
+        if dM is not None:
+            u_out  += delta*(dM[..., 0, 0]*u + dM[..., 0, 1]*up + dM[..., 0, 2]*delta)
+            up_out += delta*(dM[..., 1, 0]*u + dM[..., 1, 1]*up + dM[..., 1, 2]*delta)
+        return u_out, up_out
+
+    # One energy: returns the tracked Bunch
+    def track(self, bunch, gamma):
+        Mx, My, dMx, dMy = self.maps(np.array([gamma]))
+        x, xp = self._apply(Mx[0], None if dMx is None else dMx[0], bunch.x, bunch.xp, bunch.delta)
+        y, yp = self._apply(My[0], None if dMy is None else dMy[0], bunch.y, bunch.yp, bunch.delta)
+        return Bunch(x, xp, y, yp, bunch.delta, gamma, t=bunch.t)
+
+    # Many energies at once. The maps are
+    # linear in (u, u', delta), so the centroid
+    # and RMS size at every energy follow from
+    # moments of the ensemble, collected once
+    # a chunk of particles at a time:
+    #   <v>, <delta v>, <v v>, <delta v v>,
+    #   <delta^2 v v>
+    # with v = (u, u', delta). The result is
+    # what tracking every particle at every
+    # energy gives, at the cost of one pass.
+    @staticmethod
+    def _moments(u, up, delta, chunksize):
+        m0 = np.zeros(3)
+        m1 = np.zeros(3)
+        S  = np.zeros((3, 3, 3))
+        for start in range(0, len(u), chunksize):
+            sl = slice(start, start+chunksize)
+            v  = np.array([u[sl], up[sl], delta[sl]], dtype=np.float64)
+            d  = v[2]
+            m0 += v.sum(axis=1)
+            m1 += np.dot(v, d)
+            for k, w in enumerate([None, d, d*d]):
+                vw = v if w is None else v*w
+                S[k] += np.dot(vw, v.T)
+        n = float(len(u))
+        return m0/n, m1/n, S/n
+
+    @staticmethod
+    def _plane_stats(M, dM, moments):
+        m0, m1, S = moments
+        a = M[:, 0, :]
+        mean = np.dot(a, m0)
+        sq   = np.einsum('ei,ij,ej->e', a, S[0], a)
+        if dM is not None:
+            b = dM[:, 0, :]
+            mean += np.dot(b, m1)
+            sq   += 2*np.einsum('ei,ij,ej->e', a, S[1], b) + np.einsum('ei,ij,ej->e', b, S[2], b)
+        return mean, np.sqrt(np.maximum(sq - np.square(mean), 0))
+
+    # Returns arrays over the energies *gamma*
+    # for one ensemble (coordinates relative to
+    # each reference energy)
+    def scan(self, bunch, gamma, chunksize=2**20):
+        gamma = np.atleast_1d(np.asarray(gamma, dtype=np.float64))
+        Mx, My, dMx, dMy = self.maps(gamma)
+        mean_x, sigx = self._plane_stats(Mx, dMx, self._moments(bunch.x, bunch.xp, bunch.delta, chunksize))
+        mean_y, sigy = self._plane_stats(My, dMy, self._moments(bunch.y, bunch.yp, bunch.delta, chunksize))
+        return dict(sigx=sigx, sigy=sigy, mean_x=mean_x, mean_y=mean_y, rho=1.0/(sigx*sigy))
+
+
+# ====================================
+# elegant_pool job
+# ====================================
+# Drop-in for elegant_pool.elegant_job:
+# tracks a Gaussian bunch instead of running
+# elegant, writes the particle file in
+# elegant's layout and reduces it the same
+# way, so the whole elegant path can run
+# without the elegant binary.
+def tracker_job(beamline, energy_gamma, n_particles, sigma_dp, workdir, order=1, seed=0):
+    tracker = Tracker.from_beamline(beamline, order=order)
+    bunch   = gaussian_bunch(n_particles, beamline.beam_x, beamline.beam_y, sigma_dp, energy_gamma, rng=seed)
+    out     = tracker.track(bunch, energy_gamma)
+
+    particle_file = os.path.join(workdir, 'out.out')
+    columns = out.columns()
+    sdds_reader.write_binary(particle_file, dict((name, columns[name]) for name in ['x', 'xp', 'y', 'yp', 't', 'p']))
+
+    moments = bunch_stats.bunch_stats(particle_file)
+    return dict(
+            sigx          = moments.std('x'),
+            sigy          = moments.std('y'),
+            mean_x        = moments.mean[0],
+            mean_y        = moments.mean[2],
+            emit_x        = moments.emittance('x', 'xp'),
+            emit_y        = moments.emittance('y', 'yp'),
+            particle_file = particle_file
+            )
@@ -0,0 +1,205 @@
+import numpy as np
+
+
+# ====================================
+# Element records
+# ====================================
+# Element type codes
+DRIFT = 0
+QUAD  = 1
+BEND  = 2
+
+_type_codes = {'drift': DRIFT, 'quad': QUAD, 'bend': BEND}
+
+element_dtype = np.dtype([
+    ('type'   , 'i1'),
+    ('length' , 'f8'),
+    ('K1'     , 'f8'),
+    ('angle'  , 'f8'),
+    ('rotate' , 'f8'),
+    ('EDGE1'  , 'i1'),
+    ('E1'     , 'f8'),
+    ('EDGE2'  , 'i1'),
+    ('E2'     , 'f8'),
+    ('HGAP'   , 'f8'),
+    ('FINT'   , 'f8')
+    ])
+
+
+# Flatten a list of slactrac Drift/Quad/Bend
+# elements into a record array
+def element_table(element_list):
+    table = np.zeros(len(element_list), dtype=element_dtype)
+    for i, element in enumerate(element_list):
+        kind = _type_codes.get(element._type)
+        if kind is None:
+            raise NotImplementedError('Element type not handled: {}'.format(element._type))
+        kwargs = getattr(element, '_kwargs', {})
+        rec = table[i]
+        rec['type']   = kind
+        rec['length'] = element.length
+        if kind == QUAD:
+            rec['K1'] = element.K1
+        elif kind == BEND:
+            rec['angle']  = element.angle
+            rec['rotate'] = element.rotate
+            rec['EDGE1']  = kwargs.get('EDGE1_EFFECTS', 1)
+            rec['E1']     = kwargs.get('E1', 0)
+            rec['EDGE2']  = kwargs.get('EDGE2_EFFECTS', 1)
+            rec['E2']     = kwargs.get('E2', 0)
+            rec['HGAP']   = kwargs.get('HGAP', 0)
+            rec['FINT']   = kwargs.get('FINT', 0.5)
+    return table
+
+
+# ====================================
+# Batched 3x3 plane matrices
+# ====================================
+# Each transverse plane is carried as
+# [[R11, R12, R16],
+#  [R21, R22, R26],
+#  [  0,   0,   1]]
+# with any number of leading batch axes.
+def _eye(shape):
+    M = np.zeros(shape + (3, 3))
+    M[..., 0, 0] = M[..., 1, 1] = M[..., 2, 2] = 1.0
+    return M
+
+
+# Body of a focusing element with signed
+# strength k (k>0 focusing, k<0 defocusing)
+def _focus(k, L):
+    rtK   = np.sqrt(np.abs(k))
+    rtK_L = rtK*L
+    pos   = k > 0
+    neg   = k < 0
+    safe  = np.where(rtK == 0, 1.0, rtK)
+
+    C  = np.where(pos, np.cos(rtK_L), np.where(neg, np.cosh(rtK_L), 1.0))
+    S  = np.where(pos, np.sin(rtK_L)/safe, np.where(neg, np.sinh(rtK_L)/safe, L))
+    Cp = -k*S
+    return C, S, Cp
+
+
+def _plane(C, S, Cp, D=0.0, Dp=0.0):
+    shape = np.broadcast(C, S, Cp, D, Dp).shape
+    R = _eye(shape)
+    R[..., 0, 0] = C
+    R[..., 0, 1] = S
+    R[..., 1, 0] = Cp
+    R[..., 1, 1] = C
+    R[..., 0, 2] = D
+    R[..., 1, 2] = Dp
+    return R
+
+
+def _quad(L, K1):
+    Rx = _plane(*_focus(K1, L))
+    Ry = _plane(*_focus(-K1, L))
+    return Rx, Ry
+
+
+# Same small-angle guards as slactrac.bend.bendmat
+_small3 = pow(1e-16, 1./3.)
+
+
+def _bend(L, angle):
+    h  = angle/L
+    kx2 = np.square(h)
+    kx2 = np.where(np.sqrt(np.abs(kx2))*L < _small3, np.square(_small3/L), kx2)
+    ky2 = np.square(_small3/L)*np.ones_like(kx2)
+
+    cx, sx, cpx = _focus(kx2, L)
+    cy, sy, cpy = _focus(ky2, L)
+    Rx = _plane(cx, sx, cpx, D=-h*(cx-1)/kx2, Dp=sx*h)
+    Ry = _plane(cy, sy, cpy)
+    return Rx, Ry, h
+
+
+def _edge(h, E, HGAP, FINT):
+    psi = 2.0*FINT*HGAP*h*(1+np.square(np.sin(E)))/np.cos(E)
+    Rx = _plane(1.0, 0.0, h*np.tan(E))
+    Ry = _plane(1.0, 0.0, -h*np.tan(E-psi))
+    return Rx, Ry
+
+
+def element_matrices(rec, scale=1.0, K1=None, length=None, edges=False):
+    # *scale* is gamma_design/gamma, the factor
+    # slactrac's change_E applies to K1 and angle
+    scale  = np.asarray(scale, dtype=np.float64)
+    L      = rec['length'] if length is None else np.asarray(length, dtype=np.float64)
+    kind   = rec['type']
+
+    if kind == QUAD:
+        K1 = rec['K1'] if K1 is None else np.asarray(K1, dtype=np.float64)
+        return _quad(L, K1*scale)
+    elif kind == BEND and rec['angle'] != 0 and np.all(L != 0):
+        Rx, Ry, h = _bend(L, rec['angle']*scale)
+        if edges:
+            if rec['EDGE1']:
+                Ex, Ey = _edge(h, rec['E1'], rec['HGAP'], rec['FINT'])
+                Rx, Ry = np.matmul(Rx, Ex), np.matmul(Ry, Ey)
+            if rec['EDGE2']:
+                Ex, Ey = _edge(h, rec['E2'], rec['HGAP'], rec['FINT'])
+                Rx, Ry = np.matmul(Ex, Rx), np.matmul(Ey, Ry)
+        if rec['rotate'] == 90:
+            Rx, Ry = Ry, Rx
+        return Rx, Ry
+    else:
+        Rx = _plane(np.ones_like(L*scale), L, 0.0)
+        return Rx, Rx.copy()
+
+
+# ====================================
+# Beamline transfer matrices
+# ====================================
+# *overrides* maps element index to a dict
+# of 'K1'/'length' arrays, broadcast against
+# *scale* (used for quad and drift scans).
+def transfer_matrices(table, scale=1.0, overrides=None, edges=False):
+    scale     = np.asarray(scale, dtype=np.float64)
+    overrides = {} if overrides is None else overrides
+
+    shape = scale.shape
+    for over in overrides.values():
+        shape = np.broadcast(np.empty(shape), *over.values()).shape
+
+    Mx = _eye(shape)
+    My = _eye(shape)
+    for i, rec in enumerate(table):
+        over = overrides.get(i, {})
+        if rec['type'] == DRIFT and 'length' not in over:
+            # Energy independent: apply in place
+            L = rec['length']
+            Mx[..., 0, :] += L*Mx[..., 1, :]
+            My[..., 0, :] += L*My[..., 1, :]
+            continue
+        Rx, Ry = element_matrices(rec, scale, edges=edges, **over)
+        Mx = np.matmul(Rx, Mx)
+        My = np.matmul(Ry, My)
+    return Mx, My
+
+
+# ====================================
+# Twiss transport
+# ====================================
+def spotsize(M, beta, alpha, emit):
+    R11 = M[..., 0, 0]
+    R12 = M[..., 0, 1]
+    gamma_tw = (1+np.power(alpha, 2))/beta
+    return np.sqrt(emit*(R11*R11*beta - 2.0*R11*R12*alpha + R12*R12*gamma_tw))
+
+
+def beam_end(table, gamma0, gamma, beam_x, beam_y, overrides=None, edges=False):
+    scale  = gamma0/np.asarray(gamma, dtype=np.float64)
+    Mx, My = transfer_matrices(table, scale, overrides=overrides, edges=edges)
+    sigx   = spotsize(Mx, beam_x.beta, beam_x.alpha, beam_x.emit)
+    sigy   = spotsize(My, beam_y.beta, beam_y.alpha, beam_y.emit)
+    return sigx, sigy, 1.0/(sigx*sigy)
+
+
+# Batched replacement for deep-copying a
+# slactrac Beamline and setting its gamma
+def beamline_end(beamline, gamma, edges=False):
+    table = element_table(beamline.elements)
+    return beam_end(table, beamline.gamma, gamma, beamline.beam_x, beamline.beam_y, edges=edges)
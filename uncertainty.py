@@ -0,0 +1,170 @@
+import logging
+import numpy as np
+from fused_functions import counts_fused
+
+logger = logging.getLogger(__name__)
+
+# ====================================
+# Input distributions
+# ====================================
+# Each draws n samples from a
+# numpy Generator. Plain numbers passed as
+# inputs are held fixed.
+class Fixed(object):
+    def __init__(self, value):
+        self.value = value
+
+    def draw(self, rng, n):
+        return np.full(n, self.value, dtype=np.float64)
+
+
+class Normal(object):
+    def __init__(self, mean, std):
+        self.mean = mean
+        self.std  = std
+
+    def draw(self, rng, n):
+        return rng.normal(self.mean, self.std, n)
+
+
+# median times/divided by factor is one
+# standard deviation
+class LogNormal(object):
+    def __init__(self, median, factor):
+        self.median = median
+        self.factor = factor
+
+    def draw(self, rng, n):
+        return self.median*np.exp(np.log(self.factor)*rng.standard_normal(n))
+
+
+class Uniform(object):
+    def __init__(self, low, high):
+        self.low  = low
+        self.high = high
+
+    def draw(self, rng, n):
+        return rng.uniform(self.low, self.high, n)
+
+
+def _dist(value):
+    return value if hasattr(value, 'draw') else Fixed(value)
+
+
+# ====================================
+# Streaming quantiles
+# ====================================
+# Histogram on log-spaced bins, so memory is
+# fixed however many samples go in and
+# quantiles are good to a bin width
+# (relative). The range is taken from the
+# first update, padded by *pad* decades;
+# samples outside it land in under/overflow
+# and are reported via min/max.
+#
+# Samples <= 0 (e.g. a Normal input crossing
+# zero) have no place on the log grid. They
+# still count, in the underflow, so the
+# quantiles above them stay unbiased;
+# quantiles that fall among them come back
+# as NaN, and the first one is logged.
+class LogHistogram(object):
+    def __init__(self, bins=4096, lo=None, hi=None, pad=2.0):
+        self.bins        = bins
+        self.lo          = lo
+        self.hi          = hi
+        self.pad         = pad
+        self.counts      = np.zeros(bins+2, dtype=np.int64)
+        self.n           = 0
+        self.nonpositive = 0
+        self.min         = np.inf
+        self.max         = -np.inf
+
+    def update(self, values):
+        if values.size == 0:
+            return
+        self.min = min(self.min, values.min())
+        self.max = max(self.max, values.max())
+        self.n  += values.size
+
+        positive = values > 0
+        n_bad    = values.size - np.count_nonzero(positive)
+        if n_bad:
+            if not self.nonpositive:
+                logger.warning('{} of {} samples are <= 0; quantiles below them are NaN'.format(n_bad, values.size))
+            self.nonpositive += n_bad
+            self.counts[0]   += n_bad
+            values = values[positive]
+            if values.size == 0:
+                return
+
+        logv = np.log10(values)
+        if self.lo is None:
+            self.lo = np.floor(logv.min()) - self.pad
+            self.hi = np.ceil(logv.max()) + self.pad
+        index = np.floor((logv-self.lo)*(self.bins/(self.hi-self.lo))).astype(np.int64) + 1
+        np.clip(index, 0, self.bins+1, out=index)
+        self.counts += np.bincount(index, minlength=self.bins+2)
+
+    @property
+    def resolution(self):
+        return np.power(10.0, (self.hi-self.lo)/self.bins) - 1
+
+    def quantile(self, q):
+        q      = np.asarray(q, dtype=np.float64)
+        target = q*self.n
+        if self.lo is None:
+            return np.full(q.shape, np.nan)
+        edges = np.linspace(self.lo, self.hi, self.bins+1)
+        cdf   = np.cumsum(self.counts[1:-1]) + self.counts[0]
+        # Linear in log within a bin
+        i      = np.clip(np.searchsorted(cdf, target, side='left'), 0, self.bins-1)
+        below  = np.where(i > 0, cdf[i-1], self.counts[0])
+        inbin  = np.maximum(cdf[i]-below, 1)
+        frac   = np.clip((target-below)/inbin, 0, 1)
+        out    = np.power(10.0, edges[i] + frac*(edges[i+1]-edges[i]))
+        out    = np.clip(out, self.min, self.max)
+        return np.where(target < self.nonpositive, np.nan, out)
+
+
+# ====================================
+# Propagation through counts()
+# ====================================
+# inputs: SE, N, mag, px_length, QE and
+# counts_max (full well), each a number or a
+# distribution. fills maps a name to a beam
+# density (C/m^2) whose well-fill fraction
+# is wanted; levels maps a name to a fill
+# fraction whose beam density is wanted
+# (e.g. 1 for saturation). Samples are made
+# and reduced chunksize at a time.
+#
+# Returns name -> LogHistogram.
+def propagate(inputs, fills=None, levels=None, n=10**6, chunksize=2**18, seed=None, bins=4096):
+    fills  = {} if fills is None else fills
+    levels = {} if levels is None else levels
+    dists  = dict((name, _dist(inputs[name])) for name in ['SE', 'N', 'mag', 'px_length', 'QE', 'counts_max'])
+    hists  = dict((name, LogHistogram(bins=bins)) for name in list(fills)+list(levels))
+    rng    = np.random.default_rng(seed)
+
+    n    = int(n)
+    unit = np.empty(min(chunksize, n))
+    buf  = np.empty(min(chunksize, n))
+    for start in range(0, n, chunksize):
+        m    = min(chunksize, n-start)
+        draw = dict((name, dist.draw(rng, m)) for name, dist in dists.items())
+        # Well fraction per unit density
+        c1   = counts_fused(1.0, draw['SE'], draw['N'], draw['mag'], draw['px_length'], draw['QE'], out=unit[:m])
+        c1  /= draw['counts_max']
+        for name, sigma in fills.items():
+            hists[name].update(np.multiply(c1, sigma, out=buf[:m]))
+        for name, fill in levels.items():
+            hists[name].update(np.divide(fill, c1, out=buf[:m]))
+    return hists
+
+
+# Central interval and median from a
+# histogram, e.g. level=0.95 for 2.5%/97.5%
+def band(hist, level=0.95):
+    lo, med, hi = hist.quantile([0.5-level/2, 0.5, 0.5+level/2])
+    return dict(low=lo, median=med, high=hi)